@@ -0,0 +1,209 @@
+from datetime import date
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from psycopg import sql
+
+from queries import Resolver, filtro_values, fold_identifier, primary_filtro, qualified_table
+
+# Funções de agregação aceitas em `metrics=coluna:funcao`
+AGGREGATIONS = {'sum': 'SUM', 'avg': 'AVG', 'min': 'MIN', 'max': 'MAX', 'count': 'COUNT'}
+
+# Teto de linhas retornadas quando `limit` não é informado
+MAX_AGGREGATE_ROWS = 10000
+
+
+def get_dimensions(config: Dict[str, Any]) -> List[str]:
+    """Colunas pelas quais o sistema pode ser agrupado ou filtrado"""
+    dimensions = [config['date_col']]
+    if config['filtro_col']:
+        dimensions.append(config['filtro_col'])
+    for col in config.get('dimensions', []):
+        if col not in dimensions:
+            dimensions.append(col)
+    return dimensions
+
+
+def get_metrics(config: Dict[str, Any]) -> List[str]:
+    """Colunas numéricas que podem ser agregadas (padrão: kpi_cols)"""
+    return config.get('metrics', config['kpi_cols'])
+
+
+def parse_metric(spec: str, metrics: List[str], resolve: Resolver = fold_identifier) -> Tuple[sql.Composable, str, str]:
+    """Converte `coluna:funcao` em (expressão SQL, função, alias)"""
+    if spec == 'count':
+        return sql.SQL('COUNT(*)'), 'COUNT', 'count'
+
+    col, _, agg = spec.partition(':')
+    agg = (agg or 'sum').lower()
+    if col not in metrics:
+        raise HTTPException(status_code=400, detail=f"Métrica inválida: {col}")
+    if agg not in AGGREGATIONS:
+        raise HTTPException(status_code=400, detail=f"Agregação inválida: {agg}")
+    return sql.SQL("{}({})").format(sql.SQL(AGGREGATIONS[agg]), resolve(col)), AGGREGATIONS[agg], f"{col}_{agg}"
+
+
+def parse_filters(filters: List[str], dimensions: List[str]) -> Dict[str, List[str]]:
+    """Agrupa os filtros `coluna:valor` por coluna (valores repetidos viram ANY)"""
+    parsed: Dict[str, List[str]] = {}
+    for spec in filters:
+        col, sep, value = spec.partition(':')
+        if not sep or col not in dimensions:
+            raise HTTPException(status_code=400, detail=f"Filtro inválido: {spec}")
+        parsed.setdefault(col, []).append(value)
+    return parsed
+
+
+def build_where(
+    config: Dict[str, Any],
+    date_from: Optional[date],
+    date_to: Optional[date],
+    filters: Dict[str, List[str]],
+    resolve: Resolver = fold_identifier,
+) -> Tuple[sql.Composable, list]:
+    """Monta o WHERE com o filtro fixo do sistema, o intervalo de datas e os filtros de faceta.
+
+    Um filtro na própria `filtro_col` substitui o filtro fixo, desde que os
+    valores estejam entre os configurados em `filtro_val`.
+    """
+    conditions: List[sql.Composable] = []
+    params: list = []
+
+    filters = dict(filters)
+    if config['filtro_col']:
+        filtro_col = resolve(config['filtro_col'])
+        selected = filters.pop(config['filtro_col'], None)
+        if selected is None:
+            conditions.append(sql.SQL("{} = %s").format(filtro_col))
+            params.append(primary_filtro(config))
+        else:
+            invalid = [value for value in selected if value not in filtro_values(config)]
+            if invalid:
+                raise HTTPException(
+                    status_code=400, detail=f"Valor não permitido para {config['filtro_col']}: {', '.join(invalid)}"
+                )
+            conditions.append(sql.SQL("{} = ANY(%s)").format(filtro_col))
+            params.append(selected)
+    if date_from:
+        conditions.append(sql.SQL("{} >= %s").format(resolve(config['date_col'])))
+        params.append(date_from)
+    if date_to:
+        conditions.append(sql.SQL("{} <= %s").format(resolve(config['date_col'])))
+        params.append(date_to)
+    for col, values in filters.items():
+        conditions.append(sql.SQL("{}::text = ANY(%s)").format(resolve(col)))
+        params.append(values)
+
+    where_clause = sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL("")
+    return where_clause, params
+
+
+def build_aggregate_query(
+    config: Dict[str, Any],
+    group_by: List[str],
+    metrics: List[str],
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    filters: Optional[List[str]] = None,
+    order_by: Optional[str] = None,
+    limit: Optional[int] = None,
+    resolve: Resolver = fold_identifier,
+) -> Tuple[sql.Composed, list, List[str]]:
+    """Constrói a query de agregação (GROUP BY) a partir dos parâmetros da requisição.
+
+    Só aceita colunas declaradas no SISTEMAS_DB, resolvidas para a grafia real
+    pelo `resolve` do registry; valores sempre vão como parâmetros.
+    Retorna (query, parâmetros, nomes das colunas do resultado).
+    """
+    dimensions = get_dimensions(config)
+    for col in group_by:
+        if col not in dimensions:
+            raise HTTPException(status_code=400, detail=f"Dimensão inválida: {col}")
+    if not metrics:
+        raise HTTPException(status_code=400, detail="Informe ao menos uma métrica")
+
+    select_parts: List[sql.Composable] = [resolve(col) for col in group_by]
+    aliases = list(group_by)
+    for spec in metrics:
+        expression, _, alias = parse_metric(spec, get_metrics(config), resolve)
+        select_parts.append(sql.SQL("{} AS {}").format(expression, sql.Identifier(alias)))
+        aliases.append(alias)
+
+    where_clause, params = build_where(
+        config, date_from, date_to, parse_filters(filters or [], dimensions), resolve
+    )
+    group_clause = (
+        sql.SQL("GROUP BY {}").format(sql.SQL(", ").join(resolve(col) for col in group_by))
+        if group_by else sql.SQL("")
+    )
+
+    # Ordenação: `-alias` para decrescente; padrão é a data mais recente primeiro
+    if order_by:
+        descending = order_by.startswith('-')
+        order_col = order_by.lstrip('-')
+        if order_col not in aliases:
+            raise HTTPException(status_code=400, detail=f"Ordenação inválida: {order_by}")
+        order_expr = resolve(order_col) if order_col in group_by else sql.Identifier(order_col)
+        order_clause = sql.SQL("ORDER BY {} {} NULLS LAST").format(order_expr, sql.SQL('DESC' if descending else 'ASC'))
+    elif config['date_col'] in group_by:
+        order_clause = sql.SQL("ORDER BY {} DESC").format(resolve(config['date_col']))
+    else:
+        order_clause = sql.SQL("")
+
+    params.append(min(limit, MAX_AGGREGATE_ROWS) if limit else MAX_AGGREGATE_ROWS)
+    query = sql.SQL("""
+        SELECT {select}
+        FROM {table}
+        {where}
+        {group_by}
+        {order_by}
+        LIMIT %s
+    """).format(
+        select=sql.SQL(", ").join(select_parts),
+        table=qualified_table(config),
+        where=where_clause,
+        group_by=group_clause,
+        order_by=order_clause,
+    )
+    return query, params, aliases
+
+
+def build_facets_query(
+    config: Dict[str, Any],
+    facets: List[str],
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    resolve: Resolver = fold_identifier,
+) -> Tuple[sql.Composed, list]:
+    """Constrói uma única query com GROUPING SETS que lista os valores distintos de cada faceta"""
+    dimensions = get_dimensions(config)
+    for col in facets:
+        if col not in dimensions:
+            raise HTTPException(status_code=400, detail=f"Faceta inválida: {col}")
+
+    # As facetas listam todos os valores configurados do filtro fixo (os que podem ser filtrados)
+    filters = {config['filtro_col']: filtro_values(config)} if config['filtro_col'] else {}
+    where_clause, params = build_where(config, date_from, date_to, filters, resolve)
+    # Cada linha traz o índice da faceta (via GROUPING) e o valor convertido para texto
+    columns = [resolve(col) for col in facets]
+    facet_index = sql.SQL(" ").join(
+        sql.SQL("WHEN GROUPING({}) = 0 THEN {}").format(col, sql.Literal(i)) for i, col in enumerate(columns)
+    )
+    facet_value = sql.SQL(" ").join(
+        sql.SQL("WHEN GROUPING({0}) = 0 THEN {0}::text").format(col) for col in columns
+    )
+    grouping_sets = sql.SQL(", ").join(sql.SQL("({})").format(col) for col in columns)
+    query = sql.SQL("""
+        SELECT CASE {facet_index} END AS facet, CASE {facet_value} END AS value
+        FROM {table}
+        {where}
+        GROUP BY GROUPING SETS ({grouping_sets})
+        ORDER BY 1, 2
+    """).format(
+        facet_index=facet_index,
+        facet_value=facet_value,
+        table=qualified_table(config),
+        where=where_clause,
+        grouping_sets=grouping_sets,
+    )
+    return query, params
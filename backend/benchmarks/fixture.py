@@ -0,0 +1,277 @@
+"""Postgres local com o schema do SISTEMAS_DB e dados sintéticos, usado pelo benchmark.
+
+Nunca aponte para o banco de produção: as tabelas do `SISTEMAS_DB` são
+recriadas (DROP TABLE) antes da carga.
+"""
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+from typing import Any, Dict, List, Optional
+from urllib.parse import quote
+
+import psycopg
+from psycopg import sql
+from psycopg.conninfo import conninfo_to_dict, make_conninfo
+
+from aggregate import get_metrics
+from queries import filtro_values
+
+# Valores extras de filtro_col, além do filtro_val do sistema (simulam outras pipelines/workspaces)
+EXTRA_FILTER_VALUES = ['bench_1', 'bench_2']
+
+# Quantidade de valores distintos em cada coluna de dimensão
+DIMENSION_CARDINALITY = 50
+
+# Valores das dimensões usadas em queries customizadas (evolution)
+DIMENSION_VALUES = {
+    'conn_state_current': ['open', 'close', 'connecting'],
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_postgres(dsn: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with psycopg.connect(dsn, connect_timeout=2):
+                return
+        except psycopg.OperationalError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.5)
+
+
+class LocalPostgres:
+    """Sobe um Postgres descartável via `initdb`/`pg_ctl` ou pelo docker-compose.dev.yml.
+
+    No modo `external` usa um banco já existente (ex.: service container do CI)
+    informado por DSN.
+    """
+
+    def __init__(self, mode: str, pg_bin: Optional[str] = None, dsn: Optional[str] = None):
+        self.mode = mode
+        self.pg_bin = pg_bin
+        self.datadir: Optional[str] = None
+        self.host = '127.0.0.1'
+        self.port = 5432
+        self.dbname = 'dashboard-diario'
+        self.user = 'postgres'
+        self.password = 'postgres'
+        if dsn:
+            info = conninfo_to_dict(dsn)
+            self.host = info.get('host', self.host)
+            self.port = int(info.get('port', self.port))
+            self.dbname = info.get('dbname', self.dbname)
+            self.user = info.get('user', self.user)
+            self.password = info.get('password', '')
+
+    @property
+    def dsn(self) -> str:
+        return make_conninfo(host=self.host, port=self.port, dbname=self.dbname, user=self.user, password=self.password)
+
+    @property
+    def env(self) -> Dict[str, str]:
+        """Variáveis do config.py que apontam a API/manage.py para este banco.
+
+        O config.py monta uma URL, então host (diretório do socket), usuário
+        e senha vão escapados.
+        """
+        return {
+            'DB_HOST': quote(self.host, safe=''),
+            'DB_PORT': str(self.port),
+            'DB_NAME': self.dbname,
+            'DB_USER': quote(self.user, safe=''),
+            'DB_PASSWORD': quote(self.password, safe=''),
+        }
+
+    def _bin(self, name: str) -> str:
+        path = os.path.join(self.pg_bin, name) if self.pg_bin else shutil.which(name)
+        if not path:
+            raise RuntimeError(f"{name} não encontrado; informe --pg-bin ou use --postgres docker")
+        return path
+
+    def start(self) -> None:
+        if self.mode == 'external':
+            pass
+        elif self.mode == 'docker':
+            compose = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docker-compose.dev.yml')
+            subprocess.run(['docker', 'compose', '-f', compose, 'up', '-d'], check=True)
+        else:
+            self.datadir = tempfile.mkdtemp(prefix='kpi-bench-pg-')
+            self.port = free_port()
+            pwfile = os.path.join(self.datadir, 'pwfile')
+            os.makedirs(os.path.join(self.datadir, 'data'))
+            with open(pwfile, 'w') as f:
+                f.write(self.password)
+            subprocess.run(
+                [self._bin('initdb'), '-D', os.path.join(self.datadir, 'data'), '-U', self.user,
+                 f'--pwfile={pwfile}', '-A', 'md5', '--no-sync'],
+                check=True, stdout=subprocess.DEVNULL
+            )
+            subprocess.run(
+                [self._bin('pg_ctl'), '-D', os.path.join(self.datadir, 'data'), '-l', os.path.join(self.datadir, 'log'),
+                 '-o', f"-p {self.port} -k {self.datadir} -c listen_addresses=127.0.0.1 -c fsync=off", '-w', 'start'],
+                check=True, stdout=subprocess.DEVNULL
+            )
+            maintenance_dsn = make_conninfo(self.dsn, dbname='postgres')
+            wait_for_postgres(maintenance_dsn)
+            with psycopg.connect(maintenance_dsn, autocommit=True) as conn:
+                conn.execute(sql.SQL("CREATE DATABASE {}").format(sql.Identifier(self.dbname)))
+        wait_for_postgres(self.dsn)
+
+    def stop(self) -> None:
+        if self.mode != 'initdb':
+            return  # o container/banco externo fica de pé para reaproveitar a carga entre execuções
+        if self.datadir:
+            subprocess.run(
+                [self._bin('pg_ctl'), '-D', os.path.join(self.datadir, 'data'), '-m', 'fast', 'stop'],
+                check=False, stdout=subprocess.DEVNULL
+            )
+            shutil.rmtree(self.datadir, ignore_errors=True)
+
+
+def numeric_columns(config: Dict[str, Any]) -> List[str]:
+    # Em queries customizadas os kpi_cols são aliases calculados, não colunas
+    kpi_cols = config['kpi_cols'] if config['kpi_query_type'] != 'custom' else []
+    columns = [*kpi_cols, *get_metrics(config), *config.get('kpi_aggregations', {})]
+    if 'custom_series_query' not in config:
+        columns.append(config['chart_col'])
+    return list(dict.fromkeys(columns))
+
+
+def text_columns(config: Dict[str, Any]) -> List[str]:
+    columns = [config['filtro_col']] if config['filtro_col'] else []
+    return list(dict.fromkeys(columns + list(config.get('dimensions', []))))
+
+
+def build_seed_sql(config: Dict[str, Any], rows: int, days: int) -> List[sql.Composed]:
+    """DROP/CREATE da tabela do sistema e INSERT de `rows` linhas espalhadas em `days` dias"""
+    table = sql.SQL("{}.{}").format(sql.Identifier(config['schema']), sql.Identifier(config['tabela']))
+    texts = text_columns(config)
+    numerics = [col for col in numeric_columns(config) if col not in texts]
+    # Nomes sem aspas no Postgres viram minúsculas; o registry resolve a grafia no startup
+    ident = lambda name: sql.Identifier(name.lower())
+
+    definitions = [
+        sql.SQL("{} date NOT NULL").format(ident(config['date_col'])),
+        sql.SQL("{} timestamptz NOT NULL").format(ident(config['updated_col'])),
+        *(sql.SQL("{} text").format(ident(col)) for col in texts),
+        *(sql.SQL("{} numeric(14, 2)").format(ident(col)) for col in numerics),
+    ]
+
+    values = [
+        sql.SQL("current_date - (i % {})").format(sql.Literal(days)),
+        sql.SQL("(current_date - (i % {}))::timestamptz + random() * interval '1 day'").format(sql.Literal(days)),
+    ]
+    for col in texts:
+        if col == config['filtro_col']:
+            choices = [*filtro_values(config), *EXTRA_FILTER_VALUES]
+        else:
+            choices = DIMENSION_VALUES.get(col)
+        if choices:
+            values.append(sql.SQL("({}::text[])[1 + i % {}]").format(sql.Literal(choices), sql.Literal(len(choices))))
+        else:
+            values.append(sql.SQL("{} || (i % {})").format(sql.Literal(f"{col}_"), sql.Literal(DIMENSION_CARDINALITY)))
+    values.extend(sql.SQL("round((random() * 100)::numeric, 2)") for _ in numerics)
+
+    return [
+        sql.SQL("CREATE SCHEMA IF NOT EXISTS {}").format(sql.Identifier(config['schema'])),
+        sql.SQL("DROP TABLE IF EXISTS {}").format(table),
+        sql.SQL("CREATE TABLE {} ({})").format(table, sql.SQL(", ").join(definitions)),
+        sql.SQL("INSERT INTO {} SELECT {} FROM generate_series(0, {}) AS g(i)").format(
+            table, sql.SQL(", ").join(values), sql.Literal(rows - 1)
+        ),
+        sql.SQL("ANALYZE {}").format(table),
+    ]
+
+
+def seed(dsn: str, sistemas: Dict[str, Dict[str, Any]], rows: int, days: int) -> None:
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        for system, config in sistemas.items():
+            start = time.perf_counter()
+            for statement in build_seed_sql(config, rows, days):
+                conn.execute(statement)
+            print(f"  {system:<12} {rows} linhas em {time.perf_counter() - start:.1f}s")
+
+
+def seeded_rows(dsn: str, sistemas: Dict[str, Dict[str, Any]]) -> Optional[int]:
+    """Menor número de linhas entre as tabelas (None se alguma não existir), para reaproveitar a carga"""
+    counts = []
+    with psycopg.connect(dsn, autocommit=True) as conn:
+        for config in sistemas.values():
+            table = sql.SQL("{}.{}").format(sql.Identifier(config['schema']), sql.Identifier(config['tabela']))
+            try:
+                counts.append(conn.execute(sql.SQL("SELECT count(*) FROM {}").format(table)).fetchone()[0])
+            except psycopg.errors.UndefinedTable:
+                return None
+    return min(counts) if counts else None
+
+
+class RoundTripProxy:
+    """Proxy TCP entre a API e o Postgres que conta round trips e bytes trafegados.
+
+    Um round trip é contado cada vez que o cliente volta a enviar dados depois
+    de ter recebido uma resposta do servidor, então várias queries enviadas
+    juntas no pipeline mode contam como uma só.
+    """
+
+    def __init__(self, target_host: str, target_port: int):
+        self.target_host = target_host
+        self.target_port = target_port
+        self.port = free_port()
+        self.round_trips = 0
+        self.bytes_from_db = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._handle, '127.0.0.1', self.port)
+
+    async def stop(self) -> None:
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def snapshot(self) -> tuple:
+        return self.round_trips, self.bytes_from_db
+
+    async def _handle(self, client_reader, client_writer):
+        if self.target_host.startswith('/'):
+            # Socket unix (mesma convenção de diretório da libpq)
+            server_reader, server_writer = await asyncio.open_unix_connection(
+                os.path.join(self.target_host, f'.s.PGSQL.{self.target_port}')
+            )
+        else:
+            server_reader, server_writer = await asyncio.open_connection(self.target_host, self.target_port)
+        state = {'waiting': False}
+
+        async def client_to_server():
+            while data := await client_reader.read(65536):
+                if not state['waiting']:
+                    self.round_trips += 1
+                    state['waiting'] = True
+                server_writer.write(data)
+                await server_writer.drain()
+            server_writer.close()
+
+        async def server_to_client():
+            while data := await server_reader.read(65536):
+                state['waiting'] = False
+                self.bytes_from_db += len(data)
+                client_writer.write(data)
+                await client_writer.drain()
+            client_writer.close()
+
+        try:
+            await asyncio.gather(client_to_server(), server_to_client(), return_exceptions=True)
+        except asyncio.CancelledError:
+            server_writer.close()
+            client_writer.close()
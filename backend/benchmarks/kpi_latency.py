@@ -0,0 +1,81 @@
+"""Mede a latência de /api/kpis/* com e sem uma carga pesada de /api/detailed rodando em paralelo.
+
+Uso (com a API rodando):
+    python benchmarks/kpi_latency.py --base-url http://127.0.0.1:1644 --duration 20
+
+Para medir o banco e não o cache, suba a API com CACHE_TTL=0.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from typing import List
+
+import httpx
+
+SYSTEMS = ['piperun', 'n8n', 'conta_azul', 'cpj3c', 'meta_ads', 'google_ads', 'ti', 'liderhub', 'evolution']
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def kpi_worker(client: httpx.AsyncClient, deadline: float, latencies: List[float], offset: int):
+    i = offset
+    while time.perf_counter() < deadline:
+        system = SYSTEMS[i % len(SYSTEMS)]
+        start = time.perf_counter()
+        response = await client.get(f"/api/kpis/{system}")
+        latencies.append((time.perf_counter() - start) * 1000)
+        response.raise_for_status()
+        i += 1
+
+
+async def heavy_worker(client: httpx.AsyncClient, deadline: float, system: str):
+    while time.perf_counter() < deadline:
+        response = await client.get(f"/api/detailed/{system}")
+        response.raise_for_status()
+
+
+async def run_phase(base_url: str, duration: float, concurrency: int, heavy: int, heavy_system: str) -> List[float]:
+    latencies: List[float] = []
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=concurrency + heavy)
+    async with httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) as client:
+        tasks = [kpi_worker(client, deadline, latencies, i) for i in range(concurrency)]
+        tasks += [heavy_worker(client, deadline, heavy_system) for _ in range(heavy)]
+        await asyncio.gather(*tasks)
+    return latencies
+
+
+def report(label: str, latencies: List[float], duration: float):
+    print(
+        f"{label:<22} n={len(latencies):<6} "
+        f"p50={percentile(latencies, 50):8.1f}ms "
+        f"p95={percentile(latencies, 95):8.1f}ms "
+        f"p99={percentile(latencies, 99):8.1f}ms "
+        f"média={statistics.mean(latencies):8.1f}ms "
+        f"req/s={len(latencies) / duration:7.1f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', default='http://127.0.0.1:1644')
+    parser.add_argument('--duration', type=float, default=20, help='segundos por fase')
+    parser.add_argument('--concurrency', type=int, default=8, help='clientes consultando /api/kpis')
+    parser.add_argument('--heavy', type=int, default=2, help='clientes consultando /api/detailed em paralelo')
+    parser.add_argument('--heavy-system', default='meta_ads')
+    args = parser.parse_args()
+
+    idle = await run_phase(args.base_url, args.duration, args.concurrency, 0, args.heavy_system)
+    report("kpis (sem carga)", idle, args.duration)
+
+    loaded = await run_phase(args.base_url, args.duration, args.concurrency, args.heavy, args.heavy_system)
+    report(f"kpis (+{args.heavy} detailed)", loaded, args.duration)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,385 @@
+"""Benchmark de todos os endpoints contra um Postgres local com dados sintéticos.
+
+Sobe um Postgres descartável (initdb ou docker), cria as tabelas do
+SISTEMAS_DB, carrega `--rows` linhas por tabela, gera os rollups, sobe a API
+com uvicorn e dispara cada cenário com `--concurrency` clientes por
+`--duration` segundos. Reporta p50/p95/p99, req/s, round trips ao banco e
+bytes por resposta, e compara com a baseline salva (sai com código 1 se
+houver regressão).
+
+Uso:
+    pip install -r requirements-dev.txt
+    python benchmarks/suite.py --rows 100000 --save-baseline   # grava a baseline
+    python benchmarks/suite.py --rows 100000                   # compara com ela
+    python benchmarks/suite.py --postgres docker --rows 10000000 --reuse
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Any, Callable, Dict, List, Optional, Union
+
+import httpx
+import psycopg
+from psycopg import sql
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from fixture import (  # noqa: E402
+    DIMENSION_CARDINALITY, LocalPostgres, RoundTripProxy, free_port, numeric_columns, seed, seeded_rows, text_columns,
+)
+from kpi_latency import percentile  # noqa: E402
+from config import ROLLUP_SCHEMA  # noqa: E402
+from ingest import ingest_key  # noqa: E402
+from main import SISTEMAS_DB  # noqa: E402
+from queries import filtro_values  # noqa: E402
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines')
+
+SYSTEMS = list(SISTEMAS_DB)
+
+# Token passado à API para o cenário de ingestão
+INGEST_TOKEN = 'benchmark'
+
+# Linhas por carga no cenário de ingestão
+INGEST_ROWS = 200
+
+
+@dataclass
+class Call:
+    """Requisição de um cenário que não é um GET simples"""
+    path: str
+    method: str = 'GET'
+    body: Optional[bytes] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+    # SSE: mede até o primeiro evento (o snapshot inicial) e fecha a conexão
+    first_event: bool = False
+
+
+def range_series_systems() -> List[str]:
+    """Sistemas cuja série aceita intervalos mesmo sem rollups (sem `custom_series_query`)"""
+    return [system for system in SYSTEMS if 'custom_series_query' not in SISTEMAS_DB[system]]
+
+
+def ingest_systems() -> List[str]:
+    """Sistemas cuja chave de ingestão só usa colunas criadas pela carga sintética"""
+    systems = []
+    for system, config in SISTEMAS_DB.items():
+        seeded = {config['date_col'], *text_columns(config)}
+        if all(column in seeded for column in ingest_key(config)):
+            systems.append(system)
+    return systems
+
+
+def ingest_body(config: Dict[str, Any]) -> bytes:
+    """CSV com INGEST_ROWS linhas nos dias mais recentes (atualiza linhas da carga sintética e cria outras)"""
+    key = ingest_key(config)
+    numerics = [column for column in numeric_columns(config) if column not in key]
+    lines = [",".join(key + numerics)]
+    for i in range(INGEST_ROWS):
+        values = []
+        for column in key:
+            if column == config['date_col']:
+                values.append((date.today() - timedelta(days=i % 30)).isoformat())
+            elif column == config['filtro_col']:
+                values.append(filtro_values(config)[0])
+            else:
+                values.append(f"{column}_{i % DIMENSION_CARDINALITY}")
+        values.extend(f"{(i * 7) % 100}.50" for _ in numerics)
+        lines.append(",".join(values))
+    return ("\n".join(lines) + "\n").encode()
+
+
+def ingest_calls() -> List[Call]:
+    headers = {'Authorization': f"Bearer {INGEST_TOKEN}", 'Content-Type': 'text/csv'}
+    return [
+        Call(f"/api/ingest/{system}", 'POST', ingest_body(SISTEMAS_DB[system]), headers)
+        for system in ingest_systems()
+    ]
+
+
+# Cada cenário gera a lista de requisições (URL de um GET ou `Call`) que os clientes percorrem em rodízio.
+# A ingestão altera os dados e invalida os caches, por isso fica por último.
+SCENARIOS: Dict[str, Callable[[], List[Union[str, Call]]]] = {
+    'kpis': lambda: [f"/api/kpis/{system}" for system in SYSTEMS],
+    'series': lambda: [f"/api/series/{system}" for system in SYSTEMS],
+    'dashboard': lambda: ["/api/dashboard"],
+    'aggregate': lambda: [
+        "/api/aggregate/meta_ads?group_by=campaign_name&metrics=cost:sum&metrics=leads:sum&order_by=-cost_sum&limit=15",
+        "/api/aggregate/google_ads?group_by=ref_date&metrics=clicks:sum&metrics=cpc:avg&limit=30",
+    ],
+    'monthly': lambda: [f"/api/monthly/{system}?metrics=count" for system in SYSTEMS],
+    'detailed': lambda: [f"/api/detailed/{system}?limit=1000" for system in SYSTEMS if system != 'piperun'],
+    'detailed_piperun_all': lambda: ["/api/detailed/piperun/all?limit=1000"],
+    'series_range': lambda: [
+        path
+        for system in range_series_systems()
+        for path in (
+            f"/api/series/{system}?bucket=week",
+            f"/api/series/{system}?bucket=day&max_points=60&downsample=lttb",
+            f"/api/series/{system}?bucket=day&max_points=60&downsample=minmax",
+        )
+    ],
+    'report_monthly': lambda: ["/api/report/monthly"],
+    'detailed_stream': lambda: [
+        *(f"/api/detailed/{system}?stream=ndjson" for system in SYSTEMS if system != 'piperun'),
+        "/api/detailed/piperun/all?stream=json",
+    ],
+    'stream': lambda: [Call("/api/stream", first_event=True)],
+    'ingest': ingest_calls,
+}
+
+# Limites de regressão em relação à baseline (frações)
+DEFAULT_LATENCY_TOLERANCE = 0.25
+DEFAULT_BYTES_TOLERANCE = 0.10
+DEFAULT_ROUND_TRIP_TOLERANCE = 0.10
+
+
+async def send(client: httpx.AsyncClient, request: Union[str, Call]) -> httpx.Response:
+    if isinstance(request, str):
+        return await client.get(request)
+    if not request.first_event:
+        return await client.request(request.method, request.path, content=request.body, headers=request.headers)
+    async with client.stream(request.method, request.path, headers=request.headers) as response:
+        tail = b''
+        async for chunk in response.aiter_bytes():
+            # Eventos SSE terminam com uma linha em branco
+            if b'\n\n' in tail + chunk:
+                break
+            tail = chunk[-1:]
+    return response
+
+
+async def run_scenario(
+    client: httpx.AsyncClient,
+    paths: List[Union[str, Call]],
+    duration: float,
+    concurrency: int,
+    proxy: Optional[RoundTripProxy],
+) -> Dict[str, Any]:
+    # Aquecimento: preenche o pool e prepara os statements antes de medir
+    for path in paths:
+        await send(client, path)
+
+    # Round trips e bytes do banco medidos sem concorrência, para não depender
+    # de quantas requisições o single-flight do cache conseguiu agrupar
+    before = proxy.snapshot() if proxy else (0, 0)
+    for path in paths:
+        await send(client, path)
+    after = proxy.snapshot() if proxy else (0, 0)
+
+    latencies: List[float] = []
+    sizes: List[int] = []
+    errors = 0
+    start = time.perf_counter()
+    deadline = start + duration
+
+    async def worker(offset: int):
+        nonlocal errors
+        i = offset
+        while time.perf_counter() < deadline:
+            request_start = time.perf_counter()
+            response = await send(client, paths[i % len(paths)])
+            latencies.append((time.perf_counter() - request_start) * 1000)
+            sizes.append(response.num_bytes_downloaded)
+            if response.status_code >= 400:
+                errors += 1
+            i += 1
+
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    requests = len(latencies)
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': percentile(latencies, 50),
+        'p95_ms': percentile(latencies, 95),
+        'p99_ms': percentile(latencies, 99),
+        'rps': requests / elapsed,
+        'bytes_per_response': sum(sizes) / requests,
+        'round_trips_per_request': (after[0] - before[0]) / len(paths) if proxy else None,
+        'db_bytes_per_request': (after[1] - before[1]) / len(paths) if proxy else None,
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]], args) -> List[str]:
+    """Lista as regressões em relação à baseline"""
+    regressions = []
+    for name, result in results.items():
+        if result['errors']:
+            regressions.append(f"{name}: {result['errors']} respostas com erro")
+        base = baseline.get(name)
+        if not base:
+            continue
+        checks = [
+            ('p95_ms', result['p95_ms'] > base['p95_ms'] * (1 + args.latency_tolerance)),
+            ('rps', result['rps'] < base['rps'] * (1 - args.latency_tolerance)),
+            ('bytes_per_response', result['bytes_per_response'] > base['bytes_per_response'] * (1 + args.bytes_tolerance)),
+        ]
+        if result['round_trips_per_request'] is not None and base.get('round_trips_per_request') is not None:
+            checks.append((
+                'round_trips_per_request',
+                result['round_trips_per_request'] > base['round_trips_per_request'] * (1 + args.round_trip_tolerance) + 0.1
+            ))
+        for metric, regressed in checks:
+            if regressed:
+                regressions.append(f"{name}: {metric} {result[metric]:.2f} (baseline {base[metric]:.2f})")
+    return regressions
+
+
+def report(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"\n{'cenário':<22}{'req':>7}{'err':>5}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'req/s':>9}{'bytes/resp':>12}{'rt/req':>8}{'db bytes/req':>14}")
+    for name, r in results.items():
+        round_trips = f"{r['round_trips_per_request']:8.2f}" if r['round_trips_per_request'] is not None else f"{'-':>8}"
+        db_bytes = f"{r['db_bytes_per_request']:14.0f}" if r['db_bytes_per_request'] is not None else f"{'-':>14}"
+        print(f"{name:<22}{r['requests']:>7}{r['errors']:>5}{r['p50_ms']:9.1f}{r['p95_ms']:9.1f}{r['p99_ms']:9.1f}"
+              f"{r['rps']:9.1f}{r['bytes_per_response']:12.0f}{round_trips}{db_bytes}")
+
+
+def wait_for_api(base_url: str, process: subprocess.Popen, workers: int = 1, timeout: float = 60) -> None:
+    """Espera o /readyz (queries validadas e pool preparado) antes de medir qualquer cenário.
+
+    Com vários workers cada requisição cai em um deles: exige `workers`
+    respostas prontas seguidas para não medir um worker ainda em warm-up.
+    """
+    deadline = time.monotonic() + timeout
+    ready = 0
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("A API encerrou durante o startup")
+        try:
+            ready = ready + 1 if httpx.get(f"{base_url}/readyz", timeout=1).status_code == 200 else 0
+        except httpx.TransportError:
+            ready = 0
+        if ready >= workers:
+            return
+        time.sleep(0.3 if not ready else 0.05)
+    raise RuntimeError("A API não ficou pronta a tempo")
+
+
+async def run(args, postgres: LocalPostgres) -> Dict[str, Dict[str, Any]]:
+    proxy = None if args.no_proxy else RoundTripProxy(postgres.host, postgres.port)
+    if proxy:
+        await proxy.start()
+
+    api_port = free_port()
+    env = {**os.environ, **postgres.env, 'CACHE_TTL': str(args.cache_ttl), 'INGEST_TOKEN': INGEST_TOKEN}
+    if proxy:
+        env.update({'DB_HOST': '127.0.0.1', 'DB_PORT': str(proxy.port)})
+    api = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(api_port),
+         '--workers', str(args.workers), '--log-level', 'warning'],
+        cwd=BACKEND_DIR, env=env,
+    )
+    base_url = f"http://127.0.0.1:{api_port}"
+    results: Dict[str, Dict[str, Any]] = {}
+    try:
+        # Espera fora do event loop para o proxy continuar atendendo o startup da API
+        await asyncio.to_thread(wait_for_api, base_url, api, args.workers)
+        limits = httpx.Limits(max_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+            for name in args.scenarios:
+                print(f"  {name}...", flush=True)
+                results[name] = await run_scenario(client, SCENARIOS[name](), args.duration, args.concurrency, proxy)
+    finally:
+        api.terminate()
+        # O shutdown da API fecha as conexões através do proxy, que roda neste event loop
+        await asyncio.to_thread(api.wait)
+        if proxy:
+            await proxy.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--postgres', choices=['initdb', 'docker', 'external'], default='initdb',
+                        help='initdb: instância temporária (precisa do initdb/pg_ctl no PATH); '
+                             'docker: docker-compose.dev.yml; external: banco descartável informado em --dsn')
+    parser.add_argument('--pg-bin', help='diretório com initdb e pg_ctl')
+    parser.add_argument('--dsn', help='DSN do banco no modo external (as tabelas do SISTEMAS_DB são recriadas!)')
+    parser.add_argument('--rows', type=int, default=10000, help='linhas por tabela (de 10 mil a 10 milhões)')
+    parser.add_argument('--days', type=int, default=365, help='dias distintos de ref_date')
+    parser.add_argument('--reuse', action='store_true', help='não recarrega se as tabelas já tiverem --rows linhas')
+    parser.add_argument('--no-rollups', action='store_true', help='mede as séries lidas das tabelas originais')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=10, help='segundos por cenário')
+    parser.add_argument('--workers', type=int, default=1, help='workers do uvicorn')
+    parser.add_argument('--cache-ttl', type=float, default=0, help='CACHE_TTL da API (0 mede o banco, não o cache)')
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--no-proxy', action='store_true', help='não conta round trips (sem proxy entre API e banco)')
+    parser.add_argument('--baseline', help='arquivo da baseline (padrão: baselines/rows-<rows>.json)')
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--latency-tolerance', type=float, default=DEFAULT_LATENCY_TOLERANCE)
+    parser.add_argument('--bytes-tolerance', type=float, default=DEFAULT_BYTES_TOLERANCE)
+    parser.add_argument('--round-trip-tolerance', type=float, default=DEFAULT_ROUND_TRIP_TOLERANCE)
+    parser.add_argument('--output', help='grava os resultados em JSON')
+    args = parser.parse_args()
+    if (args.postgres == 'external') != bool(args.dsn):
+        parser.error("--dsn é obrigatório no modo external (e só vale nele)")
+
+    baseline_path = args.baseline or os.path.join(BASELINE_DIR, f"rows-{args.rows}.json")
+    postgres = LocalPostgres(args.postgres, args.pg_bin, args.dsn)
+    print(f"Subindo Postgres ({args.postgres})...")
+    postgres.start()
+    try:
+        if args.reuse and seeded_rows(postgres.dsn, SISTEMAS_DB) == args.rows:
+            print("Reaproveitando a carga existente")
+        else:
+            print(f"Carregando {args.rows} linhas por tabela...")
+            seed(postgres.dsn, SISTEMAS_DB, args.rows, args.days)
+            if not args.no_rollups:
+                print("Gerando rollups...")
+                subprocess.run(
+                    [sys.executable, 'manage.py', 'refresh-rollups', '--full'],
+                    cwd=BACKEND_DIR, check=True, stdout=subprocess.DEVNULL, env={**os.environ, **postgres.env},
+                )
+        if args.no_rollups:
+            print("Removendo rollups...")
+            with psycopg.connect(postgres.dsn, autocommit=True) as conn:
+                conn.execute(sql.SQL("DROP TABLE IF EXISTS {schema}.kpi_rollup_daily, {schema}.kpi_rollup_monthly, "
+                                     "{schema}.kpi_rollup_state").format(schema=sql.Identifier(ROLLUP_SCHEMA)))
+
+        print(f"Rodando cenários ({args.concurrency} clientes, {args.duration:.0f}s cada)...")
+        results = asyncio.run(run(args, postgres))
+    finally:
+        postgres.stop()
+
+    report(results)
+    meta = {'rows': args.rows, 'concurrency': args.concurrency, 'duration': args.duration, 'workers': args.workers}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, 'w') as f:
+            json.dump({'meta': meta, 'results': results}, f, indent=2)
+        print(f"\nBaseline gravada em {baseline_path}")
+        return
+
+    if not os.path.exists(baseline_path):
+        print(f"\nSem baseline em {baseline_path}; rode com --save-baseline para criar uma")
+        return
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if baseline['meta'] != meta:
+        print(f"\nAviso: baseline gravada com outros parâmetros ({baseline['meta']})")
+    regressions = compare(results, baseline['results'], args)
+    if regressions:
+        print("\nRegressões em relação à baseline:")
+        for regression in regressions:
+            print(f"  - {regression}")
+        sys.exit(1)
+    print("\nSem regressões em relação à baseline")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, replace
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from deadline import detached_context
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CacheEntry:
+    value: Any
+    watermark: Any
+    expires_at: float
+    # Momento (monotonic) em que o valor foi confirmado pela última vez no banco
+    refreshed_at: float = 0.0
+    # Marcada por `invalidate`: o próximo acesso recalcula, mas o valor segue disponível como stale
+    invalidated: bool = False
+    stale: bool = False
+
+    @property
+    def age(self) -> float:
+        """Segundos desde a última confirmação no banco"""
+        return time.monotonic() - self.refreshed_at
+
+
+@dataclass
+class _Flight:
+    task: asyncio.Task
+    # Requisições aguardando o resultado agora
+    waiters: int = 0
+    # Alguém desistiu de esperar sem ser cancelado (ex.: respondeu stale): a execução segue em segundo plano
+    detached: bool = False
+
+
+class SingleFlight:
+    """Agrupa chamadas simultâneas para a mesma chave em uma única execução.
+
+    A execução roda em uma task própria, com prazo do servidor (`budget`
+    segundos) em vez do prazo de quem a iniciou. Quem desiste por `timeout`
+    não a interrompe: ela continua para atualizar as próximas requisições.
+    Já se todos que aguardam forem cancelados (cliente desconectou ou o prazo
+    da requisição acabou), a execução é cancelada junto, e com ela a query
+    em andamento no Postgres.
+    """
+
+    def __init__(self, budget: Optional[float] = None):
+        self.budget = budget
+        self._flights: Dict[Hashable, _Flight] = {}
+
+    async def wait(self, key: Hashable, fn: Callable[[], Awaitable[Any]], timeout: Optional[float] = None) -> Any:
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.create_task(fn(), context=detached_context(self.budget))
+            flight = self._flights[key] = _Flight(task)
+            task.add_done_callback(lambda t: self._done(key, flight))
+
+        flight.waiters += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(flight.task), timeout)
+        except asyncio.TimeoutError:
+            flight.detached = True
+            raise
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.detached and not flight.task.done():
+                self._forget(key, flight)
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _forget(self, key: Hashable, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def _done(self, key: Hashable, flight: _Flight) -> None:
+        self._forget(key, flight)
+        # Evita o aviso de "exception was never retrieved" quando ninguém aguardava
+        if not flight.task.cancelled():
+            flight.task.exception()
+
+
+class WatermarkCache:
+    """Cache em memória com TTL, revalidado pelo watermark (MAX(updated_col)) da tabela.
+
+    Dentro do TTL a resposta sai direto da memória. Após o TTL, o watermark é
+    consultado: se não mudou, a entrada é renovada sem refazer a query pesada.
+    Requisições simultâneas para a mesma chave compartilham uma única execução
+    (single-flight).
+
+    O último valor bom de cada chave é mantido por até `stale_max` segundos.
+    Se a revalidação falhar ou demorar mais que `stale_wait`, esse valor é
+    devolvido marcado como stale enquanto a atualização continua em segundo plano.
+    """
+
+    def __init__(self, ttl: float, stale_wait: float = 0, stale_max: float = 0, budget: Optional[float] = None):
+        self.ttl = ttl
+        self.stale_wait = stale_wait
+        self.stale_max = stale_max
+        self._entries: Dict[Hashable, CacheEntry] = {}
+        self._flight = SingleFlight(budget)
+        # Incrementado a cada `invalidate`: um recálculo que começou antes guarda o valor já invalidado
+        self._generation = 0
+
+    async def get(
+        self,
+        key: Hashable,
+        watermark_fn: Callable[[], Awaitable[Any]],
+        compute_fn: Callable[[], Awaitable[Any]],
+    ) -> Any:
+        return (await self.get_entry(key, watermark_fn, compute_fn)).value
+
+    async def get_entry(
+        self,
+        key: Hashable,
+        watermark_fn: Callable[[], Awaitable[Any]],
+        compute_fn: Callable[[], Awaitable[Any]],
+    ) -> CacheEntry:
+        """Como `get`, mas devolve também o watermark do valor (usado nos GETs condicionais)"""
+        entry = self._entries.get(key)
+        if entry and not entry.invalidated and time.monotonic() < entry.expires_at:
+            return entry
+
+        refresh = lambda: self._refresh(key, entry, watermark_fn, compute_fn)
+        if entry is None or entry.age > self.stale_max:
+            return await self._flight.wait(key, refresh)
+        try:
+            return await self._flight.wait(key, refresh, self.stale_wait)
+        except asyncio.TimeoutError:
+            logger.info("Revalidação de %s passou de %.1fs; servindo valor de %.0fs atrás", key, self.stale_wait, entry.age)
+        except Exception as e:
+            logger.warning("Falha ao revalidar %s (%s); servindo valor de %.0fs atrás", key, e, entry.age)
+        return replace(entry, stale=True)
+
+    def invalidate(self, predicate: Optional[Callable[[Hashable], bool]] = None) -> None:
+        """Força o recálculo das entradas que satisfazem o predicado (ou de todas, se omitido)"""
+        self._generation += 1
+        for key, entry in list(self._entries.items()):
+            if predicate is None or predicate(key):
+                self._entries[key] = replace(entry, invalidated=True)
+
+    async def _refresh(self, key, entry, watermark_fn, compute_fn) -> CacheEntry:
+        generation = self._generation
+        watermark = await watermark_fn()
+        if entry is None or entry.invalidated or entry.watermark != watermark:
+            value = await compute_fn()
+        else:
+            value = entry.value
+        now = time.monotonic()
+        self._entries[key] = CacheEntry(
+            value, watermark, now + self.ttl, refreshed_at=now, invalidated=generation != self._generation
+        )
+        return self._entries[key]
@@ -0,0 +1,63 @@
+import hashlib
+from datetime import date, datetime, time, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Optional
+
+from fastapi import Request, Response
+
+
+def watermark_datetime(watermark: Any) -> Optional[datetime]:
+    """Converte o watermark (MAX(updated_col)) em datetime UTC, quando possível.
+
+    Um watermark composto (ex.: origem e último refresh do rollup) vale pelo mais recente.
+    """
+    if isinstance(watermark, tuple):
+        return max(filter(None, map(watermark_datetime, watermark)), default=None)
+    if isinstance(watermark, datetime):
+        return watermark if watermark.tzinfo else watermark.replace(tzinfo=timezone.utc)
+    if isinstance(watermark, date):
+        return datetime.combine(watermark, time.min, tzinfo=timezone.utc)
+    return None
+
+
+def make_etag(request: Request, watermark: Any) -> str:
+    """ETag fraco derivado do endpoint, dos parâmetros, do Accept e do watermark da tabela"""
+    query = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+    raw = f"{request.url.path}?{query}|{request.headers.get('accept', '')}|{watermark!r}"
+    return f'W/"{hashlib.sha1(raw.encode()).hexdigest()[:20]}"'
+
+
+def conditional_headers(request: Request, watermark: Any, max_age: int) -> Dict[str, str]:
+    """Headers de validação e de cache para a resposta"""
+    headers = {
+        'ETag': make_etag(request, watermark),
+        'Cache-Control': f'public, max-age={max_age}, must-revalidate',
+    }
+    modified = watermark_datetime(watermark)
+    if modified:
+        headers['Last-Modified'] = format_datetime(modified.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def is_not_modified(request: Request, headers: Dict[str, str]) -> bool:
+    """Avalia If-None-Match (prioritário) e If-Modified-Since contra os headers calculados"""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        tags = {tag.strip() for tag in if_none_match.split(',')}
+        # Comparação fraca: ignora o prefixo W/ dos dois lados
+        weak = {tag.removeprefix('W/') for tag in tags}
+        return '*' in tags or headers['ETag'].removeprefix('W/') in weak
+
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and 'Last-Modified' in headers:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        modified = parsedate_to_datetime(headers['Last-Modified'])
+        return modified <= since
+    return False
+
+
+def not_modified_response(headers: Dict[str, str]) -> Response:
+    return Response(status_code=304, headers=headers)
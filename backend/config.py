@@ -6,5 +6,29 @@ DB_NAME = os.getenv('DB_NAME', 'dashboard-diario')
 DB_USER = os.getenv('DB_USER', 'postgres')
 DB_PASSWORD = os.getenv('DB_PASSWORD', 'mkt2024')
 DB_TIMEOUT = int(os.getenv('DB_TIMEOUT', '5'))
+REQUEST_TIMEOUT_MAX_MS = int(os.getenv('REQUEST_TIMEOUT_MAX_MS', '30000'))
+POOL_MIN_SIZE = int(os.getenv('POOL_MIN_SIZE', '1'))
+POOL_MAX_SIZE = int(os.getenv('POOL_MAX_SIZE', '5'))
+POOL_WARMUP_PREPARE = os.getenv('POOL_WARMUP_PREPARE', '1') == '1'
+CACHE_TTL = float(os.getenv('CACHE_TTL', '30'))
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1000'))
+STREAM_POLL_INTERVAL = float(os.getenv('STREAM_POLL_INTERVAL', '30'))
+HTTP_MAX_AGE = int(os.getenv('HTTP_MAX_AGE', '15'))
+ROLLUP_SCHEMA = os.getenv('ROLLUP_SCHEMA', 'kpi_tv')
+ROLLUP_REFRESH_INTERVAL = float(os.getenv('ROLLUP_REFRESH_INTERVAL', '5'))
+ROLLUP_OVERLAP = float(os.getenv('ROLLUP_OVERLAP', '300'))
+ROLLUP_STATEMENT_TIMEOUT_MS = int(os.getenv('ROLLUP_STATEMENT_TIMEOUT_MS', '60000'))
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', '0'))
+STATEMENT_TIMEOUT_MS = int(os.getenv('STATEMENT_TIMEOUT_MS', '5000'))
+CACHE_STALE_WAIT = float(os.getenv('CACHE_STALE_WAIT', '1'))
+CACHE_STALE_MAX = float(os.getenv('CACHE_STALE_MAX', '86400'))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', '5'))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv('CIRCUIT_RESET_TIMEOUT', '30'))
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', '')
+SNAPSHOT_INTERVAL = float(os.getenv('SNAPSHOT_INTERVAL', '5'))
+SNAPSHOT_MAX_AGE = float(os.getenv('SNAPSHOT_MAX_AGE', '120'))
+SERIES_MAX_POINTS = int(os.getenv('SERIES_MAX_POINTS', '1000'))
+INGEST_TOKEN = os.getenv('INGEST_TOKEN', '')
+INGEST_STATEMENT_TIMEOUT_MS = int(os.getenv('INGEST_STATEMENT_TIMEOUT_MS', '60000'))
 
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
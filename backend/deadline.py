@@ -0,0 +1,186 @@
+import asyncio
+import contextvars
+import math
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from starlette.responses import JSONResponse
+
+from metrics import record_cancelled_request
+
+# Header com o tempo máximo (ms) que o cliente vai esperar pela resposta
+DEADLINE_HEADER = b'x-timeout-ms'
+
+# O statement_timeout é arredondado para cima neste passo, para que o mesmo
+# valor sirva para requisições seguidas e o SET só seja feito quando mudar
+STATEMENT_TIMEOUT_STEP_MS = 500
+
+
+@dataclass
+class RequestDeadline:
+    """Prazo da requisição atual (compartilhado via contextvar com o pool)"""
+    expires_at: float
+    # Prazo pedido pelo cliente e menor que o padrão
+    custom: bool = False
+    # 'disconnect' ou 'deadline' quando a requisição foi interrompida
+    cancelled: Optional[str] = None
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def statement_timeout_ms(self, limit_ms: int) -> int:
+        """Tempo restante como statement_timeout, limitado pelo do servidor (0 = sem limite)"""
+        step = STATEMENT_TIMEOUT_STEP_MS
+        timeout = max(math.ceil(self.remaining() * 1000 / step) * step, step)
+        return min(timeout, limit_ms) if limit_ms else timeout
+
+
+_current: contextvars.ContextVar[Optional[RequestDeadline]] = contextvars.ContextVar('request_deadline', default=None)
+
+
+def current_deadline() -> Optional[RequestDeadline]:
+    return _current.get()
+
+
+def detached_context(budget: Optional[float]) -> contextvars.Context:
+    """Cópia do contexto atual com um prazo próprio do servidor (`budget` segundos,
+    ou sem prazo se None), para trabalho compartilhado entre requisições: o
+    X-Timeout-Ms de quem iniciou não vale para os demais.
+    """
+    context = contextvars.copy_context()
+    deadline = RequestDeadline(time.monotonic() + budget) if budget is not None else None
+    context.run(_current.set, deadline)
+    return context
+
+
+def parse_budget(value: Optional[bytes], default: float, maximum: float) -> Optional[float]:
+    """Prazo pedido no header (segundos), limitado a `maximum`; None se ausente ou inválido"""
+    if value is None:
+        return None
+    try:
+        budget = float(value) / 1000
+    except ValueError:
+        return None
+    if not math.isfinite(budget) or budget <= 0:
+        return None
+    return min(budget, maximum)
+
+
+def _prepend(message, receive):
+    """receive que devolve primeiro a mensagem já lida"""
+    pending = [message]
+
+    async def replay():
+        return pending.pop() if pending else await receive()
+    return replay
+
+
+class DeadlineMiddleware:
+    """Middleware ASGI que dá um prazo a cada requisição e interrompe o trabalho abandonado.
+
+    O prazo vem do header `X-Timeout-Ms` (padrão `default` segundos, no máximo
+    `maximum`) e vira o statement_timeout das conexões pegas no pool. Em GET
+    e HEAD o endpoint roda em uma task separada, cancelada quando o cliente
+    desconecta ou quando o prazo acaba antes de a resposta começar (504); o
+    pool então cancela a query em andamento no Postgres. Deve ser o
+    middleware mais interno, para que o 504 passe pelo CORS e pelas métricas.
+    """
+
+    def __init__(self, app, default: float, maximum: float):
+        self.app = app
+        self.default = default
+        self.maximum = maximum
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        header = next((value for name, value in scope['headers'] if name == DEADLINE_HEADER), None)
+        budget = parse_budget(header, self.default, self.maximum)
+        deadline = RequestDeadline(
+            time.monotonic() + (budget or self.default),
+            custom=budget is not None and budget < self.default,
+        )
+        token = _current.set(deadline)
+        try:
+            if scope['method'] in ('GET', 'HEAD'):
+                await self._run_cancellable(deadline, scope, receive, send)
+            else:
+                # Com corpo (ex.: /api/ingest) o endpoint lê o receive: vale só o statement_timeout
+                await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+
+    async def _run_cancellable(self, deadline: RequestDeadline, scope, receive, send) -> None:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            record_cancelled_request('disconnect')
+            return
+
+        if message.get('more_body', False):
+            # Corpo em vários pedaços: segue com o receive original, sem vigiar o disconnect
+            await self.app(scope, _prepend(message, receive), send)
+            return
+
+        delivered = False
+        disconnected = asyncio.Event()
+        response_started = False
+        response_complete = False
+
+        async def app_receive():
+            # Entrega o corpo já lido e depois só avisa do disconnect vigiado aqui
+            nonlocal delivered
+            if not delivered:
+                delivered = True
+                return message
+            await disconnected.wait()
+            return {'type': 'http.disconnect'}
+
+        async def app_send(event):
+            nonlocal response_started, response_complete
+            if event['type'] == 'http.response.start':
+                response_started = True
+            elif event['type'] == 'http.response.body' and not event.get('more_body', False):
+                response_complete = True
+            await send(event)
+
+        app_task = asyncio.create_task(self.app(scope, app_receive, app_send))
+        watcher = asyncio.create_task(receive())
+        try:
+            while not app_task.done():
+                # Depois que a resposta começou (streaming, SSE) o prazo não se aplica mais
+                timeout = None if response_started else max(deadline.remaining(), 0)
+                done, _ = await asyncio.wait(
+                    {app_task, watcher}, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if app_task in done:
+                    break
+                if watcher in done:
+                    disconnected.set()
+                    if not response_complete:
+                        deadline.cancelled = 'disconnect'
+                        # Fechar um stream já iniciado (SSE) é o fim normal dele, não trabalho perdido
+                        if not response_started:
+                            record_cancelled_request('disconnect')
+                        app_task.cancel()
+                    break
+                if not response_started:
+                    deadline.cancelled = 'deadline'
+                    record_cancelled_request('deadline')
+                    app_task.cancel()
+                    break
+            try:
+                await app_task
+            except asyncio.CancelledError:
+                if deadline.cancelled is None:
+                    raise
+        finally:
+            watcher.cancel()
+            if not app_task.done():
+                app_task.cancel()
+
+        if deadline.cancelled == 'deadline' and not response_started:
+            response = JSONResponse({"detail": "Tempo limite da requisição esgotado"}, status_code=504)
+            await response(scope, app_receive, send)
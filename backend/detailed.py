@@ -0,0 +1,221 @@
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from psycopg import postgres, sql
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc
+except ImportError:  # pyarrow é opcional; sem ele o formato arrow não fica disponível
+    pa = None
+
+from queries import Resolver, fold_identifier, primary_filtro, qualified_table
+
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+
+# Tamanho padrão e máximo das páginas de /api/detailed (sem streaming)
+DEFAULT_PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+
+# Coluna auxiliar com o ctid, usada para desempatar linhas com o mesmo (date_col, updated_col).
+# As tabelas do SISTEMAS_DB não têm uma chave única declarada, então o ctid é o
+# único desempate genérico. Ele é estável enquanto a linha não muda de lugar: um
+# UPDATE troca o ctid, mas também o updated_col, e a linha muda de posição na
+# ordem de qualquer jeito; já um VACUUM FULL/CLUSTER reescreve a tabela, e cursores
+# emitidos antes dele podem pular ou repetir linhas com o mesmo (date_col, updated_col).
+TIEBREAK_COL = '_ctid'
+
+# Quantidade de linhas buscadas por vez do cursor nomeado no modo streaming
+STREAM_CHUNK_SIZE = 2000
+
+
+def encode_cursor(date_value: Any, updated_value: Any, ctid: str) -> str:
+    """Gera o token opaco de paginação a partir da última linha da página"""
+    payload = json.dumps([json_default(date_value), json_default(updated_value), ctid])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token: str) -> Tuple[Any, Any, str]:
+    """Lê o token de paginação gerado por encode_cursor"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        date_value, updated_value, ctid = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Cursor de paginação inválido")
+    return date_value, updated_value, ctid
+
+
+def json_default(value: Any) -> Any:
+    """Serializa os tipos que o Postgres devolve e o json padrão não conhece"""
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+# Tipos que o json serializa sem conversão
+_JSON_NATIVE_TYPES = {
+    'int2', 'int4', 'int8', 'float4', 'float8', 'bool', 'text', 'varchar', 'bpchar', 'name', 'json', 'jsonb',
+}
+_JSON_NATIVE_OIDS = {postgres.types[name].oid for name in _JSON_NATIVE_TYPES}
+_TEMPORAL_OIDS = {postgres.types[name].oid for name in ('date', 'timestamp', 'timestamptz', 'time')}
+_NUMERIC_OID = postgres.types['numeric'].oid
+
+
+def _iso(value: Any) -> Any:
+    return None if value is None else value.isoformat()
+
+
+def _float(value: Any) -> Any:
+    return None if value is None else float(value)
+
+
+def _str(value: Any) -> Any:
+    return None if value is None else str(value)
+
+
+def build_converters(description, keep_temporal: bool = False) -> List[Optional[Callable[[Any], Any]]]:
+    """Escolhe uma vez, pelo tipo de cada coluna em `cur.description`, como converter os valores.
+
+    `None` significa que o valor já pode ir direto para o json. Com
+    `keep_temporal`, datas são mantidas como objetos (usado no formato arrow).
+    """
+    converters: List[Optional[Callable[[Any], Any]]] = []
+    for desc in description:
+        oid = desc.type_code
+        if oid in _JSON_NATIVE_OIDS:
+            converters.append(None)
+        elif oid in _TEMPORAL_OIDS:
+            converters.append(None if keep_temporal else _iso)
+        elif oid == _NUMERIC_OID:
+            converters.append(_float)
+        else:
+            converters.append(_str)
+    return converters
+
+
+def to_row_dicts(rows: List[tuple], names: List[str], keep: List[int], converters) -> List[Dict[str, Any]]:
+    """Formato tradicional: lista de objetos, uma chave por coluna"""
+    plan = [(i, names[i], converters[i]) for i in keep]
+    return [
+        {name: (convert(row[i]) if convert else row[i]) for i, name, convert in plan}
+        for row in rows
+    ]
+
+
+def _column_values(rows: List[tuple], names: List[str], keep: List[int], converters) -> List[list]:
+    transposed = list(zip(*rows)) if rows else [() for _ in names]
+    values = []
+    for i in keep:
+        convert = converters[i]
+        values.append([convert(v) for v in transposed[i]] if convert else list(transposed[i]))
+    return values
+
+
+def to_columnar(rows: List[tuple], names: List[str], keep: List[int], converters) -> Dict[str, Any]:
+    """Formato colunar: os nomes aparecem uma vez e cada coluna vira uma lista de valores"""
+    return {
+        "columns": [names[i] for i in keep],
+        "data": _column_values(rows, names, keep, converters),
+    }
+
+
+def to_arrow_ipc(rows: List[tuple], names: List[str], keep: List[int], converters) -> bytes:
+    """Serializa as linhas como um stream Apache Arrow IPC"""
+    arrays = [pa.array(values) for values in _column_values(rows, names, keep, converters)]
+    table = pa.Table.from_arrays(arrays, names=[names[i] for i in keep])
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def resolve_columns(requested: Sequence[str], table_columns: List[str]) -> List[str]:
+    """Valida a projeção pedida em `columns=` contra as colunas reais da tabela"""
+    if not requested:
+        return []
+    invalid = [col for col in requested if col not in table_columns]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Colunas inválidas: {', '.join(invalid)}")
+    return list(dict.fromkeys(requested))
+
+
+def build_detailed_query(
+    config: Dict[str, Any],
+    columns: List[str],
+    filtro_vals: Optional[List[str]] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = None,
+    resolve: Resolver = fold_identifier,
+) -> Tuple[sql.Composed, list]:
+    """Constrói a query de detalhes com projeção e paginação por keyset em (date_col, updated_col).
+
+    As colunas de ordenação (e o ctid, que desempata linhas gravadas no mesmo
+    instante) são sempre selecionadas para que o próximo cursor possa ser
+    calculado. Linhas com `updated_col` nulo vêm primeiro dentro do dia
+    (NULLS FIRST, a ordem do índice); quando o cursor cai em uma delas, a
+    condição trata o nulo explicitamente, já que a comparação de tuplas com
+    NULL nunca é verdadeira. `columns` já vem com a grafia real (validada por
+    `resolve_columns`); as do SISTEMAS_DB passam pelo `resolve` do registry.
+    `filtro_vals` substitui o filtro fixo do sistema.
+    """
+    date_col = resolve(config['date_col'])
+    updated_col = resolve(config['updated_col'])
+
+    if columns:
+        projection = [sql.Identifier(col) for col in columns]
+        for col in (date_col, updated_col):
+            if col not in projection:
+                projection.append(col)
+        select_clause = sql.SQL(", ").join(projection)
+    else:
+        select_clause = sql.SQL("*")
+
+    conditions: List[sql.Composable] = []
+    params: list = []
+    if filtro_vals is not None:
+        conditions.append(sql.SQL("{} = ANY(%s)").format(resolve(config['filtro_col'])))
+        params.append(filtro_vals)
+    elif config['filtro_col']:
+        conditions.append(sql.SQL("{} = %s").format(resolve(config['filtro_col'])))
+        params.append(primary_filtro(config))
+    if after:
+        date_value, updated_value, ctid = decode_cursor(after)
+        if updated_value is None:
+            # Depois de (dia, NULL, ctid): dias anteriores, linhas não nulas do mesmo dia
+            # e nulas com ctid menor
+            conditions.append(sql.SQL(
+                "({date_col} < %s OR ({date_col} = %s AND ({updated_col} IS NOT NULL OR ctid < %s::tid)))"
+            ).format(date_col=date_col, updated_col=updated_col))
+            params.extend([date_value, date_value, ctid])
+        else:
+            # Linhas nulas do mesmo dia já vieram antes; nos dias anteriores a primeira coluna decide
+            conditions.append(sql.SQL("({}, {}, ctid) < (%s, %s, %s::tid)").format(date_col, updated_col))
+            params.extend([date_value, updated_value, ctid])
+
+    limit_clause = sql.SQL("")
+    if limit:
+        limit_clause = sql.SQL("LIMIT %s")
+        params.append(limit)
+
+    query = sql.SQL("""
+        SELECT {select}, ctid::text AS {tiebreak}
+        FROM {table}
+        {where}
+        ORDER BY {date_col} DESC, {updated_col} DESC NULLS FIRST, ctid DESC
+        {limit}
+    """).format(
+        select=select_clause,
+        tiebreak=sql.Identifier(TIEBREAK_COL),
+        table=qualified_table(config),
+        where=sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL(""),
+        date_col=date_col,
+        updated_col=updated_col,
+        limit=limit_clause,
+    )
+    return query, params
@@ -0,0 +1,69 @@
+from typing import List, Sequence
+
+
+def lttb(xs: Sequence[float], ys: Sequence[float], threshold: int) -> List[int]:
+    """Largest-Triangle-Three-Buckets: índices dos pontos que preservam a forma da série.
+
+    O primeiro e o último ponto são mantidos; os demais são divididos em
+    `threshold - 2` faixas e de cada uma sai o ponto que forma o maior
+    triângulo com o ponto escolhido antes e a média da faixa seguinte.
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    every = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        # Média da próxima faixa (o último ponto, na última)
+        next_start = end
+        next_end = min(int((i + 2) * every) + 1, n)
+        if next_start >= next_end:
+            avg_x, avg_y = xs[-1], ys[-1]
+        else:
+            count = next_end - next_start
+            avg_x = sum(xs[next_start:next_end]) / count
+            avg_y = sum(ys[next_start:next_end]) / count
+
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((xs[a] - avg_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (avg_y - ys[a]))
+            if area > best_area:
+                best, best_area = j, area
+        selected.append(best)
+        a = best
+    selected.append(n - 1)
+    return selected
+
+
+def min_max(ys: Sequence[float], threshold: int) -> List[int]:
+    """Índices do menor e do maior valor de cada faixa (picos e vales nunca somem do gráfico).
+
+    O primeiro e o último ponto são mantidos; cada uma das `(threshold - 2) // 2`
+    faixas do meio contribui com até dois pontos, em ordem cronológica. Com
+    `threshold` 3 não cabe uma faixa inteira: sai só o ponto do meio mais
+    distante da reta entre o primeiro e o último.
+    """
+    n = len(ys)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    buckets = (threshold - 2) // 2
+    if buckets < 1:
+        slope = (ys[-1] - ys[0]) / (n - 1)
+        extreme = max(range(1, n - 1), key=lambda i: abs(ys[i] - ys[0] - slope * i))
+        return [0, extreme, n - 1]
+
+    every = (n - 2) / buckets
+    selected = [0]
+    for i in range(buckets):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        indexes = range(start, end)
+        low = min(indexes, key=ys.__getitem__)
+        high = max(indexes, key=ys.__getitem__)
+        selected.extend(sorted({low, high}))
+    selected.append(n - 1)
+    return selected
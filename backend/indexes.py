@@ -0,0 +1,162 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from psycopg import sql
+
+from detailed import DEFAULT_PAGE_SIZE, build_detailed_query
+from queries import GROUPED_QUERIES, QueryRegistry, filtro_values, fold_identifier
+
+logger = logging.getLogger(__name__)
+
+# Limite do Postgres para nomes de objetos
+MAX_IDENTIFIER_LENGTH = 63
+
+
+@dataclass
+class IndexSpec:
+    """Índice composto que as queries geradas a partir do SISTEMAS_DB precisam"""
+    schema: str
+    table: str
+    # (coluna, descendente)
+    columns: List[Tuple[str, bool]]
+    reason: str
+    systems: List[str] = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        name = "_".join([self.table, *(column for column, _ in self.columns), "idx"]).lower()
+        return name[:MAX_IDENTIFIER_LENGTH]
+
+    @property
+    def label(self) -> str:
+        return ", ".join(f"{column} DESC" if desc else column for column, desc in self.columns)
+
+    def create_sql(self) -> sql.Composed:
+        """CREATE INDEX CONCURRENTLY (precisa rodar fora de transação, em autocommit)"""
+        return sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {schema}.{table} ({columns})").format(
+            name=sql.Identifier(self.name),
+            schema=fold_identifier(self.schema),
+            table=fold_identifier(self.table),
+            columns=sql.SQL(", ").join(
+                sql.SQL("{} DESC" if desc else "{}").format(sql.Identifier(column)) for column, desc in self.columns
+            ),
+        )
+
+    def covered_by(self, keys: List[Tuple[Optional[str], bool]]) -> bool:
+        """Se um índice existente com essas chaves atende as mesmas buscas.
+
+        Basta que as colunas do spec sejam o prefixo das chaves, com as mesmas
+        direções ou todas invertidas (o Postgres percorre o índice de trás para frente).
+        """
+        if len(keys) < len(self.columns):
+            return False
+        prefix = keys[:len(self.columns)]
+        if any(key != column for (key, _), (column, _) in zip(prefix, self.columns)):
+            return False
+        same = [key_desc == desc for (_, key_desc), (_, desc) in zip(prefix, self.columns)]
+        return all(same) or not any(same)
+
+
+@dataclass
+class ExistingIndex:
+    name: str
+    keys: List[Tuple[Optional[str], bool]]
+    valid: bool
+
+
+def required_indexes(sistemas: Dict[str, Dict[str, Any]], registry: QueryRegistry) -> List[IndexSpec]:
+    """Deriva do SISTEMAS_DB os índices usados pelas queries de KPI, série, watermark e detalhes.
+
+    - `(filtro_col, date_col DESC, updated_col DESC)`: linha mais recente e
+      "último dia" por filtro, séries por `GROUP BY filtro_col, date_col` e a
+      paginação por keyset de /api/detailed (sem `filtro_col`, só as datas);
+    - `(updated_col DESC)`: watermark (`MAX(updated_col)`) e o refresh
+      incremental dos rollups.
+    """
+    specs: Dict[Tuple[str, str, tuple], IndexSpec] = {}
+
+    def add(system: str, config: Dict[str, Any], columns: List[Tuple[str, bool]], reason: str) -> None:
+        key = (config['schema'].lower(), config['tabela'].lower(), tuple(columns))
+        spec = specs.setdefault(key, IndexSpec(config['schema'], config['tabela'], columns, reason))
+        spec.systems.append(system)
+
+    for system, config in sistemas.items():
+        column = lambda name: registry.column_name(system, name)
+        date_col = (column(config['date_col']), True)
+        updated_col = (column(config['updated_col']), True)
+        if config['filtro_col']:
+            add(system, config, [(column(config['filtro_col']), False), date_col, updated_col],
+                "KPIs/séries por filtro e detalhes paginados")
+        else:
+            add(system, config, [date_col, updated_col], "último dia, séries e detalhes paginados")
+        add(system, config, [updated_col], "watermark e refresh dos rollups")
+    return list(specs.values())
+
+
+async def existing_indexes(conn, schema: str, table: str) -> List[ExistingIndex]:
+    """Índices da tabela lidos do catálogo (chaves em ordem, com a direção de cada uma).
+
+    Índices parciais ficam de fora; chaves de expressão aparecem como None.
+    """
+    async with conn.cursor() as cur:
+        await cur.execute("""
+            SELECT idx.indexname,
+                   array_agg(att.attname::text ORDER BY key.position),
+                   array_agg((ind.indoption[key.position - 1] & 1) = 1 ORDER BY key.position),
+                   bool_and(ind.indisvalid)
+            FROM pg_indexes AS idx
+            JOIN pg_class AS cls ON cls.relname = idx.indexname
+            JOIN pg_namespace AS nsp ON nsp.oid = cls.relnamespace AND nsp.nspname = idx.schemaname
+            JOIN pg_index AS ind ON ind.indexrelid = cls.oid
+            CROSS JOIN LATERAL unnest(ind.indkey::int2[]) WITH ORDINALITY AS key(attnum, position)
+            LEFT JOIN pg_attribute AS att ON att.attrelid = ind.indrelid AND att.attnum = key.attnum
+            WHERE idx.schemaname = %s AND idx.tablename = %s AND ind.indpred IS NULL
+              AND key.position <= ind.indnkeyatts
+            GROUP BY idx.indexname
+        """, (schema.lower(), table.lower()))
+        return [
+            ExistingIndex(name, list(zip(columns, descending)), valid)
+            for name, columns, descending, valid in await cur.fetchall()
+        ]
+
+
+async def check_indexes(conn, specs: List[IndexSpec]) -> List[Tuple[IndexSpec, Optional[ExistingIndex]]]:
+    """Casa cada índice necessário com um índice existente que o atenda (None se faltar)"""
+    cache: Dict[Tuple[str, str], List[ExistingIndex]] = {}
+    results = []
+    for spec in specs:
+        key = (spec.schema.lower(), spec.table.lower())
+        if key not in cache:
+            cache[key] = await existing_indexes(conn, spec.schema, spec.table)
+        # Prefere um índice válido; um inválido (CONCURRENTLY interrompido) precisa ser recriado
+        matches = sorted((index for index in cache[key] if spec.covered_by(index.keys)), key=lambda i: not i.valid)
+        results.append((spec, matches[0] if matches else None))
+    return results
+
+
+def explain_targets(
+    sistemas: Dict[str, Dict[str, Any]], registry: QueryRegistry, system: str
+) -> List[Tuple[str, Any, tuple]]:
+    """(nome, query, parâmetros) de cada query gerada para o sistema, prontos para o EXPLAIN"""
+    config = sistemas[system]
+    queries = registry.get(system)
+    targets = []
+    for name in ('kpi', 'series', 'watermark', *GROUPED_QUERIES):
+        compiled = getattr(queries, name)
+        if compiled is None:
+            continue
+        params = (*compiled.params, filtro_values(config)) if name in GROUPED_QUERIES else compiled.params
+        targets.append((name, compiled.query, params))
+    query, params = build_detailed_query(config, [], None, None, DEFAULT_PAGE_SIZE, registry.resolver(system))
+    targets.append(('detailed', query, tuple(params)))
+    return targets
+
+
+async def explain_analyze(conn, query: Any, params: tuple) -> List[str]:
+    """Plano real da query com EXPLAIN (ANALYZE, BUFFERS); a query é executada (só leituras)"""
+    if isinstance(query, sql.Composable):
+        query = query.as_string(conn)
+    async with conn.cursor() as cur:
+        await cur.execute(f"EXPLAIN (ANALYZE, BUFFERS) {query}", params)
+        return [row[0] for row in await cur.fetchall()]
@@ -0,0 +1,284 @@
+import csv
+import json
+from typing import Any, AsyncIterator, Dict, List, Tuple
+
+import psycopg
+from fastapi import HTTPException
+from psycopg import sql
+
+from live import NOTIFY_CHANNEL
+from queries import qualified_table
+
+# Content-Types aceitos pelo /api/ingest e o formato de cada um
+INGEST_FORMATS = {
+    'text/csv': 'csv',
+    'application/x-ndjson': 'ndjson',
+    'application/ndjson': 'ndjson',
+    'application/jsonl': 'ndjson',
+}
+
+# Tabela temporária da carga (some no COMMIT/ROLLBACK) e a coluna que guarda a ordem de chegada
+STAGE_TABLE = sql.Identifier('ingest_stage')
+STAGE_SEQ = sql.Identifier('ingest_seq')
+
+
+def ingest_format(content_type: str) -> str:
+    """Formato da carga a partir do Content-Type (415 se não for CSV nem NDJSON)"""
+    media_type = content_type.split(';')[0].strip().lower()
+    if media_type not in INGEST_FORMATS:
+        raise HTTPException(
+            status_code=415, detail=f"Content-Type deve ser um de: {', '.join(INGEST_FORMATS)}"
+        )
+    return INGEST_FORMATS[media_type]
+
+
+def ingest_key(config: Dict[str, Any]) -> List[str]:
+    """Colunas que identificam uma linha: (filtro_col, date_col[, ingest_dimensions])"""
+    key = [config['filtro_col']] if config['filtro_col'] else []
+    return key + [config['date_col']] + list(config.get('ingest_dimensions', []))
+
+
+async def _lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Quebra o corpo da requisição em linhas, sem juntá-lo inteiro em memória"""
+    pending = b''
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b'\n')
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+
+async def _split_header(chunks: AsyncIterator[bytes]) -> Tuple[bytes, bytes]:
+    """Separa a primeira linha (cabeçalho do CSV) do que já chegou depois dela"""
+    pending = b''
+    async for chunk in chunks:
+        pending += chunk
+        if b'\n' in pending:
+            header, rest = pending.split(b'\n', 1)
+            return header, rest
+    return pending, b''
+
+
+def _decode_record(line: bytes, number: int) -> Dict[str, Any]:
+    try:
+        record = json.loads(line)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Linha {number}: JSON inválido ({e})")
+    if not isinstance(record, dict):
+        raise HTTPException(status_code=400, detail=f"Linha {number}: cada linha deve ser um objeto JSON")
+    return record
+
+
+class BulkIngest:
+    """Carga em lote de linhas CSV/NDJSON nas tabelas do SISTEMAS_DB.
+
+    As linhas vão por COPY para uma tabela temporária e de lá para a tabela
+    do sistema com um upsert pela chave de `ingest_key` (UPDATE das linhas
+    existentes + INSERT das novas; se a carga repetir uma chave, vale a
+    última). Tudo roda em uma transação: a carga entra inteira ou nada.
+    O `updated_col` das linhas gravadas recebe `now()`, o que avança o
+    watermark, e o NOTIFY avisa os workers (SSE e caches) no COMMIT.
+    """
+
+    def __init__(self, sistemas: Dict[str, Dict[str, Any]], statement_timeout_ms: int):
+        self.sistemas = sistemas
+        self.statement_timeout_ms = statement_timeout_ms
+
+    async def _table_columns(self, cur, config: Dict[str, Any]) -> Dict[str, str]:
+        """Colunas reais da tabela, indexadas pelo nome em minúsculas"""
+        await cur.execute("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = %s AND table_name = %s
+        """, (config['schema'].lower(), config['tabela'].lower()))
+        columns = {row[0].lower(): row[0] for row in await cur.fetchall()}
+        if not columns:
+            raise HTTPException(status_code=500, detail=f"Tabela {config['schema']}.{config['tabela']} não encontrada")
+        return columns
+
+    def _resolve_columns(self, config: Dict[str, Any], table_columns: Dict[str, str], names: List[str]) -> List[str]:
+        """Valida os nomes recebidos contra a tabela e devolve a grafia real de cada coluna"""
+        lowered = [name.strip().lower() for name in names]
+        if not names or '' in lowered:
+            raise HTTPException(status_code=400, detail="Cabeçalho sem nome de coluna")
+        duplicated = sorted({name for name in lowered if lowered.count(name) > 1})
+        if duplicated:
+            raise HTTPException(status_code=400, detail=f"Colunas repetidas: {', '.join(duplicated)}")
+        unknown = [name for name, low in zip(names, lowered) if low not in table_columns]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Colunas inexistentes na tabela: {', '.join(unknown)}")
+        if config['updated_col'].lower() in lowered:
+            raise HTTPException(
+                status_code=400, detail=f"A coluna {config['updated_col']} é preenchida pela API"
+            )
+        missing = [column for column in ingest_key(config) if column.lower() not in lowered]
+        if missing:
+            raise HTTPException(status_code=400, detail=f"Colunas da chave ausentes: {', '.join(missing)}")
+        return [table_columns[low] for low in lowered]
+
+    def _upsert_query(self, config: Dict[str, Any], columns: List[str], key: List[str],
+                      updated_col: str) -> sql.Composed:
+        """UPDATE das chaves existentes e INSERT das novas a partir da tabela temporária, em um statement"""
+        table = qualified_table(config)
+        cols = [sql.Identifier(column) for column in columns]
+        key_cols = [sql.Identifier(column) for column in key]
+        updated_col = sql.Identifier(updated_col)
+        match = sql.SQL(' AND ').join(sql.SQL("t.{c} = s.{c}").format(c=column) for column in key_cols)
+        assignments = [sql.SQL("{c} = s.{c}").format(c=column) for column in cols if column not in key_cols]
+        assignments.append(sql.SQL("{} = now()").format(updated_col))
+
+        return sql.SQL("""
+            WITH s AS (
+                SELECT DISTINCT ON ({key}) {cols}
+                FROM {stage}
+                ORDER BY {key}, {seq} DESC
+            ),
+            updated AS (
+                UPDATE {table} AS t SET {assignments}
+                FROM s
+                WHERE {match}
+                RETURNING 1
+            ),
+            inserted AS (
+                INSERT INTO {table} ({cols}, {updated_col})
+                SELECT {source_cols}, now()
+                FROM s
+                WHERE NOT EXISTS (SELECT 1 FROM {table} AS t WHERE {match})
+                RETURNING 1
+            )
+            SELECT (SELECT COUNT(*) FROM updated), (SELECT COUNT(*) FROM inserted), now()
+        """).format(
+            key=sql.SQL(', ').join(key_cols),
+            cols=sql.SQL(', ').join(cols),
+            source_cols=sql.SQL(', ').join(sql.SQL("s.{}").format(column) for column in cols),
+            stage=STAGE_TABLE,
+            seq=STAGE_SEQ,
+            table=table,
+            assignments=sql.SQL(', ').join(assignments),
+            match=match,
+            updated_col=updated_col,
+        )
+
+    async def _create_stage(self, cur, config: Dict[str, Any], columns: List[str]) -> None:
+        """Tabela temporária só com as colunas da carga (mesmos tipos, sem constraints)"""
+        await cur.execute(sql.SQL("""
+            CREATE TEMP TABLE {stage} ON COMMIT DROP AS
+            SELECT {cols} FROM {table} WITH NO DATA
+        """).format(
+            stage=STAGE_TABLE,
+            cols=sql.SQL(', ').join(map(sql.Identifier, columns)),
+            table=qualified_table(config),
+        ))
+        await cur.execute(sql.SQL("ALTER TABLE {} ADD COLUMN {} bigint GENERATED ALWAYS AS IDENTITY").format(
+            STAGE_TABLE, STAGE_SEQ
+        ))
+
+    def _copy_statement(self, columns: List[str], fmt: str) -> sql.Composed:
+        options = sql.SQL(" (FORMAT csv)") if fmt == 'csv' else sql.SQL("")
+        return sql.SQL("COPY {} ({}) FROM STDIN{}").format(
+            STAGE_TABLE, sql.SQL(', ').join(map(sql.Identifier, columns)), options
+        )
+
+    async def _copy_csv(self, cur, config: Dict[str, Any], table_columns: Dict[str, str],
+                        chunks: AsyncIterator[bytes]) -> List[str]:
+        """CSV: o cabeçalho define as colunas e o resto do corpo vai direto para o COPY"""
+        header, rest = await _split_header(chunks)
+        names = next(csv.reader([header.decode('utf-8-sig').rstrip('\r')]), [])
+        columns = self._resolve_columns(config, table_columns, names)
+        await self._create_stage(cur, config, columns)
+        async with cur.copy(self._copy_statement(columns, 'csv')) as copy:
+            if rest:
+                await copy.write(rest)
+            async for chunk in chunks:
+                await copy.write(chunk)
+        return columns
+
+    async def _copy_ndjson(self, cur, config: Dict[str, Any], table_columns: Dict[str, str],
+                           chunks: AsyncIterator[bytes]) -> List[str]:
+        """NDJSON: as chaves do primeiro objeto definem as colunas; nos demais, chaves ausentes viram NULL"""
+        lines = _lines(chunks)
+        number = 0
+        first = None
+        async for line in lines:
+            number += 1
+            if line.strip():
+                first = _decode_record(line, number)
+                break
+        if first is None:
+            raise HTTPException(status_code=400, detail="Nenhuma linha recebida")
+        names = list(first)
+        columns = self._resolve_columns(config, table_columns, names)
+        await self._create_stage(cur, config, columns)
+
+        async with cur.copy(self._copy_statement(columns, 'ndjson')) as copy:
+            record = first
+            while True:
+                extra = set(record) - set(names)
+                if extra:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"Linha {number}: colunas fora das do primeiro objeto: {', '.join(sorted(extra))}"
+                    )
+                row = [record.get(name) for name in names]
+                if any(isinstance(value, (dict, list)) for value in row):
+                    raise HTTPException(status_code=400, detail=f"Linha {number}: valores aninhados não são suportados")
+                await copy.write_row(row)
+
+                record = None
+                async for line in lines:
+                    number += 1
+                    if line.strip():
+                        record = _decode_record(line, number)
+                        break
+                if record is None:
+                    break
+        return columns
+
+    async def load(self, conn, system: str, fmt: str, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """Carrega o corpo da requisição na tabela do sistema. Retorna as contagens da carga."""
+        config = self.sistemas[system]
+        try:
+            async with conn.transaction():
+                async with conn.cursor() as cur:
+                    # Cargas pesadas passam do statement_timeout das leituras
+                    await cur.execute("SELECT set_config('statement_timeout', %s, true)",
+                                      (str(self.statement_timeout_ms),))
+                    # Duas cargas simultâneas da mesma tabela inseririam a mesma chave duas vezes
+                    await cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))",
+                                      (f"kpi_ingest:{config['schema']}.{config['tabela']}",))
+                    table_columns = await self._table_columns(cur, config)
+
+                    copy_rows = self._copy_csv if fmt == 'csv' else self._copy_ndjson
+                    columns = await copy_rows(cur, config, table_columns, chunks)
+                    received = cur.rowcount
+                    if received <= 0:
+                        raise HTTPException(status_code=400, detail="Nenhuma linha recebida")
+
+                    key = [table_columns[column.lower()] for column in ingest_key(config)]
+                    await cur.execute(sql.SQL("SELECT COUNT(*) FROM {} WHERE {}").format(
+                        STAGE_TABLE,
+                        sql.SQL(' OR ').join(sql.SQL("{} IS NULL").format(sql.Identifier(column)) for column in key),
+                    ))
+                    null_keys = (await cur.fetchone())[0]
+                    if null_keys:
+                        raise HTTPException(
+                            status_code=400, detail=f"{null_keys} linha(s) sem valor em {', '.join(key)}"
+                        )
+
+                    updated_col = table_columns.get(config['updated_col'].lower(), config['updated_col'])
+                    await cur.execute(self._upsert_query(config, columns, key, updated_col))
+                    updated, inserted, updated_at = await cur.fetchone()
+                    # Entregue só no COMMIT; com os triggers do manage.py o aviso é o mesmo (e o Postgres junta os dois)
+                    await cur.execute("SELECT pg_notify(%s, %s)", (NOTIFY_CHANNEL, config['tabela']))
+        except (psycopg.DataError, psycopg.IntegrityError) as e:
+            # Valor que não converte para o tipo da coluna, NOT NULL violado etc.
+            raise HTTPException(status_code=400, detail=f"Carga rejeitada: {e.diag.message_primary or e}")
+
+        return {
+            "system": system,
+            "rows": received,
+            "updated": updated,
+            "inserted": inserted,
+            "updatedAt": updated_at.isoformat(),
+        }
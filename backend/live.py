@@ -0,0 +1,170 @@
+import asyncio
+import json
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Set
+
+import psycopg
+from fastapi.encoders import jsonable_encoder
+from psycopg import sql
+
+from queries import fold_identifier, qualified_table
+
+logger = logging.getLogger(__name__)
+
+# Canal usado pelos triggers instalados com `python manage.py install-triggers`
+NOTIFY_CHANNEL = 'kpi_tv_changes'
+
+# Eventos acumulados por cliente antes de começar a descartar os mais antigos
+SUBSCRIBER_QUEUE_SIZE = 100
+
+
+def build_notify_triggers_sql(sistemas: Dict[str, Dict[str, Any]]) -> List[sql.Composed]:
+    """Gera o SQL que cria a função de NOTIFY e um trigger por tabela do SISTEMAS_DB.
+
+    O trigger é por statement, então uma carga em lote gera um único aviso
+    por tabela, com o nome da tabela como payload.
+    """
+    tables = sorted({(config['schema'], config['tabela']) for config in sistemas.values()})
+    function = lambda schema: sql.SQL("{}.notify_kpi_change").format(fold_identifier(schema))
+    statements = []
+    for schema in sorted({schema for schema, _ in tables}):
+        statements.append(sql.SQL("""
+            CREATE OR REPLACE FUNCTION {function}() RETURNS trigger AS $$
+            BEGIN
+                PERFORM pg_notify({channel}, TG_TABLE_NAME);
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql
+        """).format(function=function(schema), channel=sql.Literal(NOTIFY_CHANNEL)))
+    for schema, tabela in tables:
+        trigger = fold_identifier(f"{tabela}_notify")
+        table = qualified_table({'schema': schema, 'tabela': tabela})
+        statements.append(sql.SQL("DROP TRIGGER IF EXISTS {} ON {}").format(trigger, table))
+        statements.append(sql.SQL("""
+            CREATE TRIGGER {trigger}
+            AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {table}
+            FOR EACH STATEMENT EXECUTE FUNCTION {function}()
+        """).format(trigger=trigger, table=table, function=function(schema)))
+    return statements
+
+
+def format_sse(event: str, data: Any) -> str:
+    """Formata uma mensagem no padrão Server-Sent Events.
+
+    Os dados passam pelo mesmo jsonable_encoder das respostas REST, para que
+    Decimal chegue como número (e não como string) no frontend.
+    """
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+class LiveUpdates:
+    """Recalcula e distribui para os dashboards conectados os KPIs/séries que mudaram.
+
+    As mudanças chegam por LISTEN/NOTIFY ou, para tabelas sem trigger, pela
+    comparação periódica do watermark (feita só enquanto há clientes
+    conectados). Avisos em sequência são agrupados por `debounce` segundos,
+    então cada mudança custa um recálculo, não um por tela.
+    """
+
+    def __init__(
+        self,
+        dsn: str,
+        table_systems: Dict[str, List[str]],
+        fetch_watermark: Callable[[str], Awaitable[Any]],
+        compute: Callable[[str], Awaitable[Dict[str, Any]]],
+        poll_interval: float,
+        debounce: float = 1.0,
+    ):
+        self.dsn = dsn
+        self.table_systems = table_systems
+        self.fetch_watermark = fetch_watermark
+        self.compute = compute
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._dirty: Set[str] = set()
+        self._wakeup = asyncio.Event()
+        self._watermarks: Dict[str, Any] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    @property
+    def systems(self) -> List[str]:
+        return [system for systems in self.table_systems.values() for system in systems]
+
+    async def start(self) -> None:
+        self._tasks = [
+            asyncio.create_task(self._listen()),
+            asyncio.create_task(self._poll()),
+            asyncio.create_task(self._process()),
+        ]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+    def mark_dirty(self, systems: Iterable[str]) -> None:
+        """Agenda o recálculo dos sistemas informados"""
+        systems = set(systems)
+        if systems:
+            self._dirty |= systems
+            self._wakeup.set()
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        for queue in self._subscribers:
+            if queue.full():
+                # Cliente lento: descarta o evento mais antigo para não travar os demais
+                queue.get_nowait()
+            queue.put_nowait(event)
+
+    async def _listen(self) -> None:
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.dsn, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    async for notify in conn.notifies():
+                        self.mark_dirty(self.table_systems.get(notify.payload, []))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("LISTEN %s falhou, tentando novamente: %s", NOTIFY_CHANNEL, e)
+                await asyncio.sleep(self.poll_interval)
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if not self._subscribers:
+                continue
+            for system in self.systems:
+                try:
+                    watermark = await self.fetch_watermark(system)
+                except Exception as e:
+                    logger.warning("Falha ao consultar o watermark de %s: %s", system, e)
+                    continue
+                previous = self._watermarks.get(system, watermark)
+                self._watermarks[system] = watermark
+                if watermark != previous:
+                    self.mark_dirty([system])
+
+    async def _process(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.debounce)
+            self._wakeup.clear()
+            systems, self._dirty = self._dirty, set()
+            for system in systems:
+                try:
+                    payload = await self.compute(system)
+                except Exception as e:
+                    logger.warning("Falha ao recalcular %s: %s", system, e)
+                    payload = {"error": str(e)}
+                self.publish({"system": system, **payload})
@@ -1,12 +1,182 @@
-from datetime import datetime
-from typing import List, Dict, Any
-from fastapi import FastAPI, HTTPException
+import asyncio
+import json
+import logging
+import secrets
+from contextlib import asynccontextmanager
+from datetime import date, datetime
+from typing import List, Dict, Any, Literal, Optional
+import psycopg
+from psycopg import sql
+from psycopg_pool import PoolTimeout
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
-import psycopg_pool
-from config import DATABASE_URL, DB_TIMEOUT
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:  # brotli é opcional; sem ele a compressão fica só em gzip
+    BrotliMiddleware = None
+from aggregate import build_aggregate_query, build_facets_query
+from cache import CacheEntry, SingleFlight, WatermarkCache
+from conditional import conditional_headers, is_not_modified, not_modified_response, watermark_datetime
+from deadline import DeadlineMiddleware
+from detailed import (
+    ARROW_MEDIA_TYPE, DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, STREAM_CHUNK_SIZE, TIEBREAK_COL, pa,
+    build_converters, build_detailed_query, encode_cursor, resolve_columns,
+    to_arrow_ipc, to_columnar, to_row_dicts,
+)
+from downsample import lttb, min_max
+from ingest import BulkIngest, ingest_format
+from live import LiveUpdates, format_sse
+from metrics import (
+    InstrumentedCursor, MetricsMiddleware, StartupTimes, TimedJSONResponse, measure_serialization, render_metrics,
+    set_known_systems,
+)
+from queries import CompiledQuery, QueryRegistry, build_range_series_query, filtro_values
+from report import MonthlyReport, parse_month
+from resilience import CircuitBreaker, CircuitOpenError, LastGoodStore, ResilientPool
+from rollups import RollupManager, RollupRefresher
+from snapshots import SnapshotPublisher, SnapshotStore, encode_body
+from config import (
+    DATABASE_URL, DB_TIMEOUT, REQUEST_TIMEOUT_MAX_MS, POOL_MIN_SIZE, POOL_MAX_SIZE, POOL_WARMUP_PREPARE, CACHE_TTL, COMPRESSION_MIN_SIZE, STREAM_POLL_INTERVAL, HTTP_MAX_AGE, ROLLUP_SCHEMA,
+    ROLLUP_REFRESH_INTERVAL, ROLLUP_OVERLAP, ROLLUP_STATEMENT_TIMEOUT_MS,
+    STATEMENT_TIMEOUT_MS, CACHE_STALE_WAIT, CACHE_STALE_MAX, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT,
+    SNAPSHOT_PATH, SNAPSHOT_INTERVAL, SNAPSHOT_MAX_AGE, SERIES_MAX_POINTS, INGEST_TOKEN, INGEST_STATEMENT_TIMEOUT_MS,
+)
+
+logger = logging.getLogger(__name__)
+
+# Pool assíncrono de conexões com o banco de dados PostgreSQL, criado só no
+# lifespan (importar o módulo não abre conexões nem precisa do banco).
+# O pool e os cursores são instrumentados para o /metrics e o Server-Timing.
+# Após falhas seguidas do banco o circuit breaker recusa conexões na hora,
+# e as respostas saem do último valor bom (stale) em vez de esperar o timeout.
+pool: Optional[ResilientPool] = None
+
+# Tempos do startup (expostos no /readyz e no /metrics)
+startup = StartupTimes()
+
+def create_pool() -> ResilientPool:
+    """Cria o pool (fechado); as conexões são abertas em segundo plano pelo `open`"""
+    return ResilientPool(
+        DATABASE_URL,
+        min_size=POOL_MIN_SIZE,
+        max_size=POOL_MAX_SIZE,
+        open=False,
+        timeout=DB_TIMEOUT,
+        breaker=CircuitBreaker(CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT),
+        # Teto do statement_timeout ajustado ao prazo de cada requisição
+        statement_timeout_ms=STATEMENT_TIMEOUT_MS,
+        # Cada conexão nova já chega com as queries mais usadas preparadas
+        configure=configure_connection if POOL_WARMUP_PREPARE else None,
+        # Todas as consultas são de leitura; autocommit evita BEGIN/ROLLBACK extras
+        # e permite isolar erros por ponto de sincronização no pipeline mode.
+        # O statement_timeout limita cada query (0 desliga).
+        kwargs={
+            'autocommit': True,
+            'cursor_factory': InstrumentedCursor,
+            'options': f'-c statement_timeout={STATEMENT_TIMEOUT_MS}',
+        }
+    )
+
+def warmup_statements() -> List[CompiledQuery]:
+    """Queries de KPI, série e watermark de todos os sistemas válidos (as do /api/dashboard)"""
+    statements = []
+    for system in SISTEMAS_DB:
+        if system in registry.errors:
+            # Sistema com tabela/coluna inválida: o dashboard já devolve o erro dele sem consultar
+            continue
+        queries = registry.get(system)
+        statements += [queries.kpi, get_series_query(system), queries.watermark]
+    return statements
+
+async def prepare_statements(conn: psycopg.AsyncConnection) -> None:
+    """Prepara as queries do dashboard na conexão nova, em um único round trip.
+
+    Roda no warm-up e no `configure` do pool, antes de a conexão ser entregue
+    a alguma requisição; uma falha só é registrada (a conexão continua válida e as
+    queries são preparadas no primeiro uso, como antes).
+    """
+    try:
+        async with conn.pipeline():
+            for statement in warmup_statements():
+                await conn.execute(statement.query, statement.params, prepare=True)
+    except psycopg.Error as e:
+        logger.warning("Não foi possível preparar as queries na conexão nova: %s", e)
+
+async def configure_connection(conn: psycopg.AsyncConnection) -> None:
+    """`configure` do pool: só prepara depois da validação, com o SQL já na grafia real das colunas.
+
+    O preparo é só otimização: qualquer erro é registrado e a conexão é
+    entregue assim mesmo (uma exceção aqui impediria o pool de abrir conexões).
+    """
+    if startup.validated is None:
+        return
+    try:
+        await prepare_statements(conn)
+    except Exception:
+        logger.exception("Falha inesperada ao preparar as queries na conexão nova")
+
+async def warm_up() -> None:
+    """Valida as queries, confere os rollups, aquece o pool e marca a API como pronta (/readyz).
+
+    Roda em segundo plano para o servidor aceitar requisições na hora; sem
+    banco, tenta de novo com espera crescente até conseguir.
+    """
+    delay = 1.0
+    while True:
+        try:
+            async with pool.connection() as conn:
+                await registry.validate(conn)
+                if not await rollups.check(conn):
+                    logger.info("Tabelas de rollup não encontradas; séries lidas das tabelas originais")
+            break
+        except psycopg.Error as e:
+            # Sem banco as queries seguem compiladas, só não validadas
+            logger.warning("Não foi possível validar as queries no startup (nova tentativa em %.0fs): %s", delay, e)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, CIRCUIT_RESET_TIMEOUT)
+    startup.mark('validated')
+    if POOL_WARMUP_PREPARE:
+        # Troca as conexões abertas antes da validação por outras já preparadas
+        await pool.drain()
+        try:
+            await pool.wait(timeout=DB_TIMEOUT)
+        except PoolTimeout:
+            logger.warning("Pool não atingiu %d conexão(ões) no warm-up", POOL_MIN_SIZE)
+    logger.info("API pronta em %.0f ms", startup.mark('ready') * 1000)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global pool
+    pool = create_pool()
+    # Não espera o min_size: as conexões (e o warm-up) seguem em segundo plano
+    await pool.open(wait=False)
+    warm_up_task = asyncio.create_task(warm_up())
+    await live.start()
+    await rollup_refresher.start()
+    if snapshots:
+        await snapshots.open()
+    if snapshot_publisher:
+        await snapshot_publisher.start()
+    logger.info("Servidor aceitando requisições em %.0f ms", startup.mark('serving') * 1000)
+    try:
+        yield
+    finally:
+        warm_up_task.cancel()
+        if snapshot_publisher:
+            await snapshot_publisher.stop()
+        await rollup_refresher.stop()
+        await live.stop()
+        await pool.close()
 
 # Inicializa a aplicação FastAPI
-app = FastAPI(title="B&O Dashboard API")
+app = FastAPI(title="B&O Dashboard API", lifespan=lifespan, default_response_class=TimedJSONResponse)
+
+# Prazo por requisição (header X-Timeout-Ms, padrão DB_TIMEOUT): vira o statement_timeout,
+# e a query é cancelada se o cliente desconectar ou o prazo acabar (mais interno de todos)
+app.add_middleware(DeadlineMiddleware, default=DB_TIMEOUT, maximum=REQUEST_TIMEOUT_MAX_MS / 1000)
 
 # Configura o middleware de CORS para permitir requisições de qualquer origem
 app.add_middleware(
@@ -15,16 +185,31 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Last-Modified", "Server-Timing"],
 )
 
-# Cria o pool de conexões com o banco de dados PostgreSQL
-pool = psycopg_pool.ConnectionPool(
-    DATABASE_URL,
-    min_size=1,
-    max_size=5,
-    open=True,
-    timeout=DB_TIMEOUT
-)
+# Comprime as respostas conforme o Accept-Encoding (brotli quando disponível, senão gzip)
+if BrotliMiddleware is not None:
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_SIZE, gzip_fallback=True)
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
+# Mede cada requisição (o mais externo, para ver o tamanho já comprimido)
+app.add_middleware(MetricsMiddleware)
+
+# Banco lento ou fora do ar: responde 503 (com Retry-After quando o circuito está aberto)
+@app.exception_handler(psycopg.OperationalError)
+async def database_unavailable(request: Request, exc: psycopg.OperationalError):
+    headers = {'Retry-After': str(int(exc.retry_after) + 1)} if isinstance(exc, CircuitOpenError) else None
+    return JSONResponse({"detail": "Banco de dados indisponível"}, status_code=503, headers=headers)
+
+# Cache de KPIs e séries, invalidado quando o MAX(updated_col) da tabela muda.
+# Se a revalidação falhar ou demorar, serve o último valor bom marcado como stale.
+cache = WatermarkCache(ttl=CACHE_TTL, stale_wait=CACHE_STALE_WAIT, stale_max=CACHE_STALE_MAX, budget=DB_TIMEOUT)
+
+# Último resultado bom de cada sistema no /api/dashboard, e execuções em andamento
+dashboard_last_good = LastGoodStore(CACHE_STALE_MAX)
+dashboard_flight = SingleFlight(DB_TIMEOUT)
 
 # Configuração dos sistemas e seus respectivos parâmetros de consulta
 SISTEMAS_DB = {
@@ -32,11 +217,14 @@ SISTEMAS_DB = {
         'schema': 'kpi_tv',
         'tabela': 'piperun_daily',
         'filtro_col': 'pipeline_id',
-        'filtro_val': '78157',
+        # O primeiro valor é o dos cards da TV; a lista toda é usada na página de detalhes
+        'filtro_val': ['78157', '78175', '78291'],
         'date_col': 'ref_date',
         'updated_col': 'updated_at',
         'kpi_cols': ['oportunidades_recebidas', 'oportunidades_ganhas', 'oportunidades_perdidas'],
         'chart_col': 'oportunidades_recebidas',
+        'dimensions': ['pipeline_id', 'pipeline_name'],
+        'metrics': ['oportunidades_recebidas', 'oportunidades_ganhas', 'oportunidades_perdidas'],
         'kpi_query_type': 'single_row',
         'series_aggregation': 'SUM'
     },
@@ -49,6 +237,8 @@ SISTEMAS_DB = {
         'updated_col': 'updated_at',
         'kpi_cols': ['flows_total', 'runs_success', 'runs_failed', 'avg_duration_sec'],
         'chart_col': 'runs_success',
+        'dimensions': ['workspace_id', 'workspace_name'],
+        'metrics': ['flows_total', 'runs_success', 'runs_failed', 'avg_duration_sec'],
         'kpi_query_type': 'single_row',
         'series_aggregation': 'SUM'
     },
@@ -61,6 +251,12 @@ SISTEMAS_DB = {
         'updated_col': 'updated_at',
         'kpi_cols': ['recebiveisHojeValor', 'entradaValor', 'pagaveisHojeValor'],
         'chart_col': 'entradaValor',
+        'dimensions': ['topClient', 'topFornecedor'],
+        'metrics': ['recebiveisHojeQuant', 'recebiveisHojeValor', 'recebiveis7DiasQuant', 'recebiveis7DiasValor',
+                    'pagaveisHojeQuant', 'pagaveisHojeValor', 'pagaveis7DiasQuant', 'pagaveis7DiasValor',
+                    'entradasQuant', 'entradaValor', 'saidaQuant', 'saidaValor', 'fluxoCaixa',
+                    'topClientValor', 'topFornecedorValor', 'esperadaQuant', 'esperadaValor',
+                    'inadimplentesQuant', 'inadimplentesValor'],
         'kpi_query_type': 'single_row',
         'series_aggregation': 'SUM'
     },
@@ -85,6 +281,11 @@ SISTEMAS_DB = {
         'updated_col': 'updated_at',
         'kpi_cols': ['cost', 'leads', 'clicks', 'cpl', 'cpc'],
         'chart_col': 'clicks',
+        'dimensions': ['account_id', 'account_name', 'campaign_id', 'campaign_name'],
+        # Uma linha por campanha e dia no /api/ingest
+        'ingest_dimensions': ['campaign_id'],
+        'metrics': ['cost', 'leads', 'clicks', 'cpl', 'cpc', 'impressions', 'reach', 'frequency',
+                    'average_total_spend', 'taxa_de_conversao'],
         'kpi_query_type': 'aggregated',
         'kpi_aggregations': {
             'cost': 'SUM',
@@ -104,6 +305,9 @@ SISTEMAS_DB = {
         'updated_col': 'updated_at',
         'kpi_cols': ['cost', 'leads', 'clicks', 'cpl', 'cpc'],
         'chart_col': 'clicks',
+        'dimensions': ['account_id', 'account_name', 'campaign_name'],
+        'ingest_dimensions': ['account_id', 'campaign_name'],
+        'metrics': ['cost', 'leads', 'clicks', 'cpl', 'cpc', 'roas', 'impressions', 'gasto_medio'],
         'kpi_query_type': 'aggregated',
         'kpi_aggregations': {
             'cost': 'SUM',
@@ -147,6 +351,11 @@ SISTEMAS_DB = {
         'updated_col': 'update_at',
         'kpi_cols': ['conn_state_open', 'conn_state_not_open', 'messages_sent_total', 'frt_avg_minutes', 'total_instances'],
         'chart_col': 'messages_sent_total',
+        'dimensions': ['instance_id', 'instance_name', 'owner', 'instance_status', 'conn_state_current'],
+        'ingest_dimensions': ['instance_id'],
+        'metrics': ['messages_sent_total', 'client_messages', 'response_messages', 'delivered_message',
+                    'read_for_client', 'delivered_rate_pct', 'read_rate_pct', 'chats_active', 'total_chats',
+                    'frt_seconds', 'frt_avg_minutes', 'chats_no_response_over_threshold'],
         'kpi_query_type': 'custom',
         'custom_kpi_query': """
             SELECT 
@@ -167,264 +376,916 @@ SISTEMAS_DB = {
         'custom_series_query': """
             SELECT {date_col}, COUNT(*) as value_sum
             FROM {schema}.{tabela}
+            {where_filter}
             GROUP BY {date_col}
             ORDER BY {date_col} DESC
             LIMIT 14
-        """
+        """,
+        # Equivalente da custom_series_query no rollup (linhas por dia)
+        'rollup_series': {'col': '*', 'aggregation': 'COUNT'}
     },
 }
 
-def build_kpi_query(config: Dict[str, Any]) -> str:
-    """Constrói a query de KPI baseada na configuração do sistema"""
-    schema = config['schema']
-    tabela = config['tabela']
-    date_col = config['date_col']
-    updated_col = config['updated_col']
-    filtro_col = config['filtro_col']
-    kpi_query_type = config['kpi_query_type']
-    
-    # Constrói as condições de filtro
-    where_filter = f"WHERE {filtro_col} = %s" if filtro_col else ""
-    and_filter = f"AND {filtro_col} = %s" if filtro_col else ""
-    
-    if kpi_query_type == 'custom':
-        # Para queries customizadas como evolution
-        return config['custom_kpi_query'].format(
-            schema=schema,
-            tabela=tabela,
-            date_col=date_col,
-            updated_col=updated_col,
-            where_filter=where_filter,
-            and_filter=and_filter
-        )
-    elif kpi_query_type == 'aggregated':
-        # Para sistemas que precisam de agregação como meta_ads/google_ads
-        kpi_aggregations = config['kpi_aggregations']
-        select_clause = ", ".join([
-            f"{agg}({col}) AS {col}_{agg.lower()}" 
-            for col, agg in kpi_aggregations.items()
-        ])
-        return f"""
-            SELECT 
-                {select_clause},
-                MAX({updated_col}) AS updated_at
-            FROM {schema}.{tabela}
-            WHERE {date_col} = (
-                SELECT MAX({date_col}) FROM {schema}.{tabela}
-                {where_filter}
-            )
-            {and_filter}
-        """
-    else:
-        # Para sistemas que pegam a linha mais recente (single_row)
-        kpi_cols = config['kpi_cols']
-        return f"""
-            SELECT {', '.join(kpi_cols)}, {updated_col}
-            FROM {schema}.{tabela}
-            {where_filter}
-            ORDER BY {date_col} DESC
-            LIMIT 1
-        """
-
-def build_series_query(config: Dict[str, Any]) -> str:
-    """Constrói a query de série temporal baseada na configuração do sistema"""
-    
-    # Se tem query customizada para série, usa ela
-    if 'custom_series_query' in config:
-        schema = config['schema']
-        tabela = config['tabela']
-        date_col = config['date_col']
-        filtro_col = config['filtro_col']
-        
-        where_filter = f"WHERE {filtro_col} = %s" if filtro_col else ""
-        
-        return config['custom_series_query'].format(
-            schema=schema,
-            tabela=tabela,
-            date_col=date_col,
-            where_filter=where_filter
-        )
-    
-    # Caso contrário, usa a lógica padrão
-    schema = config['schema']
-    tabela = config['tabela']
-    date_col = config['date_col']
-    filtro_col = config['filtro_col']
-    chart_col = config['chart_col']
-    series_aggregation = config['series_aggregation']
-    
-    where_filter = f"WHERE {filtro_col} = %s" if filtro_col else ""
-    
-    return f"""
-        SELECT {date_col}, {series_aggregation}({chart_col}) as value_sum
-        FROM {schema}.{tabela}
-        {where_filter}
-        GROUP BY {date_col}
-        ORDER BY {date_col} DESC
-        LIMIT 14
-    """
+# Seções do relatório mensal (/api/report/monthly, página RelatorioGeral):
+# métricas diárias (`coluna:funcao`; `last` = linha mais recente do dia),
+# filtros fixos de dimensão e colunas da linha mais recente do mês
+RELATORIO_MENSAL = {
+    'meta_ads': {'metrics': {'leads': 'leads:sum'}},
+    'google_ads': {'metrics': {'leads': 'leads:sum'}},
+    'conta_azul': {
+        'metrics': {'recebido': 'entradaValor:sum', 'receber': 'recebiveisHojeValor:last'},
+        'latest': ['inadimplentesValor', 'inadimplentesQuant', 'recebiveis7DiasValor', 'pagaveis7DiasValor'],
+    },
+    'piperun': {
+        'where': {'pipeline_name': '00. PRE-RECEPTIVO BRANCO'},
+        'metrics': {'recebidas': 'oportunidades_recebidas:sum', 'ganhas': 'oportunidades_ganhas:sum'},
+    },
+}
 
-def get_query_params(config: Dict[str, Any]) -> tuple:
-    """Retorna os parâmetros para as queries baseado na configuração"""
-    filtro_col = config['filtro_col']
-    filtro_val = config['filtro_val']
-    
-    if not filtro_col:
-        return ()
-    
-    kpi_query_type = config['kpi_query_type']
-    if kpi_query_type in ['custom', 'aggregated']:
-        # Para queries que precisam do filtro duas vezes (subquery + where principal)
-        return (filtro_val, filtro_val)
-    else:
-        # Para queries single_row que só precisam do filtro uma vez
-        return (filtro_val,)
+# Queries de KPI, série e watermark compiladas uma única vez (validadas no lifespan)
+registry = QueryRegistry(SISTEMAS_DB)
+
+# Só os sistemas configurados viram label `system` nas métricas
+set_known_systems(SISTEMAS_DB)
+
+# Rollups diário/mensal atualizados incrementalmente (criados com `python manage.py refresh-rollups`)
+rollups = RollupManager(
+    SISTEMAS_DB, registry, ROLLUP_SCHEMA, overlap=ROLLUP_OVERLAP, statement_timeout_ms=ROLLUP_STATEMENT_TIMEOUT_MS
+)
 
-def get_kpi_and_series(system: str) -> tuple[Dict[str, Any], Dict[str, Any]]:
-    """Função refatorada que usa configuração ao invés de if/else"""
+# Relatório mensal consolidado, montado no banco em um único round trip
+monthly_report = MonthlyReport(RELATORIO_MENSAL, SISTEMAS_DB, registry, rollups)
+
+def get_system_config(system: str) -> Dict[str, Any]:
+    """Retorna a configuração do sistema ou 404 se ele não existir"""
     if system not in SISTEMAS_DB:
         raise HTTPException(status_code=404, detail="Sistema não encontrado")
+    return SISTEMAS_DB[system]
+
+def format_kpi_row(kpi_row: tuple) -> Dict[str, Any]:
+    """Monta a resposta de KPIs a partir da linha retornada pela query"""
+    kpi_values = list(kpi_row[:-1])
+    updated_at = kpi_row[-1]
     
-    config = SISTEMAS_DB[system]
-    
-    with pool.connection() as conn:
-        with conn.cursor() as cur:
-            # Executa query de KPI
-            kpi_query = build_kpi_query(config)
-            kpi_params = get_query_params(config)
-            
-            cur.execute(kpi_query, kpi_params)
-            kpi_row = cur.fetchone()
-            
-            if not kpi_row:
-                raise HTTPException(status_code=404, detail="Dados não encontrados")
-            
-            kpi_values = list(kpi_row[:-1])
-            updated_at = kpi_row[-1]
-            
-            # Executa query de série temporal
-            series_query = build_series_query(config)
-            series_params = (config['filtro_val'],) if config['filtro_col'] else ()
-            
-            cur.execute(series_query, series_params)
-            series_rows = cur.fetchall()
-            
-            # Monta os pontos da série para o frontend (ordem cronológica crescente)
-            series_points = [
-                {
-                    "x": row[0].date().isoformat() if isinstance(row[0], datetime) else str(row[0]),
-                    "y": float(row[1]) if row[1] is not None else 0
-                }
-                for row in reversed(series_rows)
-            ]
-    
-    # Monta as respostas
-    kpis_response = {
+    return {
         "values": kpi_values,
         "updatedAt": updated_at.isoformat() if isinstance(updated_at, datetime) else str(updated_at)
     }
+
+def format_series_rows(system: str, series_rows: List[tuple]) -> Dict[str, Any]:
+    """Monta os pontos da série para o frontend (ordem cronológica crescente)"""
+    series_points = [
+        {
+            "x": row[0].date().isoformat() if isinstance(row[0], datetime) else str(row[0]),
+            "y": float(row[1]) if row[1] is not None else 0
+        }
+        for row in reversed(series_rows)
+    ]
     
-    series_response = {
+    return {
         "points": series_points,
         "label": system
     }
+
+def watermark_query(system: str, filtro_vals: Optional[List[str]] = None, rollup: bool = False) -> CompiledQuery:
+    """Query do watermark do sistema; com `rollup`, junto com o último refresh do rollup (respostas lidas dele)"""
+    queries = registry.get(system)
+    if filtro_vals is not None:
+        watermark = CompiledQuery(queries.watermark_any.query, (filtro_vals,))
+    else:
+        watermark = queries.watermark
+    if rollup and rollups.supports(system):
+        return rollups.watermark_query(system, watermark)
+    return watermark
+
+async def fetch_watermark(system: str, filtro_vals: Optional[List[str]] = None, rollup: bool = False) -> Any:
+    """Consulta o watermark atual do sistema (consulta barata, usada pelo cache e pelos ETags).
+    
+    Com `rollup` e o rollup disponível, devolve (MAX(updated_col), último refresh
+    do rollup): o que foi lido do rollup antes de ele alcançar a origem não fica
+    guardado (no cache ou no navegador) com o watermark novo.
+    """
+    get_system_config(system)
+    watermark = watermark_query(system, filtro_vals, rollup)
+    
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(watermark.query, watermark.params, prepare=True)
+            row = await cur.fetchone()
+            return row[0] if len(row) == 1 else tuple(row)
+
+async def get_kpis_data(system: str) -> Dict[str, Any]:
+    """Executa somente a query de KPI do sistema"""
+    get_system_config(system)
+    kpi = registry.get(system).kpi
+    
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(kpi.query, kpi.params, prepare=True)
+            kpi_row = await cur.fetchone()
+    
+    if not kpi_row:
+        raise HTTPException(status_code=404, detail="Dados não encontrados")
+    
+    return format_kpi_row(kpi_row)
+
+def get_series_query(system: str) -> CompiledQuery:
+    """Query da série: do rollup diário quando disponível, senão da tabela original"""
+    return rollups.series(system) or registry.get(system).series
+
+async def get_series_data(system: str) -> Dict[str, Any]:
+    """Executa somente a query de série temporal do sistema"""
+    get_system_config(system)
+    series = get_series_query(system)
+    rollup_refresher.schedule([system])
+    
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(series.query, series.params, prepare=True)
+            series_rows = await cur.fetchall()
+    
+    return format_series_rows(system, series_rows)
+
+def parse_filtro(system: str, filtro: List[str]) -> Optional[List[str]]:
+    """Valores repetidos de `filtro` na query string (None quando não informados).
+    
+    Só valores listados em `filtro_val` são aceitos (os demais respondem 400,
+    como no /api/aggregate). A lista volta sem repetições e ordenada, para
+    que a mesma seleção em outra ordem use a mesma entrada do cache.
+    """
+    if not filtro:
+        return None
+    config = get_system_config(system)
+    if not config['filtro_col']:
+        raise HTTPException(status_code=400, detail=f"O sistema {system} não tem filtro_col para agrupar")
+    invalid = [value for value in dict.fromkeys(filtro) if value not in filtro_values(config)]
+    if invalid:
+        raise HTTPException(
+            status_code=400, detail=f"Valor não permitido para {config['filtro_col']}: {', '.join(invalid)}"
+        )
+    return sorted(set(filtro))
+
+def grouped_query(system: str, name: str) -> CompiledQuery:
+    """Query agrupada por filtro_col do registry (400 se o sistema não suportar)"""
+    compiled = getattr(registry.get(system), name)
+    if compiled is None:
+        raise HTTPException(status_code=400, detail=f"A consulta do sistema {system} não pode ser agrupada por filtro")
+    return compiled
+
+async def get_grouped_kpis_data(system: str, filtro_vals: List[str]) -> Dict[str, Any]:
+    """KPIs de vários valores do filtro em uma única query, com a resposta separada por grupo"""
+    kpi = grouped_query(system, 'kpi_grouped')
+    
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(kpi.query, (*kpi.params, filtro_vals), prepare=True)
+            kpi_rows = await cur.fetchall()
+    
+    found = {str(row[0]): format_kpi_row(row[1:]) for row in kpi_rows}
+    return {"groups": {value: found.get(value, {"error": "Dados não encontrados"}) for value in filtro_vals}}
+
+async def get_grouped_series_data(system: str, filtro_vals: List[str]) -> Dict[str, Any]:
+    """Séries de vários valores do filtro com um único GROUP BY filtro_col, date_col"""
+    series = rollups.grouped_series(system) or grouped_query(system, 'series_grouped')
+    rollup_refresher.schedule([system])
+    
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(series.query, (*series.params, filtro_vals), prepare=True)
+            series_rows = await cur.fetchall()
+    
+    by_group: Dict[str, List[tuple]] = {}
+    for filtro, ref_date, value in series_rows:
+        by_group.setdefault(str(filtro), []).append((ref_date, value))
+    return {"groups": {
+        value: {**format_series_rows(system, by_group.get(value, [])), "label": value}
+        for value in filtro_vals
+    }}
+
+def downsample_points(points: List[Dict[str, Any]], max_points: int, method: str) -> List[Dict[str, Any]]:
+    """Reduz os pontos (em ordem cronológica) a no máximo `max_points` com LTTB ou min/max"""
+    if len(points) <= max_points:
+        return points
+    ys = [point["y"] for point in points]
+    if method == 'minmax':
+        indexes = min_max(ys, max_points)
+    else:
+        xs = [date.fromisoformat(point["x"]).toordinal() for point in points]
+        indexes = lttb(xs, ys, max_points)
+    return [points[i] for i in indexes]
+
+def range_series_result(
+    system: str, rows: List[tuple], bucket: str, max_points: int, method: str
+) -> Dict[str, Any]:
+    series = format_series_rows(system, rows)
+    points = downsample_points(series["points"], max_points, method)
+    return {**series, "points": points, "bucket": bucket, "downsampled": len(points) < len(series["points"])}
+
+async def get_range_series_data(
+    system: str,
+    bucket: str,
+    date_from: Optional[date],
+    date_to: Optional[date],
+    max_points: int,
+    method: str,
+    filtro_vals: Optional[List[str]] = None,
+) -> Dict[str, Any]:
+    """Série entre `date_from` e `date_to` agrupada por dia/semana/mês (do rollup diário quando disponível).
+    
+    O banco devolve um ponto por intervalo; se ainda assim passar de
+    `max_points`, a série é reduzida no servidor.
+    """
+    config = get_system_config(system)
+    built = rollups.range_series(system, bucket, date_from, date_to, filtro_vals)
+    if built is None:
+        if 'custom_series_query' in config:
+            raise HTTPException(
+                status_code=400,
+                detail=f"A série do sistema {system} é customizada e só aceita intervalos a partir dos rollups"
+            )
+        registry.get(system)  # 500 se a configuração do sistema for inválida
+        built = build_range_series_query(config, bucket, date_from, date_to, filtro_vals, registry.resolver(system))
+    query, params = built
+    rollup_refresher.schedule([system])
+    
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params, prepare=True)
+            rows = await cur.fetchall()
     
-    return kpis_response, series_response
+    if filtro_vals is None:
+        return range_series_result(system, rows, bucket, max_points, method)
+    by_group: Dict[str, List[tuple]] = {}
+    for filtro, ref_date, value in rows:
+        by_group.setdefault(str(filtro), []).append((ref_date, value))
+    return {"groups": {
+        value: {**range_series_result(system, by_group.get(value, []), bucket, max_points, method), "label": value}
+        for value in filtro_vals
+    }}
 
-# Endpoint para retornar os KPIs do sistema
+def stale_marker(age: float) -> Dict[str, Any]:
+    """Campos adicionados às respostas servidas do último valor bom"""
+    return {"stale": True, "age": int(age)}
+
+# Respostas lidas do rollup diário: o watermark inclui o último refresh do rollup
+ROLLUP_KINDS = {'series', 'series_grouped'}
+
+async def get_cached_entry(
+    kind: str, system: str, compute_fn, filtro_vals: Optional[List[str]] = None
+) -> CacheEntry:
+    """Serve o resultado do cache, revalidando pelo watermark e agrupando requisições idênticas.
+    
+    Com `filtro_vals` a chave e o watermark passam a considerar só esses valores do filtro.
+    """
+    get_system_config(system)
+    key = (kind, system) if filtro_vals is None else (kind, system, tuple(filtro_vals))
+    return await cache.get_entry(
+        key,
+        lambda: fetch_watermark(system, filtro_vals, rollup=kind in ROLLUP_KINDS),
+        lambda: compute_fn(system),
+    )
+
+async def get_cached(kind: str, system: str, compute_fn) -> Dict[str, Any]:
+    return (await get_cached_entry(kind, system, compute_fn)).value
+
+async def conditional_cached(
+    request: Request, kind: str, system: str, compute_fn, filtro_vals: Optional[List[str]] = None
+) -> Response:
+    """Responde 304 quando o cliente já tem a versão do watermark atual, sem serializar nada"""
+    return cached_response(request, await get_cached_entry(kind, system, compute_fn, filtro_vals))
+
+def cached_response(request: Request, entry: CacheEntry) -> Response:
+    """Resposta de uma entrada do cache com ETag/304 e a marcação de stale"""
+    headers = conditional_headers(request, entry.watermark, HTTP_MAX_AGE)
+    if entry.stale:
+        # Valor antigo servido durante uma falha: o cliente não deve guardá-lo
+        headers['Cache-Control'] = 'no-cache'
+        headers['Age'] = str(int(entry.age))
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+    with measure_serialization():
+        content = jsonable_encoder(entry.value)
+    if entry.stale:
+        content = {**content, **stale_marker(entry.age)}
+    return TimedJSONResponse(content, headers=headers)
+
+# Endpoint para retornar os KPIs do sistema (por grupo quando `filtro` é informado)
 @app.get("/api/kpis/{system}")
-async def get_kpis(system: str):
-    kpis, _ = get_kpi_and_series(system)
-    return kpis
+async def get_kpis(system: str, request: Request, filtro: List[str] = Query([])):
+    filtro_vals = parse_filtro(system, filtro)
+    if filtro_vals is None:
+        return await snapshot_response(request, f"kpis:{system}") or await conditional_cached(
+            request, 'kpis', system, get_kpis_data
+        )
+    return await conditional_cached(
+        request, 'kpis_grouped', system, lambda system: get_grouped_kpis_data(system, filtro_vals), filtro_vals
+    )
 
-# Endpoint para retornar a série histórica do sistema
+# Endpoint para retornar a série histórica do sistema (por grupo quando `filtro` é informado)
 @app.get("/api/series/{system}")
-async def get_series(system: str):
-    _, series = get_kpi_and_series(system)
-    return series
+async def get_series(
+    system: str,
+    request: Request,
+    filtro: List[str] = Query([]),
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    bucket: Optional[Literal['day', 'week', 'month']] = None,
+    max_points: Optional[int] = Query(None, ge=3),
+    downsample: Literal['lttb', 'minmax'] = 'lttb',
+):
+    """Sem parâmetros, os 14 dias mais recentes (cards da TV).
+    
+    `from`/`to` (inclusivos) e `bucket` pedem um intervalo qualquer, com um ponto
+    por dia, semana ou mês. Se o resultado passar de `max_points` (no máximo
+    SERIES_MAX_POINTS), a série é reduzida com `downsample=lttb` ou `minmax`.
+    """
+    filtro_vals = parse_filtro(system, filtro)
+    if date_from or date_to or bucket or max_points:
+        if date_from and date_to and date_from > date_to:
+            raise HTTPException(status_code=400, detail="`from` deve ser anterior a `to`")
+        headers = conditional_headers(request, await fetch_watermark(system, filtro_vals, rollup=True), HTTP_MAX_AGE)
+        if is_not_modified(request, headers):
+            return not_modified_response(headers)
+        content = await get_range_series_data(
+            system, bucket or 'day', date_from, date_to,
+            min(max_points or SERIES_MAX_POINTS, SERIES_MAX_POINTS), downsample, filtro_vals
+        )
+        with measure_serialization():
+            content = jsonable_encoder(content)
+        return TimedJSONResponse(content, headers=headers)
+    if filtro_vals is None:
+        return await snapshot_response(request, f"series:{system}") or await conditional_cached(
+            request, 'series', system, get_series_data
+        )
+    return await conditional_cached(
+        request, 'series_grouped', system, lambda system: get_grouped_series_data(system, filtro_vals), filtro_vals
+    )
 
-@app.get("/api/detailed/{system}")
-async def get_detailed_data(system: str):
-    """Retorna dados detalhados de um sistema específico"""
-    if system not in SISTEMAS_DB:
-        raise HTTPException(status_code=404, detail="Sistema não encontrado")
+async def get_dashboard_data(systems: List[str]) -> Dict[str, Any]:
+    """Executa KPIs e séries de vários sistemas em uma única conexão usando pipeline mode.
     
-    config = SISTEMAS_DB[system]
-    schema = config['schema']
-    tabela = config['tabela']
-    filtro_col = config['filtro_col']
-    filtro_val = config['filtro_val']
-    date_col = config['date_col']
-    updated_col = config['updated_col']
-    
-    with pool.connection() as conn:
-        with conn.cursor() as cur:
-            # Monta a query de detalhes usando a configuração
-            where_clause = f"WHERE {filtro_col} = %s" if filtro_col else ""
-            detailed_query = f"""
-                SELECT *
-                FROM {schema}.{tabela}
-                {where_clause}
-                ORDER BY {date_col} DESC, {updated_col} DESC
-                LIMIT 1000
-            """
-            
-            params = (filtro_val,) if filtro_col else ()
-            cur.execute(detailed_query, params)
-            rows = cur.fetchall()
+    Cada sistema termina com um ponto de sincronização, então uma falha só
+    aborta as queries daquele sistema. Os erros chegam na mesma ordem em que
+    as queries foram enviadas, o que permite associá-los ao sistema certo.
+    Um sistema que falhar recebe o último resultado bom, marcado como stale.
+    Se todos falharem por erro operacional (ex.: statement_timeout), o erro é
+    propagado para contar no circuit breaker.
+    """
+    results: Dict[str, Any] = {}
+    pending = []
+    errors: List[Exception] = []
+    rollup_refresher.schedule(systems)
+    
+    async with pool.connection() as conn:
+        try:
+            async with conn.pipeline() as p:
+                for system in systems:
+                    if system not in SISTEMAS_DB:
+                        results[system] = {"error": "Sistema não encontrado"}
+                        continue
+                    if system in registry.errors:
+                        results[system] = {"error": "; ".join(registry.errors[system])}
+                        continue
+                    
+                    queries = registry.get(system)
+                    kpi_cur = conn.cursor()
+                    series_cur = conn.cursor()
+                    for cur, compiled in ((kpi_cur, queries.kpi), (series_cur, get_series_query(system))):
+                        try:
+                            await cur.execute(compiled.query, compiled.params, prepare=True)
+                        except psycopg.Error as e:
+                            errors.append(e)
+                    try:
+                        await p.sync()
+                    except psycopg.Error as e:
+                        errors.append(e)
+                    pending.append((system, kpi_cur, series_cur))
+        except psycopg.Error as e:
+            errors.append(e)
+        
+        failures: List[psycopg.Error] = []
+        for system, kpi_cur, series_cur in pending:
+            try:
+                kpi_row = await kpi_cur.fetchone()
+                series_rows = await series_cur.fetchall()
+            except psycopg.Error:
+                error = errors.pop(0) if errors else None
+                failures.append(error)
+                results[system] = stale_dashboard_result(
+                    system, str(error).splitlines()[0] if error else "Falha ao consultar o sistema"
+                )
+                continue
             
-            # Pega os nomes das colunas
-            columns = [desc[0] for desc in cur.description]
+            if not kpi_row:
+                results[system] = {"error": "Dados não encontrados"}
+                continue
             
-            # Converte os resultados para lista de dicionários
-            detailed_data = []
-            for row in rows:
-                row_dict = {}
-                for i, value in enumerate(row):
-                    if isinstance(value, datetime):
-                        row_dict[columns[i]] = value.isoformat()
-                    else:
-                        row_dict[columns[i]] = value
-                detailed_data.append(row_dict)
+            results[system] = {
+                "kpis": format_kpi_row(kpi_row),
+                "series": format_series_rows(system, series_rows)
+            }
+            dashboard_last_good.put(system, results[system])
+        
+        if failures and len(failures) == len(pending) and all(isinstance(e, psycopg.OperationalError) for e in failures):
+            raise failures[0]
     
-    return detailed_data
+    return {"systems": {system: results[system] for system in systems}}
 
-@app.get("/api/detailed/piperun/all")
-async def get_piperun_all_pipelines():
-    """Retorna dados das 3 pipelines específicas do PipeRun para a página de detalhes"""
-    pipeline_ids = ['78157', '78175', '78291']
-    
-    with pool.connection() as conn:
-        with conn.cursor() as cur:
-            # Consulta dados das 3 pipelines específicas usando ANY
-            detailed_query = """
-                SELECT *
-                FROM kpi_tv.piperun_daily
-                WHERE pipeline_id = ANY(%s)
-                ORDER BY ref_date DESC, updated_at DESC
-                LIMIT 1000
-            """
-            
-            cur.execute(detailed_query, (pipeline_ids,))
-            rows = cur.fetchall()
-            
-            # Pega os nomes das colunas
-            columns = [desc[0] for desc in cur.description]
+def stale_dashboard_result(system: str, error: str) -> Dict[str, Any]:
+    """Último resultado bom do sistema marcado como stale, ou o erro se não houver"""
+    last_good = dashboard_last_good.get(system)
+    if last_good is None:
+        return {"error": error}
+    value, age = last_good
+    return {**value, **stale_marker(age)}
+
+async def serve_dashboard(systems: List[str]) -> Dict[str, Any]:
+    """Dashboard com stale-while-revalidate: espera a consulta por até CACHE_STALE_WAIT
+    segundos quando há resultados anteriores; depois disso (ou se o banco falhar)
+    responde com eles enquanto a consulta termina em segundo plano.
+    """
+    fetch = lambda: get_dashboard_data(systems)
+    if not any(dashboard_last_good.get(system) for system in systems if system in SISTEMAS_DB):
+        return await dashboard_flight.wait(tuple(systems), fetch)
+    try:
+        return await dashboard_flight.wait(tuple(systems), fetch, CACHE_STALE_WAIT)
+    except asyncio.TimeoutError:
+        error = "Banco de dados lento"
+    except psycopg.OperationalError:
+        error = "Banco de dados indisponível"
+    return {"systems": {
+        system: stale_dashboard_result(system, error) if system in SISTEMAS_DB else {"error": "Sistema não encontrado"}
+        for system in systems
+    }}
+
+# Endpoint que retorna KPIs e séries de vários sistemas em uma única requisição
+@app.get("/api/dashboard")
+async def get_dashboard(request: Request, systems: Optional[List[str]] = Query(None)):
+    if systems is None and (response := await snapshot_response(request, 'dashboard')):
+        return response
+    return await serve_dashboard(systems or list(SISTEMAS_DB))
+
+async def fetch_watermarks(systems: List[str]) -> Dict[str, Any]:
+    """Watermark de vários sistemas em um único round trip (pipeline mode).
+    
+    Os snapshots levam a série lida do rollup, então o watermark inclui o último refresh dele.
+    """
+    pending = []
+    async with pool.connection() as conn:
+        async with conn.pipeline():
+            for system in systems:
+                if system in registry.errors:
+                    continue
+                watermark = watermark_query(system, rollup=True)
+                cur = conn.cursor()
+                await cur.execute(watermark.query, watermark.params, prepare=True)
+                pending.append((system, cur))
+        watermarks = {}
+        for system, cur in pending:
+            row = await cur.fetchone()
+            watermarks[system] = row[0] if len(row) == 1 else tuple(row)
+        return watermarks
+
+async def compute_snapshots(systems: List[str], watermarks: Dict[str, Any]) -> Dict[str, Any]:
+    """Payloads pré-serializados do dashboard e de KPIs/séries de cada sistema, a partir de um único pipeline"""
+    data = await get_dashboard_data(systems)
+    latest = max(filter(None, map(watermark_datetime, watermarks.values())), default=None)
+    items = {'dashboard': (encode_body(jsonable_encoder(data)), latest)}
+    for system, result in data['systems'].items():
+        if 'kpis' not in result:
+            continue
+        marker = {key: result[key] for key in ('stale', 'age') if key in result}
+        for kind in ('kpis', 'series'):
+            items[f"{kind}:{system}"] = (encode_body(jsonable_encoder({**result[kind], **marker})), watermarks.get(system))
+    return items
+
+async def snapshot_response(request: Request, key: str) -> Optional[Response]:
+    """Resposta direto do snapshot compartilhado, sem tocar no Postgres (None se não houver um recente)"""
+    if snapshots is None:
+        return None
+    snapshot = await snapshots.get(key)
+    if snapshot is None or snapshot.age > SNAPSHOT_MAX_AGE:
+        return None
+    headers = conditional_headers(request, snapshot.watermark, HTTP_MAX_AGE)
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+    return Response(snapshot.body, media_type='application/json', headers=headers)
+
+# Snapshots compartilhados entre workers (opcional, ligado com SNAPSHOT_PATH):
+# um único worker recalcula e os demais só leem o arquivo
+snapshots = SnapshotStore(SNAPSHOT_PATH) if SNAPSHOT_PATH else None
+snapshot_publisher = SnapshotPublisher(
+    snapshots, list(SISTEMAS_DB), fetch_watermarks, compute_snapshots, SNAPSHOT_INTERVAL, SNAPSHOT_MAX_AGE
+) if snapshots else None
+
+async def compute_live_payload(system: str) -> Dict[str, Any]:
+    """Recalcula KPIs e série de um sistema que mudou, já atualizando o cache"""
+    cache.invalidate(lambda key: key[1] == system)
+    return {
+        "kpis": await get_cached('kpis', system, get_kpis_data),
+        "series": await get_cached('series', system, get_series_data)
+    }
+
+def build_table_systems() -> Dict[str, List[str]]:
+    """Mapeia o nome de cada tabela (payload do NOTIFY) para os sistemas que a usam"""
+    table_systems: Dict[str, List[str]] = {}
+    for system, config in SISTEMAS_DB.items():
+        table_systems.setdefault(config['tabela'], []).append(system)
+    return table_systems
+
+# Atualizações em tempo real via LISTEN/NOTIFY, com fallback pelo watermark
+live = LiveUpdates(
+    DATABASE_URL,
+    build_table_systems(),
+    fetch_watermark,
+    compute_live_payload,
+    poll_interval=STREAM_POLL_INTERVAL
+)
+
+async def rollups_refreshed(systems: List[str]) -> None:
+    """Descarta o que foi calculado com o rollup antigo e avisa os dashboards conectados"""
+    await invalidate_systems(systems)
+    live.mark_dirty(systems)
+
+# Atualiza os rollups em segundo plano: as requisições só leem (e antecipam a verificação com `schedule`)
+rollup_refresher = RollupRefresher(
+    rollups, list(SISTEMAS_DB), lambda: pool.connection(), ROLLUP_REFRESH_INTERVAL, rollups_refreshed
+)
+
+@app.get("/api/stream")
+async def stream_updates(request: Request, systems: Optional[List[str]] = Query(None)):
+    """Server-Sent Events: envia um snapshot inicial e depois só os sistemas que mudaram"""
+    selected = systems or list(SISTEMAS_DB)
+    queue = live.subscribe()
+    
+    async def events():
+        try:
+            yield format_sse('snapshot', await serve_dashboard(selected))
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Comentário SSE para manter a conexão viva através de proxies
+                    yield ': keepalive\n\n'
+                    continue
+                if event['system'] in selected:
+                    yield format_sse('update', event)
+        finally:
+            live.unsubscribe(queue)
+    
+    return StreamingResponse(
+        events(),
+        media_type='text/event-stream',
+        # Content-Encoding evita que o middleware de compressão segure os eventos em buffer
+        headers={'Cache-Control': 'no-cache', 'Content-Encoding': 'identity', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.get("/api/aggregate/{system}")
+async def get_aggregate(
+    system: str,
+    group_by: List[str] = Query([]),
+    metrics: List[str] = Query([]),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    filters: List[str] = Query([], alias="filter"),
+    facets: List[str] = Query([]),
+    order_by: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+):
+    """Agrega os dados do sistema no banco (GROUP BY) em vez de devolver as linhas brutas.
+    
+    Exemplo: `/api/aggregate/meta_ads?group_by=campaign_name&metrics=cost:sum&metrics=leads:sum
+    &date_from=2025-08-01&filter=account_name:Conta&order_by=-cost_sum&limit=15&facets=account_name`
+    """
+    config = get_system_config(system)
+    facets = list(dict.fromkeys(facets))
+    resolve = registry.resolver(system)
+    query, params, columns = build_aggregate_query(
+        config, group_by, metrics, date_from, date_to, filters, order_by, limit, resolve
+    )
+    
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            rows = [dict(zip(columns, row)) for row in await cur.fetchall()]
             
-            # Converte os resultados para lista de dicionários
-            detailed_data = []
-            for row in rows:
-                row_dict = {}
-                for i, value in enumerate(row):
-                    if isinstance(value, datetime):
-                        row_dict[columns[i]] = value.isoformat()
+            facet_values: Dict[str, List[Any]] = {}
+            if facets:
+                facets_query, facets_params = build_facets_query(config, facets, date_from, date_to, resolve)
+                await cur.execute(facets_query, facets_params)
+                facet_values = {col: [] for col in facets}
+                for index, value in await cur.fetchall():
+                    if value is not None:
+                        facet_values[facets[index]].append(value)
+    
+    return {"rows": rows, "facets": facet_values}
+
+@app.get("/api/monthly/{system}")
+async def get_monthly(
+    system: str,
+    metrics: List[str] = Query([]),
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+):
+    """Totais mensais lidos do rollup mensal (sem varrer a tabela original).
+
+    Exemplo: `/api/monthly/meta_ads?metrics=cost:sum&metrics=leads:sum&date_from=2025-01-01`
+    """
+    get_system_config(system)
+    if not rollups.supports(system):
+        raise HTTPException(status_code=503, detail="Rollups indisponíveis (rode `python manage.py refresh-rollups`)")
+    query, params, columns = rollups.monthly_query(system, metrics, date_from, date_to)
+    rollup_refresher.schedule([system])
+
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            rows = [
+                {"month": row[0].strftime('%Y-%m'), **dict(zip(columns, row[1:-1])), "updatedAt": row[-1]}
+                for row in await cur.fetchall()
+            ]
+
+    return {"months": rows}
+
+async def fetch_report_watermark() -> tuple:
+    """Watermark de cada sistema do relatório mensal (uma única query)"""
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(*monthly_report.watermark_query(), prepare=True)
+            return tuple(await cur.fetchone())
+
+async def get_monthly_report_data(month: Optional[date]) -> Dict[str, Any]:
+    rollup_refresher.schedule(monthly_report.systems)
+    async with pool.connection() as conn:
+        return await monthly_report.fetch(conn, month)
+
+@app.get("/api/report/monthly")
+async def get_report_monthly(request: Request, month: Optional[str] = None):
+    """Relatório mensal da página RelatorioGeral: meses disponíveis e, para o mês pedido
+    (`month=AAAA-MM`, padrão o mais recente), os pontos diários, totais e comparações de cada sistema.
+    
+    O resultado fica em cache por (mês, watermark dos sistemas).
+    """
+    target = parse_month(month) if month else None
+    entry = await cache.get_entry(
+        ('report_monthly', target),
+        fetch_report_watermark,
+        lambda: get_monthly_report_data(target),
+    )
+    return cached_response(request, entry)
+
+# Carga em lote das tabelas do SISTEMAS_DB (COPY + upsert), usada pelos fluxos do n8n
+bulk_ingest = BulkIngest(SISTEMAS_DB, INGEST_STATEMENT_TIMEOUT_MS)
+
+def check_ingest_token(request: Request) -> None:
+    """Exige `Authorization: Bearer <INGEST_TOKEN>`; sem INGEST_TOKEN configurado a ingestão fica desligada"""
+    if not INGEST_TOKEN:
+        raise HTTPException(status_code=403, detail="Ingestão desabilitada (defina INGEST_TOKEN)")
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not secrets.compare_digest(token.strip(), INGEST_TOKEN):
+        raise HTTPException(status_code=401, detail="Token de ingestão inválido",
+                            headers={'WWW-Authenticate': 'Bearer'})
+
+async def invalidate_table(tabela: str) -> None:
+    """Descarta neste worker o que depende da tabela que acabou de mudar.
+
+    Os outros workers são avisados pelo NOTIFY da própria carga (o LISTEN do
+    /api/stream invalida o cache de cada um e recalcula os sistemas).
+    """
+    await invalidate_systems(build_table_systems().get(tabela, []))
+
+async def invalidate_systems(systems: List[str]) -> None:
+    """Descarta neste worker o cache e os snapshots dos sistemas informados"""
+    cache.invalidate(lambda key: key[1] in systems or key[0] == 'report_monthly')
+    if snapshots:
+        # Sem o snapshot, os workers voltam ao caminho normal até a próxima publicação
+        await snapshots.discard(['dashboard', *(f"{kind}:{system}" for system in systems for kind in ('kpis', 'series'))])
+
+@app.post("/api/ingest/{system}")
+async def ingest(system: str, request: Request):
+    """Carga em lote (CSV com cabeçalho ou NDJSON) na tabela do sistema.
+
+    As linhas são validadas contra as colunas da tabela, copiadas com COPY e
+    gravadas com upsert por (filtro_col, date_col[, ingest_dimensions]) em uma
+    única transação. Depois do COMMIT o watermark já mudou e os caches do
+    sistema (inclusive snapshots) são renovados; os rollups são atualizados
+    logo em seguida, em segundo plano.
+    """
+    check_ingest_token(request)
+    config = get_system_config(system)
+    fmt = ingest_format(request.headers.get('content-type', ''))
+
+    async with pool.connection() as conn:
+        result = await bulk_ingest.load(conn, system, fmt, request.stream())
+    await invalidate_table(config['tabela'])
+    rollup_refresher.schedule(build_table_systems().get(config['tabela'], []))
+    return result
+
+# Colunas reais de cada tabela, lidas do information_schema na primeira consulta
+TABLE_COLUMNS: Dict[str, List[str]] = {}
+
+async def fetch_table_columns(system: str) -> List[str]:
+    """Retorna (e guarda em memória) as colunas da tabela do sistema"""
+    if system not in TABLE_COLUMNS:
+        config = get_system_config(system)
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute("""
+                    SELECT column_name
+                    FROM information_schema.columns
+                    WHERE table_schema = %s AND table_name = %s
+                    ORDER BY ordinal_position
+                """, (config['schema'], config['tabela']))
+                TABLE_COLUMNS[system] = [row[0] for row in await cur.fetchall()]
+    return TABLE_COLUMNS[system]
+
+def wants_stream(request: Request, stream: Optional[str]) -> Optional[str]:
+    """Decide o modo de streaming pelo parâmetro `stream` ou pelo header Accept"""
+    if stream:
+        return stream
+    if 'application/x-ndjson' in request.headers.get('accept', ''):
+        return 'ndjson'
+    return None
+
+def wants_format(request: Request, format: Optional[str]) -> str:
+    """Decide o formato da página pelo parâmetro `format` ou pelo header Accept"""
+    if format:
+        return format
+    if ARROW_MEDIA_TYPE in request.headers.get('accept', ''):
+        return 'arrow'
+    return 'json'
+
+async def stream_detailed(query: sql.Composable, params: list, columns: List[str], stream_format: str):
+    """Transmite as linhas lidas de um cursor nomeado (server-side) em blocos, sem acumular em memória"""
+    async with pool.connection() as conn:
+        # Cursores nomeados precisam de uma transação aberta
+        async with conn.transaction():
+            async with conn.cursor(name='detailed_stream') as cur:
+                await cur.execute(query, params)
+                names = [desc.name for desc in cur.description]
+                keep = [
+                    i for i, name in enumerate(names)
+                    if name != TIEBREAK_COL and (not columns or name in columns)
+                ]
+                converters = build_converters(cur.description)
+                
+                first = True
+                if stream_format == 'json':
+                    yield '['
+                while True:
+                    rows = await cur.fetchmany(STREAM_CHUNK_SIZE)
+                    if not rows:
+                        break
+                    lines = [
+                        json.dumps(record, ensure_ascii=False, separators=(',', ':'))
+                        for record in to_row_dicts(rows, names, keep, converters)
+                    ]
+                    if stream_format == 'json':
+                        yield ('' if first else ',') + ','.join(lines)
                     else:
-                        row_dict[columns[i]] = value
-                detailed_data.append(row_dict)
+                        yield '\n'.join(lines) + '\n'
+                    first = False
+                if stream_format == 'json':
+                    yield ']'
+
+async def query_detailed(
+    system: str,
+    request: Request,
+    columns: List[str],
+    after: Optional[str],
+    limit: Optional[int],
+    stream: Optional[str],
+    format: Optional[str],
+    filtro_vals: Optional[List[str]] = None,
+):
+    """Consulta paginada (keyset) ou em streaming dos dados detalhados de um sistema"""
+    config = get_system_config(system)
+    
+    # Só o watermark é consultado antes de decidir se a resposta mudou
+    headers = conditional_headers(request, await fetch_watermark(system, filtro_vals), HTTP_MAX_AGE)
+    if is_not_modified(request, headers):
+        return not_modified_response(headers)
+    
+    projection = resolve_columns(columns, await fetch_table_columns(system)) if columns else []
+    stream_format = wants_stream(request, stream)
+    
+    if stream_format:
+        query, params = build_detailed_query(config, projection, filtro_vals, after, limit, registry.resolver(system))
+        media_type = 'application/x-ndjson' if stream_format == 'ndjson' else 'application/json'
+        return StreamingResponse(
+            stream_detailed(query, params, projection, stream_format),
+            media_type=media_type,
+            headers=headers
+        )
     
-    return detailed_data
+    response_format = wants_format(request, format)
+    if response_format == 'arrow' and pa is None:
+        raise HTTPException(status_code=406, detail="Formato arrow indisponível (pyarrow não instalado)")
+    
+    page_size = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    query, params = build_detailed_query(config, projection, filtro_vals, after, page_size, registry.resolver(system))
+    
+    async with pool.connection() as conn:
+        async with conn.cursor() as cur:
+            await cur.execute(query, params)
+            rows = await cur.fetchall()
+            
+            # Pega os nomes das colunas e define a conversão de cada uma pelo tipo
+            columns = [desc.name for desc in cur.description]
+            converters = build_converters(cur.description, keep_temporal=response_format == 'arrow')
+    
+    # Mantém só a projeção pedida (a coluna de desempate nunca vai para o cliente)
+    keep = [
+        i for i, name in enumerate(columns)
+        if name != TIEBREAK_COL and (not projection or name in projection)
+    ]
+    
+    # Página cheia: informa o cursor para buscar a próxima
+    if len(rows) == page_size:
+        last = rows[-1]
+        headers['X-Next-Cursor'] = encode_cursor(
+            last[columns.index(registry.column_name(system, config['date_col']))],
+            last[columns.index(registry.column_name(system, config['updated_col']))],
+            last[columns.index(TIEBREAK_COL)]
+        )
+    
+    # Os valores já saem convertidos, então a resposta é montada direto, sem o jsonable_encoder
+    if response_format == 'arrow':
+        with measure_serialization():
+            body = to_arrow_ipc(rows, columns, keep, converters)
+        return Response(body, media_type=ARROW_MEDIA_TYPE, headers=headers)
+    with measure_serialization():
+        if response_format == 'columnar':
+            content = to_columnar(rows, columns, keep, converters)
+        else:
+            content = to_row_dicts(rows, columns, keep, converters)
+    return TimedJSONResponse(content, headers=headers)
+
+@app.get("/api/detailed/{system}")
+async def get_detailed_data(
+    system: str,
+    request: Request,
+    columns: List[str] = Query([]),
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    stream: Optional[Literal['ndjson', 'json']] = None,
+    format: Optional[Literal['json', 'columnar', 'arrow']] = None,
+    filtro: List[str] = Query([]),
+):
+    """Retorna dados detalhados de um sistema específico.
+    
+    Sem parâmetros, mantém o comportamento antigo (1000 linhas mais recentes).
+    `filtro` (repetível) troca o filtro fixo do sistema por `filtro_col = ANY(...)`.
+    `after` recebe o valor do header X-Next-Cursor da página anterior,
+    `columns` limita as colunas e `stream` transmite todas as linhas em NDJSON ou JSON.
+    `format=columnar` devolve `{"columns": [...], "data": [[...], ...]}` e `format=arrow`
+    (ou `Accept: application/vnd.apache.arrow.stream`) devolve um stream Arrow IPC.
+    """
+    return await query_detailed(
+        system, request, columns, after, limit, stream, format, filtro_vals=parse_filtro(system, filtro)
+    )
+
+@app.get("/api/detailed/piperun/all")
+async def get_piperun_all_pipelines(
+    request: Request,
+    columns: List[str] = Query([]),
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    stream: Optional[Literal['ndjson', 'json']] = None,
+    format: Optional[Literal['json', 'columnar', 'arrow']] = None,
+):
+    """Retorna dados de todas as pipelines do `filtro_val` do PipeRun para a página de detalhes"""
+    return await query_detailed(
+        'piperun', request, columns, after, limit, stream, format,
+        filtro_vals=filtro_values(SISTEMAS_DB['piperun'])
+    )
 
 # Endpoint raiz para teste da API
 @app.get("/")
 async def root():
     return {"message": "B&O Dashboard API"}
+
+# Métricas no formato do Prometheus (histogramas por endpoint/sistema e estado do pool)
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(render_metrics(pool, startup), media_type='text/plain; version=0.0.4')
+
+# Liveness: o processo está de pé e respondendo (não consulta o banco)
+@app.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+# Readiness: queries validadas e pool aquecido; 503 enquanto o warm-up não termina
+@app.get("/readyz")
+async def readyz():
+    stats = pool.get_stats() if pool is not None else {}
+    body = {
+        "status": "ready" if startup.ready is not None else "starting",
+        "startupMs": {
+            phase: round(value * 1000, 1) if value is not None else None
+            for phase, value in startup.phases().items()
+        },
+        "pool": {"size": stats.get('pool_size', 0), "available": stats.get('pool_available', 0)},
+        "circuit": pool.breaker.state if pool is not None else None,
+    }
+    return JSONResponse(body, status_code=200 if startup.ready is not None else 503)
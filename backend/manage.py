@@ -0,0 +1,151 @@
+"""Comandos de manutenção do backend.
+
+Uso:
+    python manage.py install-triggers
+    python manage.py check-queries
+    python manage.py refresh-rollups [--full] [sistema ...]
+    python manage.py indexes [--explain] [--create] [sistema ...]
+"""
+import argparse
+import asyncio
+import sys
+
+import psycopg
+
+from config import DATABASE_URL, ROLLUP_SCHEMA
+from indexes import check_indexes, explain_analyze, explain_targets, required_indexes
+from live import build_notify_triggers_sql
+from main import SISTEMAS_DB
+from queries import QueryRegistry
+from rollups import RollupManager
+
+
+def install_triggers(args):
+    """Cria os triggers de NOTIFY usados por /api/stream em todas as tabelas do SISTEMAS_DB"""
+    with psycopg.connect(DATABASE_URL) as conn:
+        for statement in build_notify_triggers_sql(SISTEMAS_DB):
+            conn.execute(statement)
+    print(f"Triggers instalados em {len({c['tabela'] for c in SISTEMAS_DB.values()})} tabelas")
+
+
+def check_queries(args):
+    """Valida as queries do SISTEMAS_DB contra o banco (colunas e EXPLAIN)"""
+    async def run():
+        registry = QueryRegistry(SISTEMAS_DB)
+        async with await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True) as conn:
+            return await registry.validate(conn)
+
+    errors = asyncio.run(run())
+    for system in SISTEMAS_DB:
+        status = "OK" if system not in errors else "ERRO"
+        print(f"{system:<12} {status}")
+        for error in errors.get(system, []):
+            print(f"    - {error}")
+    if errors:
+        sys.exit(1)
+
+
+def refresh_rollups(args):
+    """Cria as tabelas de rollup (se preciso) e atualiza os rollups diário e mensal"""
+    unknown = [system for system in args.systems if system not in SISTEMAS_DB]
+    if unknown:
+        sys.exit(f"Sistemas desconhecidos: {', '.join(unknown)}")
+
+    async def run():
+        registry = QueryRegistry(SISTEMAS_DB)
+        rollups = RollupManager(SISTEMAS_DB, registry, ROLLUP_SCHEMA)
+        async with await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True) as conn:
+            await registry.validate(conn)
+            await rollups.install(conn)
+            failed = False
+            for system in args.systems or list(SISTEMAS_DB):
+                if system in registry.errors:
+                    print(f"{system:<12} ERRO (configuração inválida, veja check-queries)")
+                    failed = True
+                    continue
+                try:
+                    days = await rollups.refresh(conn, system, full=args.full)
+                except psycopg.Error as e:
+                    print(f"{system:<12} ERRO {str(e).splitlines()[0]}")
+                    failed = True
+                    continue
+                print(f"{system:<12} {days} dia(s) atualizado(s)")
+            return failed
+
+    if asyncio.run(run()):
+        sys.exit(1)
+
+
+def indexes(args):
+    """Confere os índices que as queries do SISTEMAS_DB precisam e mostra os planos (EXPLAIN ANALYZE)"""
+    unknown = [system for system in args.systems if system not in SISTEMAS_DB]
+    if unknown:
+        sys.exit(f"Sistemas desconhecidos: {', '.join(unknown)}")
+    systems = args.systems or list(SISTEMAS_DB)
+
+    async def run():
+        registry = QueryRegistry(SISTEMAS_DB)
+        # CREATE INDEX CONCURRENTLY não pode rodar dentro de uma transação
+        async with await psycopg.AsyncConnection.connect(DATABASE_URL, autocommit=True) as conn:
+            await registry.validate(conn)
+            selected = {system: SISTEMAS_DB[system] for system in systems if system not in registry.errors}
+            missing = 0
+            for spec, index in await check_indexes(conn, required_indexes(selected, registry)):
+                target = f"{spec.schema}.{spec.table} ({spec.label})"
+                if index and index.valid:
+                    print(f"OK       {target} -> {index.name}")
+                    continue
+                status = "INVÁLIDO" if index else "FALTANDO"
+                print(f"{status:<8} {target} [{spec.reason}; {', '.join(spec.systems)}]")
+                if index:
+                    print(f"    DROP INDEX CONCURRENTLY {spec.schema}.{index.name};")
+                print(f"    {spec.create_sql().as_string(conn)};")
+                if args.create and not index:
+                    try:
+                        await conn.execute(spec.create_sql())
+                    except psycopg.Error as e:
+                        print(f"    ERRO {str(e).splitlines()[0]}")
+                        missing += 1
+                        continue
+                    print("    criado")
+                else:
+                    missing += 1
+
+            if args.explain:
+                for system in selected:
+                    for name, query, params in explain_targets(SISTEMAS_DB, registry, system):
+                        print(f"\n== {system} / {name}")
+                        for line in await explain_analyze(conn, query, params):
+                            print(f"    {line}")
+
+            for system in systems:
+                if system in registry.errors:
+                    print(f"{system:<12} ERRO (configuração inválida, veja check-queries)")
+            return missing or bool(set(systems) & set(registry.errors))
+
+    if asyncio.run(run()):
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('install-triggers', help=install_triggers.__doc__).set_defaults(func=install_triggers)
+    subparsers.add_parser('check-queries', help=check_queries.__doc__).set_defaults(func=check_queries)
+    rollups_parser = subparsers.add_parser('refresh-rollups', help=refresh_rollups.__doc__)
+    rollups_parser.add_argument('systems', nargs='*', metavar='sistema', help='padrão: todos os sistemas')
+    rollups_parser.add_argument('--full', action='store_true', help='reconstrói tudo (necessário após exclusões)')
+    rollups_parser.set_defaults(func=refresh_rollups)
+    indexes_parser = subparsers.add_parser('indexes', help=indexes.__doc__)
+    indexes_parser.add_argument('systems', nargs='*', metavar='sistema', help='padrão: todos os sistemas')
+    indexes_parser.add_argument('--explain', action='store_true', help='mostra o EXPLAIN (ANALYZE, BUFFERS) de cada query')
+    indexes_parser.add_argument('--create', action='store_true', help='cria os índices que faltam (CONCURRENTLY)')
+    indexes_parser.set_defaults(func=indexes)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
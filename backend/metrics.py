@@ -0,0 +1,383 @@
+import contextvars
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import psycopg
+from psycopg import sql
+from psycopg_pool import AsyncConnectionPool
+from starlette.datastructures import MutableHeaders
+from starlette.responses import JSONResponse
+
+from config import SLOW_QUERY_MS
+
+logger = logging.getLogger(__name__)
+
+# Buckets dos histogramas (segundos, linhas e bytes)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+ROW_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+BYTE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    """Histograma no formato de exposição do Prometheus, com labels"""
+
+    def __init__(self, name: str, description: str, labels: Sequence[str], buckets: Sequence[float]):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Por combinação de labels: contagem por bucket (não acumulada), soma e total
+        self._series: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 3)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            labels = ','.join(f'{label}="{_escape(value)}"' for label, value in zip(self.labels, key))
+            prefix = f"{labels}," if labels else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{labels}}} {series[-1]}")
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    """Contador no formato de exposição do Prometheus, com labels"""
+
+    def __init__(self, name: str, description: str, labels: Sequence[str]):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._series: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, value: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        self._series[key] = self._series.get(key, 0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} counter"]
+        for key, total in sorted(self._series.items()):
+            labels = ','.join(f'{label}="{_escape(value)}"' for label, value in zip(self.labels, key))
+            lines.append(f"{self.name}{{{labels}}} {total}")
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    'kpi_api_request_duration_seconds', 'Tempo total da requisição',
+    ('endpoint', 'system', 'status'), LATENCY_BUCKETS
+)
+POOL_WAIT = Histogram(
+    'kpi_api_pool_wait_seconds', 'Espera por uma conexão do pool',
+    ('endpoint', 'system'), LATENCY_BUCKETS
+)
+QUERY_DURATION = Histogram(
+    'kpi_api_query_duration_seconds', 'Tempo de execução de cada query (execute + fetch)',
+    ('endpoint', 'system'), LATENCY_BUCKETS
+)
+ROWS_FETCHED = Histogram(
+    'kpi_api_rows_fetched', 'Linhas lidas do banco por requisição',
+    ('endpoint', 'system'), ROW_BUCKETS
+)
+SERIALIZATION = Histogram(
+    'kpi_api_serialization_seconds', 'Tempo de serialização da resposta por requisição',
+    ('endpoint', 'system'), LATENCY_BUCKETS
+)
+RESPONSE_BYTES = Histogram(
+    'kpi_api_response_bytes', 'Tamanho do corpo da resposta (após compressão)',
+    ('endpoint', 'system'), BYTE_BUCKETS
+)
+CANCELLED_WORK = Histogram(
+    'kpi_api_cancelled_work_seconds', 'Tempo de conexão já gasto por requisições interrompidas (query cancelada no banco)',
+    ('endpoint', 'system', 'reason'), LATENCY_BUCKETS
+)
+HISTOGRAMS = [REQUEST_DURATION, POOL_WAIT, QUERY_DURATION, ROWS_FETCHED, SERIALIZATION, RESPONSE_BYTES, CANCELLED_WORK]
+
+REQUESTS_CANCELLED = Counter(
+    'kpi_api_requests_cancelled_total', 'Requisições interrompidas (cliente desconectou ou deadline esgotado)',
+    ('endpoint', 'system', 'reason')
+)
+COUNTERS = [REQUESTS_CANCELLED]
+
+# Estatísticas do psycopg_pool expostas em /metrics (gauges e contadores)
+POOL_GAUGES = {
+    'pool_size': 'Conexões abertas no pool',
+    'pool_available': 'Conexões livres no pool',
+    'requests_waiting': 'Requisições esperando uma conexão',
+}
+POOL_COUNTERS = {
+    'requests_num': 'Conexões pedidas ao pool',
+    'requests_queued': 'Pedidos que precisaram esperar na fila',
+    'requests_errors': 'Pedidos que falharam (ex.: timeout do pool)',
+    'connections_lost': 'Conexões perdidas',
+}
+
+
+# Valores aceitos no label `system`; qualquer outro valor do path vira 'other',
+# para que URLs inventadas não criem séries novas no Prometheus
+_known_systems: FrozenSet[str] = frozenset()
+
+
+def set_known_systems(systems: Iterable[str]) -> None:
+    global _known_systems
+    _known_systems = frozenset(systems)
+
+
+@dataclass
+class RequestTimings:
+    """Tempos acumulados durante uma requisição (compartilhado via contextvar)"""
+    scope: Dict[str, Any]
+    pool_wait: float = 0.0
+    query: float = 0.0
+    queries: int = 0
+    rows: int = 0
+    serialize: float = 0.0
+    start: float = field(default_factory=time.perf_counter)
+    # Motivo da interrupção ('disconnect' ou 'deadline'), se houve
+    cancelled: Optional[str] = None
+
+    @property
+    def labels(self) -> Dict[str, str]:
+        endpoint = self.scope.get('endpoint')
+        system = self.scope.get('path_params', {}).get('system', '')
+        return {
+            'endpoint': getattr(endpoint, '__name__', 'unmatched'),
+            'system': system if not system or system in _known_systems else 'other',
+        }
+
+    def server_timing(self) -> str:
+        total = (time.perf_counter() - self.start) * 1000
+        return ", ".join([
+            f"pool;dur={self.pool_wait * 1000:.1f}",
+            f'db;dur={self.query * 1000:.1f};desc="{self.queries} queries, {self.rows} rows"',
+            f"ser;dur={self.serialize * 1000:.1f}",
+            f"app;dur={total:.1f}",
+        ])
+
+
+_current: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar('request_timings', default=None)
+
+# Labels usados fora de uma requisição (lifespan, LiveUpdates)
+BACKGROUND_LABELS = {'endpoint': 'background', 'system': ''}
+
+
+def current_labels() -> Dict[str, str]:
+    timings = _current.get()
+    return timings.labels if timings else BACKGROUND_LABELS
+
+
+def record_cancelled_request(reason: str) -> None:
+    """Conta a requisição interrompida (o status vira 499 quando o cliente foi embora)"""
+    timings = _current.get()
+    if timings:
+        timings.cancelled = reason
+    REQUESTS_CANCELLED.inc(reason=reason, **current_labels())
+
+
+def record_cancelled_work(reason: str, elapsed: float) -> None:
+    """Registra uma conexão liberada por requisição interrompida e há quanto tempo ela estava em uso"""
+    CANCELLED_WORK.observe(elapsed, reason=reason, **current_labels())
+
+
+@contextmanager
+def measure_serialization() -> Iterator[None]:
+    """Soma o tempo do bloco na serialização da requisição atual"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _current.get()
+        if timings:
+            timings.serialize += time.perf_counter() - start
+
+
+class TimedJSONResponse(JSONResponse):
+    """JSONResponse que contabiliza o json.dumps no tempo de serialização"""
+
+    def render(self, content: Any) -> bytes:
+        with measure_serialization():
+            return super().render(content)
+
+
+class InstrumentedCursor(psycopg.AsyncCursor):
+    """Cursor que mede o tempo de cada query, conta as linhas lidas e registra as queries lentas.
+
+    No pipeline mode o `execute` só enfileira a query; o tempo de espera pelo
+    resultado aparece no fetch, que também é medido.
+    """
+
+    # Limite em ms para o log de queries lentas (0 desliga)
+    slow_query_ms: float = SLOW_QUERY_MS
+
+    async def execute(self, query, params=None, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await super().execute(query, params, **kwargs)
+        finally:
+            self._observe(time.perf_counter() - start, query=query, params=params)
+
+    async def fetchone(self):
+        start = time.perf_counter()
+        row = await super().fetchone()
+        self._observe(time.perf_counter() - start, rows=0 if row is None else 1)
+        return row
+
+    async def fetchmany(self, size: int = 0):
+        start = time.perf_counter()
+        rows = await super().fetchmany(size)
+        self._observe(time.perf_counter() - start, rows=len(rows))
+        return rows
+
+    async def fetchall(self):
+        start = time.perf_counter()
+        rows = await super().fetchall()
+        self._observe(time.perf_counter() - start, rows=len(rows))
+        return rows
+
+    def _observe(self, elapsed: float, rows: int = 0, query=None, params=None) -> None:
+        timings = _current.get()
+        if timings:
+            timings.query += elapsed
+            timings.rows += rows
+            if query is not None:
+                timings.queries += 1
+        if query is None:
+            return
+        QUERY_DURATION.observe(elapsed, **current_labels())
+        if self.slow_query_ms and elapsed * 1000 >= self.slow_query_ms:
+            text = query.as_string(self.connection) if isinstance(query, sql.Composable) else query
+            logger.warning(
+                "Query lenta (%.0f ms) em %s: %s params=%r",
+                elapsed * 1000, current_labels()['endpoint'], " ".join(str(text).split()), params
+            )
+
+
+class InstrumentedPool(AsyncConnectionPool):
+    """Pool que mede a espera por conexão de cada `pool.connection()`"""
+
+    async def getconn(self, timeout: Optional[float] = None):
+        start = time.perf_counter()
+        try:
+            return await super().getconn(timeout)
+        finally:
+            elapsed = time.perf_counter() - start
+            POOL_WAIT.observe(elapsed, **current_labels())
+            timings = _current.get()
+            if timings:
+                timings.pool_wait += elapsed
+
+
+class MetricsMiddleware:
+    """Middleware ASGI que mede cada requisição e adiciona o header Server-Timing.
+
+    Deve ser o middleware mais externo, para que o tamanho medido seja o do
+    corpo já comprimido.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings(scope)
+        token = _current.set(timings)
+        status = None
+        size = 0
+
+        async def send_with_timing(message):
+            nonlocal status, size
+            if message['type'] == 'http.response.start':
+                status = message['status']
+                headers = MutableHeaders(scope=message)
+                headers.append('Server-Timing', timings.server_timing())
+                headers.append('Timing-Allow-Origin', '*')
+            elif message['type'] == 'http.response.body':
+                size += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if status is None:
+                # Sem resposta: o cliente desconectou (499, como no nginx) ou houve erro
+                status = 499 if timings.cancelled == 'disconnect' else 500
+            labels = timings.labels
+            REQUEST_DURATION.observe(time.perf_counter() - timings.start, status=str(status), **labels)
+            ROWS_FETCHED.observe(timings.rows, **labels)
+            SERIALIZATION.observe(timings.serialize, **labels)
+            RESPONSE_BYTES.observe(size, **labels)
+
+
+@dataclass
+class StartupTimes:
+    """Duração das fases do startup, contadas a partir da importação do main (segundos)"""
+    started: float = field(default_factory=time.perf_counter)
+    # Até o servidor aceitar requisições (/healthz)
+    serving: Optional[float] = None
+    # Até as queries serem validadas no banco
+    validated: Optional[float] = None
+    # Até o banco validado e o pool aquecido (/readyz)
+    ready: Optional[float] = None
+
+    def phases(self) -> Dict[str, Optional[float]]:
+        return {'serving': self.serving, 'validated': self.validated, 'ready': self.ready}
+
+    def mark(self, phase: str) -> float:
+        elapsed = time.perf_counter() - self.started
+        setattr(self, phase, elapsed)
+        return elapsed
+
+
+def render_metrics(pool: Optional[AsyncConnectionPool], startup: Optional[StartupTimes] = None) -> str:
+    """Texto do /metrics no formato de exposição do Prometheus (sem as métricas do pool se ainda não houver um)"""
+    lines: List[str] = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.render())
+    for counter in COUNTERS:
+        lines.extend(counter.render())
+
+    if startup is not None:
+        lines += ["# HELP kpi_api_startup_seconds Duração das fases do startup (serving, validated, ready)",
+                  "# TYPE kpi_api_startup_seconds gauge"]
+        lines += [f'kpi_api_startup_seconds{{phase="{phase}"}} {value}'
+                  for phase, value in startup.phases().items() if value is not None]
+
+    if pool is None:
+        return "\n".join(lines) + "\n"
+    stats = pool.get_stats()
+    for name, description in POOL_GAUGES.items():
+        lines += [f"# HELP kpi_api_{name} {description}", f"# TYPE kpi_api_{name} gauge",
+                  f"kpi_api_{name} {stats.get(name, 0)}"]
+    for name, description in POOL_COUNTERS.items():
+        lines += [f"# HELP kpi_api_{name}_total {description}", f"# TYPE kpi_api_{name}_total counter",
+                  f"kpi_api_{name}_total {stats.get(name, 0)}"]
+    lines += ["# HELP kpi_api_pool_max_size Tamanho máximo do pool", "# TYPE kpi_api_pool_max_size gauge",
+              f"kpi_api_pool_max_size {pool.max_size}"]
+    breaker = getattr(pool, 'breaker', None)
+    if breaker is not None:
+        lines += ["# HELP kpi_api_circuit_open Circuit breaker do banco aberto (1) ou fechado (0)",
+                  "# TYPE kpi_api_circuit_open gauge", f"kpi_api_circuit_open {int(breaker.state != 'closed')}"]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,515 @@
+import logging
+from dataclasses import dataclass
+from datetime import date
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from fastapi import HTTPException
+from psycopg import sql
+
+logger = logging.getLogger(__name__)
+
+# Funções de agregação aceitas em kpi_aggregations e series_aggregation
+AGGREGATE_FUNCTIONS = {'SUM', 'AVG', 'MIN', 'MAX', 'COUNT'}
+
+# Tamanhos de intervalo aceitos em /api/series (argumento do date_trunc)
+SERIES_BUCKETS = ('day', 'week', 'month')
+
+# Recebe o nome da coluna como está no SISTEMAS_DB e devolve o identificador SQL
+Resolver = Callable[[str], sql.Identifier]
+
+
+def fold_identifier(name: str) -> sql.Identifier:
+    """Mesma regra do Postgres para nomes sem aspas: tudo em minúsculas"""
+    return sql.Identifier(name.lower())
+
+
+def qualified_table(config: Dict[str, Any]) -> sql.Composed:
+    return sql.SQL("{}.{}").format(fold_identifier(config['schema']), fold_identifier(config['tabela']))
+
+
+def filtro_values(config: Dict[str, Any]) -> List[str]:
+    """Valores do filtro fixo do sistema (`filtro_val` aceita um valor ou uma lista)"""
+    if not config['filtro_col']:
+        return []
+    value = config['filtro_val']
+    return [value] if isinstance(value, str) else list(value)
+
+
+def primary_filtro(config: Dict[str, Any]) -> str:
+    """Valor usado pelas consultas sem grupo (cards da TV): o primeiro de `filtro_val`"""
+    values = filtro_values(config)
+    return values[0] if values else ''
+
+
+def _filters(config: Dict[str, Any], resolve: Resolver):
+    """Retorna os trechos WHERE/AND do filtro fixo do sistema (vazios quando não há filtro)"""
+    if not config['filtro_col']:
+        return sql.SQL(""), sql.SQL("")
+    filtro_col = resolve(config['filtro_col'])
+    return (
+        sql.SQL("WHERE {} = %s").format(filtro_col),
+        sql.SQL("AND {} = %s").format(filtro_col),
+    )
+
+
+def _any_filter(config: Dict[str, Any], resolve: Resolver) -> sql.Composed:
+    """`filtro_col = ANY(%s)`: a lista de valores vem da requisição (sempre o último parâmetro)"""
+    return sql.SQL("{} = ANY(%s)").format(resolve(config['filtro_col']))
+
+
+def _aggregate(name: str) -> sql.SQL:
+    if name.upper() not in AGGREGATE_FUNCTIONS:
+        raise ValueError(f"Função de agregação inválida: {name}")
+    return sql.SQL(name.upper())
+
+
+def build_kpi_query(config: Dict[str, Any], resolve: Resolver = fold_identifier) -> sql.Composed:
+    """Constrói a query de KPI baseada na configuração do sistema"""
+    table = qualified_table(config)
+    date_col = resolve(config['date_col'])
+    updated_col = resolve(config['updated_col'])
+    where_filter, and_filter = _filters(config, resolve)
+    kpi_query_type = config['kpi_query_type']
+
+    if kpi_query_type == 'custom':
+        # Para queries customizadas como evolution
+        return sql.SQL(config['custom_kpi_query']).format(
+            schema=fold_identifier(config['schema']),
+            tabela=fold_identifier(config['tabela']),
+            date_col=date_col,
+            updated_col=updated_col,
+            where_filter=where_filter,
+            and_filter=and_filter
+        )
+    elif kpi_query_type == 'aggregated':
+        # Para sistemas que precisam de agregação como meta_ads/google_ads
+        select_clause = sql.SQL(", ").join(
+            sql.SQL("{}({}) AS {}").format(
+                _aggregate(agg), resolve(col), sql.Identifier(f"{col}_{agg}".lower())
+            )
+            for col, agg in config['kpi_aggregations'].items()
+        )
+        return sql.SQL("""
+            SELECT
+                {select_clause},
+                MAX({updated_col}) AS updated_at
+            FROM {table}
+            WHERE {date_col} = (
+                SELECT MAX({date_col}) FROM {table}
+                {where_filter}
+            )
+            {and_filter}
+        """).format(
+            select_clause=select_clause,
+            updated_col=updated_col,
+            table=table,
+            date_col=date_col,
+            where_filter=where_filter,
+            and_filter=and_filter
+        )
+    else:
+        # Para sistemas que pegam a linha mais recente (single_row)
+        return sql.SQL("""
+            SELECT {kpi_cols}, {updated_col}
+            FROM {table}
+            {where_filter}
+            ORDER BY {date_col} DESC
+            LIMIT 1
+        """).format(
+            kpi_cols=sql.SQL(", ").join(resolve(col) for col in config['kpi_cols']),
+            updated_col=updated_col,
+            table=table,
+            where_filter=where_filter,
+            date_col=date_col
+        )
+
+
+def build_series_query(config: Dict[str, Any], resolve: Resolver = fold_identifier) -> sql.Composed:
+    """Constrói a query de série temporal baseada na configuração do sistema"""
+    date_col = resolve(config['date_col'])
+    where_filter, _ = _filters(config, resolve)
+
+    # Se tem query customizada para série, usa ela
+    if 'custom_series_query' in config:
+        return sql.SQL(config['custom_series_query']).format(
+            schema=fold_identifier(config['schema']),
+            tabela=fold_identifier(config['tabela']),
+            date_col=date_col,
+            where_filter=where_filter
+        )
+
+    # Caso contrário, usa a lógica padrão
+    return sql.SQL("""
+        SELECT {date_col}, {aggregation}({chart_col}) AS value_sum
+        FROM {table}
+        {where_filter}
+        GROUP BY {date_col}
+        ORDER BY {date_col} DESC
+        LIMIT 14
+    """).format(
+        date_col=date_col,
+        aggregation=_aggregate(config['series_aggregation']),
+        chart_col=resolve(config['chart_col']),
+        table=qualified_table(config),
+        where_filter=where_filter
+    )
+
+
+def build_grouped_kpi_query(config: Dict[str, Any], resolve: Resolver = fold_identifier) -> sql.Composed:
+    """KPIs de vários valores de `filtro_col` em uma query, uma linha por grupo (filtro primeiro).
+
+    Queries customizadas não têm como ser agrupadas e não passam por aqui.
+    """
+    table = qualified_table(config)
+    filtro_col = resolve(config['filtro_col'])
+    date_col = resolve(config['date_col'])
+    updated_col = resolve(config['updated_col'])
+
+    if config['kpi_query_type'] == 'aggregated':
+        # Agrega só o dia mais recente de cada grupo
+        select_clause = sql.SQL(", ").join(
+            sql.SQL("{}({}) AS {}").format(
+                _aggregate(agg), resolve(col), sql.Identifier(f"{col}_{agg}".lower())
+            )
+            for col, agg in config['kpi_aggregations'].items()
+        )
+        return sql.SQL("""
+            SELECT {filtro_col}, {select_clause}, MAX({updated_col}) AS updated_at
+            FROM (
+                SELECT *, MAX({date_col}) OVER (PARTITION BY {filtro_col}) AS latest_date
+                FROM {table}
+                WHERE {any_filter}
+            ) AS src
+            WHERE {date_col} = latest_date
+            GROUP BY {filtro_col}
+            ORDER BY {filtro_col}
+        """).format(
+            filtro_col=filtro_col,
+            select_clause=select_clause,
+            updated_col=updated_col,
+            date_col=date_col,
+            table=table,
+            any_filter=_any_filter(config, resolve)
+        )
+
+    # single_row: a linha mais recente de cada grupo
+    return sql.SQL("""
+        SELECT DISTINCT ON ({filtro_col}) {filtro_col}, {kpi_cols}, {updated_col}
+        FROM {table}
+        WHERE {any_filter}
+        ORDER BY {filtro_col}, {date_col} DESC
+    """).format(
+        filtro_col=filtro_col,
+        kpi_cols=sql.SQL(", ").join(resolve(col) for col in config['kpi_cols']),
+        updated_col=updated_col,
+        table=table,
+        any_filter=_any_filter(config, resolve),
+        date_col=date_col
+    )
+
+
+def build_grouped_series_query(config: Dict[str, Any], resolve: Resolver = fold_identifier) -> sql.Composed:
+    """Séries de vários valores de `filtro_col` com um único GROUP BY filtro_col, date_col
+    (os 14 dias mais recentes de cada grupo)
+    """
+    filtro_col = resolve(config['filtro_col'])
+    date_col = resolve(config['date_col'])
+    return sql.SQL("""
+        SELECT filtro, ref, value_sum
+        FROM (
+            SELECT {filtro_col} AS filtro, {date_col} AS ref, {aggregation}({chart_col}) AS value_sum,
+                   row_number() OVER (PARTITION BY {filtro_col} ORDER BY {date_col} DESC) AS position
+            FROM {table}
+            WHERE {any_filter}
+            GROUP BY {filtro_col}, {date_col}
+        ) AS grouped
+        WHERE position <= 14
+        ORDER BY filtro, ref DESC
+    """).format(
+        filtro_col=filtro_col,
+        date_col=date_col,
+        aggregation=_aggregate(config['series_aggregation']),
+        chart_col=resolve(config['chart_col']),
+        table=qualified_table(config),
+        any_filter=_any_filter(config, resolve)
+    )
+
+
+def build_range_series_query(
+    config: Dict[str, Any],
+    bucket: str,
+    date_from: Optional[date],
+    date_to: Optional[date],
+    filtro_vals: Optional[List[str]] = None,
+    resolve: Resolver = fold_identifier,
+) -> Tuple[sql.Composed, list]:
+    """Série em um intervalo qualquer, com os pontos agrupados por dia, semana ou mês (`date_trunc`).
+
+    Retorna (query, parâmetros). As linhas saem como (ref, value_sum) em ordem
+    decrescente, ou (filtro, ref, value_sum) quando `filtro_vals` é informado.
+    """
+    if bucket not in SERIES_BUCKETS:
+        raise ValueError(f"Intervalo inválido: {bucket}")
+    date_col = resolve(config['date_col'])
+    conditions: List[sql.Composable] = []
+    params: list = []
+    if date_from:
+        conditions.append(sql.SQL("{} >= %s::date").format(date_col))
+        params.append(date_from)
+    if date_to:
+        # `to` inclusivo mesmo quando date_col é timestamp
+        conditions.append(sql.SQL("{} < %s::date + 1").format(date_col))
+        params.append(date_to)
+    grouped = filtro_vals is not None
+    if grouped:
+        conditions.append(_any_filter(config, resolve))
+        params.append(filtro_vals)
+    elif config['filtro_col']:
+        conditions.append(sql.SQL("{} = %s").format(resolve(config['filtro_col'])))
+        params.append(primary_filtro(config))
+
+    group = sql.SQL("{} AS filtro, ").format(resolve(config['filtro_col'])) if grouped else sql.SQL("")
+    query = sql.SQL("""
+        SELECT {group}date_trunc({bucket}, {date_col})::date AS ref, {aggregation}({chart_col}) AS value_sum
+        FROM {table}
+        {where}
+        GROUP BY {group_by}
+        ORDER BY {order_by}
+    """).format(
+        group=group,
+        bucket=sql.Literal(bucket),
+        date_col=date_col,
+        aggregation=_aggregate(config['series_aggregation']),
+        chart_col=resolve(config['chart_col']),
+        table=qualified_table(config),
+        where=sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions) if conditions else sql.SQL(""),
+        group_by=sql.SQL("filtro, ref" if grouped else "ref"),
+        order_by=sql.SQL("filtro, ref DESC" if grouped else "ref DESC"),
+    )
+    return query, params
+
+
+def build_watermark_query(
+    config: Dict[str, Any], any_filter: bool = False, resolve: Resolver = fold_identifier
+) -> sql.Composed:
+    """Constrói a query que retorna o watermark (MAX(updated_col)) do sistema.
+
+    Com `any_filter`, o filtro fixo é trocado por `filtro_col = ANY(%s)`.
+    """
+    if any_filter:
+        where_filter = sql.SQL("WHERE {}").format(_any_filter(config, resolve))
+    else:
+        where_filter, _ = _filters(config, resolve)
+
+    return sql.SQL("""
+        SELECT MAX({updated_col})
+        FROM {table}
+        {where_filter}
+    """).format(
+        updated_col=resolve(config['updated_col']),
+        table=qualified_table(config),
+        where_filter=where_filter
+    )
+
+
+def get_query_params(config: Dict[str, Any]) -> tuple:
+    """Retorna os parâmetros da query de KPI baseado na configuração"""
+    if not config['filtro_col']:
+        return ()
+    filtro_val = primary_filtro(config)
+
+    kpi_query_type = config['kpi_query_type']
+    if kpi_query_type in ['custom', 'aggregated']:
+        # Para queries que precisam do filtro duas vezes (subquery + where principal)
+        return (filtro_val, filtro_val)
+    else:
+        # Para queries single_row que só precisam do filtro uma vez
+        return (filtro_val,)
+
+
+def get_series_params(config: Dict[str, Any]) -> tuple:
+    """Retorna os parâmetros das queries de série e de watermark"""
+    return (primary_filtro(config),) if config['filtro_col'] else ()
+
+
+def count_placeholders(query: sql.Composable) -> int:
+    """Conta os `%s` de uma query composta (sem precisar de conexão)"""
+    if isinstance(query, sql.Composed):
+        return sum(count_placeholders(part) for part in query)
+    if isinstance(query, sql.SQL):
+        return query.as_string(None).count('%s')
+    return 0
+
+
+def referenced_columns(config: Dict[str, Any]) -> List[str]:
+    """Colunas do SISTEMAS_DB usadas pelas queries geradas (as customizadas são checadas via EXPLAIN)"""
+    columns = [config['date_col'], config['updated_col']]
+    if config['filtro_col']:
+        columns.append(config['filtro_col'])
+    if config['kpi_query_type'] == 'aggregated':
+        columns.extend(config['kpi_aggregations'])
+    elif config['kpi_query_type'] != 'custom':
+        columns.extend(config['kpi_cols'])
+    if 'custom_series_query' not in config:
+        columns.append(config['chart_col'])
+    return list(dict.fromkeys(columns))
+
+
+# Queries de SystemQueries que recebem a lista de valores do filtro como último parâmetro
+GROUPED_QUERIES = ('watermark_any', 'kpi_grouped', 'series_grouped')
+
+
+@dataclass
+class CompiledQuery:
+    query: Union[sql.Composable, str]
+    params: tuple
+
+
+@dataclass
+class SystemQueries:
+    kpi: CompiledQuery
+    series: CompiledQuery
+    watermark: CompiledQuery
+    # Queries com filtro ANY(%s) (None sem filtro_col); a lista de valores vem da requisição
+    watermark_any: Optional[CompiledQuery]
+    kpi_grouped: Optional[CompiledQuery] = None
+    series_grouped: Optional[CompiledQuery] = None
+
+
+class QueryRegistry:
+    """Compila uma vez as queries de cada sistema do SISTEMAS_DB e as valida no banco.
+
+    A compilação é pura (não precisa de conexão). `validate` confere as
+    colunas no information_schema, resolve a grafia real de cada uma, roda
+    EXPLAIN em todas as queries e guarda o SQL final já renderizado, de modo
+    que cada requisição só reaproveita o texto (e o statement preparado).
+    """
+
+    def __init__(self, sistemas: Dict[str, Dict[str, Any]]):
+        self.sistemas = sistemas
+        self.errors: Dict[str, List[str]] = {}
+        self._queries: Dict[str, SystemQueries] = {}
+        self._resolvers: Dict[str, Resolver] = {}
+        # Colunas reais de cada tabela (preenchido por `validate`)
+        self.table_columns: Dict[str, List[str]] = {}
+        self.compile()
+
+    def compile(self, resolvers: Optional[Dict[str, Resolver]] = None) -> None:
+        self._resolvers = resolvers = resolvers or {}
+        for system, config in self.sistemas.items():
+            resolve = resolvers.get(system, fold_identifier)
+            grouped = bool(config['filtro_col'])
+            try:
+                queries = SystemQueries(
+                    kpi=CompiledQuery(build_kpi_query(config, resolve), get_query_params(config)),
+                    series=CompiledQuery(build_series_query(config, resolve), get_series_params(config)),
+                    watermark=CompiledQuery(build_watermark_query(config, resolve=resolve), get_series_params(config)),
+                    watermark_any=(
+                        CompiledQuery(build_watermark_query(config, True, resolve), ()) if grouped else None
+                    ),
+                    kpi_grouped=(
+                        CompiledQuery(build_grouped_kpi_query(config, resolve), ())
+                        if grouped and config['kpi_query_type'] != 'custom' else None
+                    ),
+                    series_grouped=(
+                        CompiledQuery(build_grouped_series_query(config, resolve), ())
+                        if grouped and 'custom_series_query' not in config else None
+                    ),
+                )
+            except (KeyError, ValueError) as e:
+                self.errors.setdefault(system, []).append(f"Configuração inválida: {e}")
+                continue
+
+            for name in ('kpi', 'series', 'watermark'):
+                compiled = getattr(queries, name)
+                expected = count_placeholders(compiled.query)
+                if expected != len(compiled.params):
+                    self.errors.setdefault(system, []).append(
+                        f"Query {name} espera {expected} parâmetros, mas recebe {len(compiled.params)}"
+                    )
+            self._queries[system] = queries
+
+    def get(self, system: str) -> SystemQueries:
+        if system in self.errors:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Configuração inválida do sistema {system}: {'; '.join(self.errors[system])}"
+            )
+        return self._queries[system]
+
+    def resolver(self, system: str) -> Resolver:
+        """Resolver de colunas do sistema (grafia real após `validate`, senão minúsculas)"""
+        return self._resolvers.get(system, fold_identifier)
+
+    def column_name(self, system: str, name: str) -> str:
+        """Grafia real da coluna na tabela (mesma regra do resolver; minúsculas sem validação prévia)"""
+        columns = self.table_columns.get(system, [])
+        if name in columns:
+            return name
+        return next((column for column in columns if column.lower() == name.lower()), name.lower())
+
+    def has_column(self, system: str, name: str) -> bool:
+        """Se a coluna existe na tabela do sistema (sem validação prévia, assume que sim)"""
+        columns = self.table_columns.get(system)
+        return columns is None or name.lower() in {column.lower() for column in columns}
+
+    async def validate(self, conn) -> Dict[str, List[str]]:
+        """Valida todas as queries no banco e renderiza o SQL final. Retorna os erros por sistema."""
+        tables = sorted({(c['schema'].lower(), c['tabela'].lower()) for c in self.sistemas.values()})
+        catalog: Dict[tuple, List[str]] = {table: [] for table in tables}
+        async with conn.cursor() as cur:
+            await cur.execute("""
+                SELECT table_schema, table_name, column_name
+                FROM information_schema.columns
+                WHERE (table_schema, table_name) IN (SELECT * FROM unnest(%s::text[], %s::text[]))
+            """, ([s for s, _ in tables], [t for _, t in tables]))
+            for schema, table, column in await cur.fetchall():
+                catalog[(schema, table)].append(column)
+
+        self.errors = {}
+        resolvers: Dict[str, Resolver] = {}
+        for system, config in self.sistemas.items():
+            table_key = (config['schema'].lower(), config['tabela'].lower())
+            columns = catalog.get(table_key, [])
+            if not columns:
+                self.errors.setdefault(system, []).append(f"Tabela {'.'.join(table_key)} não encontrada")
+                continue
+            self.table_columns[system] = columns
+            resolvers[system] = self._resolver(system, config, columns)
+
+        self.compile(resolvers)
+
+        async with conn.cursor() as cur:
+            for system, queries in self._queries.items():
+                if system in self.errors:
+                    continue
+                for name in ('kpi', 'series', 'watermark', 'watermark_any', 'kpi_grouped', 'series_grouped'):
+                    compiled = getattr(queries, name)
+                    if compiled is None:
+                        continue
+                    rendered = compiled.query.as_string(conn)
+                    params = (*compiled.params, filtro_values(self.sistemas[system])) if name in GROUPED_QUERIES else compiled.params
+                    try:
+                        await cur.execute(f"EXPLAIN {rendered}", params)
+                    except Exception as e:
+                        self.errors.setdefault(system, []).append(f"Query {name}: {str(e).splitlines()[0]}")
+                        continue
+                    compiled.query = rendered
+
+        for system, errors in self.errors.items():
+            for error in errors:
+                logger.error("SISTEMAS_DB['%s']: %s", system, error)
+        return self.errors
+
+    def _resolver(self, system: str, config: Dict[str, Any], columns: List[str]) -> Resolver:
+        """Casa as colunas do SISTEMAS_DB com a grafia real do information_schema"""
+        by_lower: Dict[str, str] = {}
+        for column in columns:
+            by_lower.setdefault(column.lower(), column)
+        for name in referenced_columns(config):
+            if name not in columns and name.lower() not in by_lower:
+                self.errors.setdefault(system, []).append(
+                    f"Coluna '{name}' não existe em {config['schema']}.{config['tabela']}"
+                )
+        existing = set(columns)
+        return lambda name: sql.Identifier(name if name in existing else by_lower.get(name.lower(), name.lower()))
@@ -0,0 +1,371 @@
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+from psycopg import sql
+
+from aggregate import AGGREGATIONS
+from queries import QueryRegistry, filtro_values, qualified_table
+from rollups import RollupManager
+
+# `last`: valor da linha mais recente do dia (pelo updated_col), para saldos como "a receber"
+REPORT_AGGREGATIONS = {**AGGREGATIONS, 'last': 'LAST'}
+
+# Acentos removidos na comparação de `where` (mesma normalização do frontend)
+ACCENTED = 'áàâãäéèêëíìîïóòôõöúùûüç'
+UNACCENTED = 'aaaaaeeeeiiiiooooouuuuc'
+
+
+def month_key(value: date) -> str:
+    return value.strftime('%Y-%m')
+
+
+def parse_month(value: str) -> date:
+    """`AAAA-MM` -> primeiro dia do mês (400 se inválido)"""
+    try:
+        return datetime.strptime(value, '%Y-%m').date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Mês inválido: {value} (use AAAA-MM)")
+
+
+def parse_report_metric(spec: str) -> Tuple[str, str]:
+    """`coluna:funcao` -> (coluna, função SQL ou LAST)"""
+    col, _, agg = spec.partition(':')
+    agg = (agg or 'sum').lower()
+    if agg not in REPORT_AGGREGATIONS:
+        raise ValueError(f"Agregação inválida: {agg}")
+    return col, REPORT_AGGREGATIONS[agg]
+
+
+def _normalized(expression: sql.Composable) -> sql.Composed:
+    return sql.SQL("translate(lower(btrim({}::text)), {}, {})").format(
+        expression, sql.Literal(ACCENTED), sql.Literal(UNACCENTED)
+    )
+
+
+def _delta(current: sql.Composable, base: sql.Composable) -> sql.Composed:
+    """Variação percentual (NULL quando a base é zero ou nula)"""
+    return sql.SQL("(({current}) - ({base})) / NULLIF({base}, 0) * 100").format(current=current, base=base)
+
+
+class MonthlyReport:
+    """Relatório mensal consolidado dos sistemas de `sections` (página RelatorioGeral).
+
+    Cada seção declara as métricas diárias (`nome: coluna:funcao`), filtros
+    fixos de dimensão (`where`, comparados sem acento e sem caixa) e colunas
+    da linha mais recente do mês (`latest`). Tudo sai em uma única ida ao
+    banco: os meses disponíveis, os pontos diários com totais, melhor/pior
+    dia e as variações contra o dia e o mês anteriores (funções de janela),
+    e as linhas mais recentes, enviados juntos no pipeline mode.
+    """
+
+    def __init__(
+        self,
+        sections: Dict[str, Dict[str, Any]],
+        sistemas: Dict[str, Dict[str, Any]],
+        registry: QueryRegistry,
+        rollups: RollupManager,
+    ):
+        self.sections = sections
+        self.sistemas = sistemas
+        self.registry = registry
+        self.rollups = rollups
+        self.metrics = {
+            system: {name: parse_report_metric(spec) for name, spec in section['metrics'].items()}
+            for system, section in sections.items()
+        }
+
+    @property
+    def systems(self) -> List[str]:
+        return list(self.sections)
+
+    def _conditions(self, system: str) -> Tuple[List[sql.Composable], list]:
+        """Filtro fixo do sistema (todos os valores de `filtro_val`) e os `where` da seção"""
+        config = self.sistemas[system]
+        resolve = self.registry.resolver(system)
+        conditions: List[sql.Composable] = []
+        params: list = []
+        if config['filtro_col']:
+            conditions.append(sql.SQL("{} = ANY(%s)").format(resolve(config['filtro_col'])))
+            params.append(filtro_values(config))
+        for col, value in self.sections[system].get('where', {}).items():
+            conditions.append(sql.SQL("{} = {}").format(
+                _normalized(resolve(col)), _normalized(sql.Literal(value))
+            ))
+        return conditions, params
+
+    def _where(self, system: str) -> Tuple[sql.Composable, list]:
+        conditions, params = self._conditions(system)
+        if not conditions:
+            return sql.SQL(""), params
+        return sql.SQL("WHERE ") + sql.SQL(" AND ").join(conditions), params
+
+    def _target_month(self, month: Optional[date]) -> Tuple[sql.Composed, list]:
+        """Mês pedido ou, sem ele, o mês mais recente com dados em algum dos sistemas"""
+        latest = []
+        params: list = [month]
+        for system in self.systems:
+            config = self.sistemas[system]
+            where, condition_params = self._where(system)
+            latest.append(sql.SQL("(SELECT date_trunc('month', MAX({date_col}))::date FROM {table} {where})").format(
+                date_col=self.registry.resolver(system)(config['date_col']),
+                table=qualified_table(config),
+                where=where,
+            ))
+            params.extend(condition_params)
+        query = sql.SQL("COALESCE(%s::date, GREATEST({}))").format(sql.SQL(", ").join(latest))
+        return query, params
+
+    def watermark_query(self) -> Tuple[sql.Composed, list]:
+        """MAX(updated_col) de cada sistema do relatório, com os mesmos filtros, em uma linha.
+
+        Os meses disponíveis saem do rollup quando há um: o último refresh de
+        cada rollup também entra, para o cache mudar quando ele alcança a origem.
+        """
+        columns = []
+        params: list = []
+        for system in self.systems:
+            config = self.sistemas[system]
+            where, condition_params = self._where(system)
+            columns.append(sql.SQL("(SELECT MAX({updated_col}) FROM {table} {where})").format(
+                updated_col=self.registry.resolver(system)(config['updated_col']),
+                table=qualified_table(config),
+                where=where,
+            ))
+            params.extend(condition_params)
+            if self.rollups.supports(system):
+                columns.append(self.rollups.refreshed_at(system))
+        return sql.SQL("SELECT {}").format(sql.SQL(", ").join(columns)), params
+
+    def months_query(self) -> Tuple[sql.Composed, list]:
+        """Meses com dados em algum dos sistemas (do rollup mensal quando disponível)"""
+        if all(self.rollups.supports(system) for system in self.systems):
+            return self.rollups.months_query(self.systems)
+        sources = []
+        params: list = []
+        for system in self.systems:
+            config = self.sistemas[system]
+            where, condition_params = self._where(system)
+            sources.append(sql.SQL("SELECT DISTINCT date_trunc('month', {date_col})::date FROM {table} {where}").format(
+                date_col=self.registry.resolver(system)(config['date_col']),
+                table=qualified_table(config),
+                where=where,
+            ))
+            params.extend(condition_params)
+        query = sql.SQL("SELECT month FROM ({}) AS months(month) GROUP BY month ORDER BY month DESC").format(
+            sql.SQL(" UNION ALL ").join(sources)
+        )
+        return query, params
+
+    def _daily_source(self, system: str) -> Tuple[sql.Composed, list]:
+        """Uma linha por (métrica, dia) do mês alvo e do anterior"""
+        config = self.sistemas[system]
+        resolve = self.registry.resolver(system)
+        date_col = resolve(config['date_col'])
+        columns = []
+        values = []
+        for index, (name, (col, agg)) in enumerate(self.metrics[system].items()):
+            if agg == 'LAST':
+                expression = sql.SQL("(array_agg({} ORDER BY {} DESC))[1]").format(
+                    resolve(col), resolve(config['updated_col'])
+                )
+            else:
+                expression = sql.SQL("{}({})").format(sql.SQL(agg), resolve(col))
+            alias = sql.Identifier(f"m{index}")
+            columns.append(sql.SQL("{}::numeric AS {}").format(expression, alias))
+            values.append(sql.SQL("({}, src.{})").format(sql.Literal(name), alias))
+
+        conditions, params = self._conditions(system)
+        conditions = [
+            sql.SQL("{} >= (SELECT month FROM target) - interval '1 month'").format(date_col),
+            sql.SQL("{} < (SELECT month FROM target) + interval '1 month'").format(date_col),
+            *conditions,
+        ]
+        query = sql.SQL("""
+            SELECT {system}::text, m.metric, src.day, m.value
+            FROM (
+                SELECT {date_col}::date AS day, {columns}
+                FROM {table}
+                WHERE {conditions}
+                GROUP BY 1
+            ) AS src
+            CROSS JOIN LATERAL (VALUES {values}) AS m(metric, value)
+        """).format(
+            system=sql.Literal(system),
+            date_col=date_col,
+            columns=sql.SQL(", ").join(columns),
+            table=qualified_table(config),
+            conditions=sql.SQL(" AND ").join(conditions),
+            values=sql.SQL(", ").join(values),
+        )
+        return query, params
+
+    def daily_query(self, month: Optional[date]) -> Tuple[sql.Composed, list]:
+        """Pontos diários do mês alvo, com os totais e as comparações calculados no banco.
+
+        `lag` compara cada dia com o anterior e cada mês com o anterior;
+        `row_number` marca o melhor e o pior dia (o primeiro, em caso de empate).
+        A variação mensal compara as médias diárias, para que um mês em
+        andamento possa ser comparado com um mês fechado.
+        """
+        target, params = self._target_month(month)
+        sources = []
+        for system in self.systems:
+            source, source_params = self._daily_source(system)
+            sources.append(source)
+            params.extend(source_params)
+        query = sql.SQL("""
+            WITH target AS (SELECT {target} AS month),
+            daily (system, metric, day, value) AS (
+                {sources}
+            ),
+            monthly AS (
+                SELECT system, metric, date_trunc('month', day)::date AS month,
+                       SUM(value) AS total, AVG(value) AS average, COUNT(*) AS days
+                FROM daily
+                GROUP BY 1, 2, 3
+            ),
+            compared AS (
+                SELECT monthly.*,
+                       lag(total) OVER months AS previous_total,
+                       lag(average) OVER months AS previous_average,
+                       lag(days) OVER months AS previous_days,
+                       lag(month) OVER months AS previous_month
+                FROM monthly
+                WINDOW months AS (PARTITION BY system, metric ORDER BY month)
+            ),
+            current AS (
+                SELECT daily.*,
+                       lag(day) OVER days AS previous_day,
+                       lag(value) OVER days AS previous_value,
+                       row_number() OVER (PARTITION BY system, metric ORDER BY value DESC, day) = 1 AS best,
+                       row_number() OVER (PARTITION BY system, metric ORDER BY value, day) = 1 AS worst
+                FROM daily
+                WHERE day >= (SELECT month FROM target)
+                WINDOW days AS (PARTITION BY system, metric ORDER BY day)
+            )
+            SELECT current.system, current.metric, current.day, current.value,
+                   current.previous_day, current.previous_value, current.best, current.worst,
+                   {delta_previous_day} AS delta_previous_day,
+                   {delta_average} AS delta_average,
+                   compared.total, compared.average, compared.days,
+                   compared.previous_month, compared.previous_total, compared.previous_average, compared.previous_days,
+                   {delta_month} AS delta_month,
+                   (SELECT month FROM target) AS target_month
+            FROM current
+            JOIN compared
+              ON compared.system = current.system AND compared.metric = current.metric
+             AND compared.month = (SELECT month FROM target)
+            ORDER BY current.system, current.metric, current.day
+        """).format(
+            target=target,
+            sources=sql.SQL(" UNION ALL ").join(sources),
+            delta_previous_day=_delta(sql.SQL("current.value"), sql.SQL("current.previous_value")),
+            delta_average=_delta(sql.SQL("current.value"), sql.SQL("compared.average")),
+            delta_month=_delta(sql.SQL("compared.average"), sql.SQL("compared.previous_average")),
+        )
+        return query, params
+
+    def latest_query(self, system: str, month: Optional[date]) -> Tuple[sql.Composed, list]:
+        """Colunas `latest` da linha mais recente do sistema no mês alvo"""
+        config = self.sistemas[system]
+        resolve = self.registry.resolver(system)
+        date_col = resolve(config['date_col'])
+        target, params = self._target_month(month)
+        conditions, condition_params = self._conditions(system)
+        params.extend(condition_params)
+        query = sql.SQL("""
+            WITH target AS (SELECT {target} AS month)
+            SELECT {columns}, {date_col}::date
+            FROM {table}
+            WHERE {date_col} >= (SELECT month FROM target)
+              AND {date_col} < (SELECT month FROM target) + interval '1 month'
+              {conditions}
+            ORDER BY {date_col} DESC, {updated_col} DESC
+            LIMIT 1
+        """).format(
+            target=target,
+            columns=sql.SQL(", ").join(resolve(col) for col in self.sections[system]['latest']),
+            date_col=date_col,
+            table=qualified_table(config),
+            conditions=sql.SQL("").join(sql.SQL(" AND {}").format(condition) for condition in conditions),
+            updated_col=resolve(config['updated_col']),
+        )
+        return query, params
+
+    async def fetch(self, conn, month: Optional[date]) -> Dict[str, Any]:
+        """Executa as queries do relatório em um único round trip (pipeline mode)"""
+        for system in self.systems:
+            self.registry.get(system)
+        latest_systems = [system for system in self.systems if self.sections[system].get('latest')]
+        async with conn.pipeline():
+            months_cur = conn.cursor()
+            daily_cur = conn.cursor()
+            latest_curs = [conn.cursor() for _ in latest_systems]
+            await months_cur.execute(*self.months_query(), prepare=True)
+            await daily_cur.execute(*self.daily_query(month), prepare=True)
+            for system, cur in zip(latest_systems, latest_curs):
+                await cur.execute(*self.latest_query(system, month), prepare=True)
+            months = [row[0] for row in await months_cur.fetchall()]
+            daily_rows = await daily_cur.fetchall()
+            latest_rows = [await cur.fetchone() for cur in latest_curs]
+
+        target = daily_rows[0][-1] if daily_rows else month or (months[0] if months else None)
+        systems: Dict[str, Any] = {
+            system: {"metrics": {name: self._empty_metric() for name in self.metrics[system]}}
+            for system in self.systems
+        }
+        for row in daily_rows:
+            self._add_row(systems[row[0]]["metrics"][row[1]], row)
+        for system, row in zip(latest_systems, latest_rows):
+            columns = self.sections[system]['latest']
+            systems[system]["latest"] = (
+                {"date": row[-1].isoformat(), "values": dict(zip(columns, (_number(value) for value in row[:-1])))}
+                if row else None
+            )
+
+        return {
+            "months": [month_key(value) for value in months],
+            "month": month_key(target) if target else None,
+            "systems": systems,
+        }
+
+    @staticmethod
+    def _empty_metric() -> Dict[str, Any]:
+        return {
+            "total": 0, "average": 0, "days": 0, "daily": [],
+            "last": None, "previousDay": None, "best": None, "worst": None,
+            "deltaPreviousDay": None, "deltaAverage": None,
+            "previousMonth": None, "deltaMonth": None,
+        }
+
+    @staticmethod
+    def _add_row(metric: Dict[str, Any], row: tuple) -> None:
+        (_, _, day, value, previous_day, previous_value, best, worst, delta_previous_day, delta_average,
+         total, average, days, previous_month, previous_total, previous_average, previous_days,
+         delta_month, _) = row
+        point = {"date": day.isoformat(), "value": _number(value)}
+        metric["daily"].append(point)
+        # As linhas chegam em ordem de dia: a última é o dia mais recente do mês
+        metric.update(
+            total=_number(total), average=_number(average), days=days,
+            last=point,
+            previousDay={"date": previous_day.isoformat(), "value": _number(previous_value)} if previous_day else None,
+            deltaPreviousDay=_number(delta_previous_day),
+            deltaAverage=_number(delta_average),
+            previousMonth={
+                "month": month_key(previous_month),
+                "total": _number(previous_total),
+                "average": _number(previous_average),
+                "days": previous_days,
+            } if previous_month else None,
+            deltaMonth=_number(delta_month),
+        )
+        if best:
+            metric["best"] = point
+        if worst:
+            metric["worst"] = point
+
+
+def _number(value: Any) -> Optional[float]:
+    return float(value) if value is not None else None
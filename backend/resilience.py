@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, Hashable, Optional, Tuple
+from weakref import WeakKeyDictionary
+
+import psycopg
+
+from deadline import current_deadline
+from metrics import InstrumentedPool, record_cancelled_work
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(psycopg.OperationalError):
+    """Banco considerado indisponível: a requisição falha na hora, sem esperar o pool"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Banco de dados indisponível (circuit breaker aberto)")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Abre após `failure_threshold` falhas seguidas de conexão/timeout.
+
+    Aberto, recusa tudo por `reset_timeout` segundos; depois deixa passar uma
+    única requisição de teste (half-open), que fecha o circuito se der certo
+    ou o reabre se falhar.
+    """
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half_open'
+
+    def before_call(self) -> None:
+        state = self.state
+        if state == 'closed' or self.failure_threshold <= 0:
+            return
+        if state == 'half_open' and not self._probing:
+            self._probing = True
+            return
+        raise CircuitOpenError(max(0.0, self.opened_at + self.reset_timeout - time.monotonic()))
+
+    def record_success(self) -> None:
+        if self.opened_at is not None:
+            logger.info("Banco de dados respondeu; circuit breaker fechado")
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+
+    def release(self) -> None:
+        """Libera a vaga de teste do half-open sem concluir nada sobre o banco"""
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        if self._probing or (self.failure_threshold > 0 and self.failures >= self.failure_threshold):
+            if self.state != 'open':
+                logger.warning("Circuit breaker aberto após %d falha(s) seguidas do banco", self.failures)
+            self.opened_at = time.monotonic()
+            self._probing = False
+
+
+class ResilientPool(InstrumentedPool):
+    """Pool que consulta o circuit breaker antes de entregar uma conexão.
+
+    Só erros operacionais (sem conexão, timeout do pool, statement_timeout)
+    contam como falha; erros de SQL mostram que o banco está respondendo.
+
+    Cada conexão entregue recebe o statement_timeout do prazo da requisição
+    atual (sem passar de `statement_timeout_ms`). Se a requisição for
+    abandonada, o psycopg cancela a query em andamento no Postgres ao receber
+    o CancelledError e a conexão volta limpa ao pool; aqui só medimos o
+    trabalho descartado.
+    """
+
+    def __init__(self, *args, breaker: CircuitBreaker, statement_timeout_ms: int = 0, **kwargs):
+        self.breaker = breaker
+        self.statement_timeout_ms = statement_timeout_ms
+        # statement_timeout de cada conexão, quando diferente do padrão da sessão
+        self._statement_timeouts: WeakKeyDictionary = WeakKeyDictionary()
+        super().__init__(*args, **kwargs)
+
+    async def _apply_deadline(self, conn) -> None:
+        """Ajusta o statement_timeout da conexão ao prazo restante (só faz o SET quando o valor muda)"""
+        deadline = current_deadline()
+        timeout = deadline.statement_timeout_ms(self.statement_timeout_ms) if deadline else self.statement_timeout_ms
+        if timeout != self._statement_timeouts.get(conn, self.statement_timeout_ms):
+            await conn.execute("SELECT set_config('statement_timeout', %s, false)", (str(timeout),))
+            self._statement_timeouts[conn] = timeout
+
+    @asynccontextmanager
+    async def connection(self, timeout: Optional[float] = None) -> AsyncIterator[Any]:
+        self.breaker.before_call()
+        try:
+            async with super().connection(timeout) as conn:
+                await self._apply_deadline(conn)
+                checked_out = time.perf_counter()
+                try:
+                    yield conn
+                except asyncio.CancelledError:
+                    deadline = current_deadline()
+                    reason = deadline.cancelled if deadline and deadline.cancelled else 'cancelled'
+                    record_cancelled_work(reason, time.perf_counter() - checked_out)
+                    raise
+        except psycopg.errors.QueryCanceled:
+            # Prazo mais curto pedido pelo cliente não diz nada sobre a saúde do banco
+            deadline = current_deadline()
+            if deadline and deadline.custom:
+                self.breaker.release()
+            else:
+                self.breaker.record_failure()
+            raise
+        except psycopg.OperationalError:
+            self.breaker.record_failure()
+            raise
+        except asyncio.CancelledError:
+            # Requisição abandonada (ex.: cliente desconectou): não diz nada sobre o banco
+            self.breaker.release()
+            raise
+        except BaseException:
+            self.breaker.record_success()
+            raise
+        else:
+            self.breaker.record_success()
+
+
+class LastGoodStore:
+    """Último resultado bom por chave, servido como stale quando o banco falha"""
+
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self._items: Dict[Hashable, Tuple[Any, float]] = {}
+
+    def put(self, key: Hashable, value: Any) -> None:
+        self._items[key] = (value, time.monotonic())
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, float]]:
+        """Devolve (valor, idade em segundos) ou None se não houver um valor recente o bastante"""
+        item = self._items.get(key)
+        if item is None:
+            return None
+        value, stored_at = item
+        age = time.monotonic() - stored_at
+        return (value, age) if age <= self.max_age else None
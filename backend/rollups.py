@@ -0,0 +1,534 @@
+import asyncio
+import logging
+import time
+from datetime import date
+from typing import Any, AsyncContextManager, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from psycopg import sql
+
+from aggregate import AGGREGATIONS, get_metrics
+from queries import SERIES_BUCKETS, CompiledQuery, QueryRegistry, primary_filtro, qualified_table
+
+logger = logging.getLogger(__name__)
+
+# Métrica especial com valor 1 por linha: a soma dela é o COUNT(*) do dia/mês
+ROW_COUNT_METRIC = '*'
+
+# Como cada função de agregação é recomposta a partir das colunas do rollup
+# (`{filter}` recebe o FILTER (WHERE metric = ...) quando várias métricas saem na mesma linha)
+ROLLUP_EXPRESSIONS = {
+    'SUM': "SUM(sum_value){filter}",
+    'AVG': "SUM(sum_value){filter} / NULLIF(SUM(count_value){filter}, 0)",
+    'MIN': "MIN(min_value){filter}",
+    'MAX': "MAX(max_value){filter}",
+    'COUNT': "SUM(count_value){filter}",
+}
+
+# Pontos da série de /api/series (mesmo LIMIT das queries originais)
+SERIES_DAYS = 14
+
+
+def rollup_metrics(config: Dict[str, Any]) -> List[str]:
+    """Colunas agregadas no rollup do sistema: métricas, coluna do gráfico e a contagem de linhas"""
+    metrics = [ROW_COUNT_METRIC, *get_metrics(config), config['chart_col']]
+    series = series_source(config)
+    if series:
+        metrics.append(series[0])
+    return list(dict.fromkeys(metrics))
+
+
+def series_source(config: Dict[str, Any]) -> Optional[Tuple[str, str]]:
+    """(métrica, função) que reproduz a série do sistema a partir do rollup.
+
+    Sistemas com `custom_series_query` só usam o rollup se declararem
+    `rollup_series`; sem isso a série continua vindo da tabela original.
+    """
+    if 'custom_series_query' in config:
+        rollup = config.get('rollup_series')
+        return (rollup['col'], rollup['aggregation'].upper()) if rollup else None
+    return config['chart_col'], config['series_aggregation'].upper()
+
+
+def build_rollup_tables_sql(schema: str) -> List[sql.Composed]:
+    """DDL das tabelas de rollup (uma linha por sistema, valor do filtro, dia/mês e métrica)"""
+    schema_id = sql.Identifier(schema)
+    statements = []
+    for table, bucket in (('kpi_rollup_daily', 'ref_date'), ('kpi_rollup_monthly', 'month')):
+        statements.append(sql.SQL("""
+            CREATE TABLE IF NOT EXISTS {schema}.{table} (
+                system text NOT NULL,
+                filtro text NOT NULL,
+                {bucket} date NOT NULL,
+                metric text NOT NULL,
+                sum_value numeric,
+                count_value bigint NOT NULL,
+                min_value numeric,
+                max_value numeric,
+                updated_at timestamptz,
+                PRIMARY KEY (system, filtro, metric, {bucket})
+            )
+        """).format(schema=schema_id, table=sql.Identifier(table), bucket=sql.Identifier(bucket)))
+        statements.append(sql.SQL("CREATE INDEX IF NOT EXISTS {index} ON {schema}.{table} (system, {bucket})").format(
+            index=sql.Identifier(f"{table}_system_{bucket}_idx"),
+            schema=schema_id,
+            table=sql.Identifier(table),
+            bucket=sql.Identifier(bucket),
+        ))
+    statements.append(sql.SQL("""
+        CREATE TABLE IF NOT EXISTS {schema}.kpi_rollup_state (
+            system text PRIMARY KEY,
+            watermark timestamptz,
+            refreshed_at timestamptz NOT NULL DEFAULT now()
+        )
+    """).format(schema=schema_id))
+    return statements
+
+
+class RollupManager:
+    """Mantém os rollups diário e mensal de cada sistema do SISTEMAS_DB.
+
+    A atualização é incremental: só os dias com linhas cujo `updated_col` é
+    maior ou igual ao último watermark processado menos `overlap` segundos
+    são recalculados, e os meses são remontados a partir do rollup diário.
+    A janela de sobreposição pega linhas de transações que gravaram um
+    `updated_col` antigo mas só fizeram commit depois do último refresh.
+    Exclusões na tabela de origem não alteram o `updated_col`; para elas use
+    `python manage.py refresh-rollups --full`.
+
+    Cada refresh roda com `statement_timeout_ms` próprio (0 mantém o da
+    sessão), já que recalcular muitos dias leva bem mais que uma leitura.
+    """
+
+    def __init__(
+        self,
+        sistemas: Dict[str, Dict[str, Any]],
+        registry: QueryRegistry,
+        schema: str,
+        overlap: float = 0,
+        statement_timeout_ms: int = 0,
+    ):
+        self.sistemas = sistemas
+        self.registry = registry
+        self.schema = schema
+        self.overlap = overlap
+        self.statement_timeout_ms = statement_timeout_ms
+        # Vira True no startup se as tabelas de rollup existirem
+        self.available = False
+        schema_id = sql.Identifier(schema)
+        self._daily = sql.SQL("{}.kpi_rollup_daily").format(schema_id)
+        self._monthly = sql.SQL("{}.kpi_rollup_monthly").format(schema_id)
+        self._state = sql.SQL("{}.kpi_rollup_state").format(schema_id)
+
+    def supports(self, system: str) -> bool:
+        return self.available and system not in self.registry.errors
+
+    async def check(self, conn) -> bool:
+        """Confere se as tabelas de rollup já foram criadas"""
+        names = [f"{self.schema}.{table}" for table in ('kpi_rollup_daily', 'kpi_rollup_monthly', 'kpi_rollup_state')]
+        async with conn.cursor() as cur:
+            await cur.execute("SELECT bool_and(to_regclass(name) IS NOT NULL) FROM unnest(%s::text[]) AS name", (names,))
+            self.available = bool((await cur.fetchone())[0])
+        return self.available
+
+    async def install(self, conn) -> None:
+        for statement in build_rollup_tables_sql(self.schema):
+            await conn.execute(statement)
+        self.available = True
+
+    async def watermarks(self, conn, systems: List[str]) -> Dict[str, Tuple[Any, Any]]:
+        """(MAX(updated_col) da origem, watermark do último refresh) de cada sistema, em uma única query"""
+        sources = []
+        for system in systems:
+            config = self.sistemas[system]
+            sources.append(sql.SQL("SELECT {}::text, (SELECT MAX({}) FROM {})::timestamptz").format(
+                sql.Literal(system),
+                self.registry.resolver(system)(config['updated_col']),
+                qualified_table(config),
+            ))
+        if not sources:
+            return {}
+        query = sql.SQL("""
+            WITH source(system, watermark) AS ({sources})
+            SELECT source.system, source.watermark, state.watermark
+            FROM source
+            LEFT JOIN {state} AS state USING (system)
+        """).format(sources=sql.SQL(" UNION ALL ").join(sources), state=self._state)
+        async with conn.cursor() as cur:
+            await cur.execute(query)
+            return {system: (source, state) for system, source, state in await cur.fetchall()}
+
+    def refreshed_at(self, system: str) -> sql.Composed:
+        """Subquery com o momento do último refresh do rollup do sistema (muda a cada atualização)"""
+        return sql.SQL("(SELECT refreshed_at FROM {} WHERE system = {})").format(self._state, sql.Literal(system))
+
+    def watermark_query(self, system: str, source: CompiledQuery) -> CompiledQuery:
+        """Watermark da origem junto com o último refresh do rollup, em uma linha.
+
+        Para as respostas lidas do rollup: enquanto o refresh em segundo plano
+        não alcança a origem, o watermark da origem já mudou mas os dados não;
+        com o refresh no watermark, cache e ETag mudam de novo quando ele acontece.
+        """
+        query = source.query if isinstance(source.query, sql.Composable) else sql.SQL(source.query)
+        return CompiledQuery(
+            sql.SQL("SELECT ({source}), {refreshed_at}").format(source=query, refreshed_at=self.refreshed_at(system)),
+            source.params,
+        )
+
+    async def refresh(self, conn, system: str, full: bool = False) -> int:
+        """Recalcula os dias alterados desde o último watermark. Retorna quantos dias foram refeitos."""
+        config = self.sistemas[system]
+        resolve = self.registry.resolver(system)
+        table = qualified_table(config)
+        date_col = resolve(config['date_col'])
+        updated_col = resolve(config['updated_col'])
+
+        async with conn.transaction():
+            async with conn.cursor() as cur:
+                if self.statement_timeout_ms:
+                    # Só nesta transação: a conexão volta ao pool com o statement_timeout das leituras
+                    await cur.execute("SELECT set_config('statement_timeout', %s, true)",
+                                      (str(self.statement_timeout_ms),))
+                # Serializa refreshes do mesmo sistema entre workers
+                await cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"kpi_rollup:{system}",))
+                await cur.execute(sql.SQL("SELECT watermark FROM {} WHERE system = %s").format(self._state), (system,))
+                row = await cur.fetchone()
+                watermark = None if full or not row else row[0]
+
+                if watermark is None:
+                    changed_filter, params = sql.SQL(""), ()
+                else:
+                    changed_filter = sql.SQL("WHERE {} >= %s::timestamptz - %s * interval '1 second'").format(updated_col)
+                    params = (watermark, self.overlap)
+                await cur.execute(sql.SQL("""
+                    SELECT
+                        (SELECT array_agg(DISTINCT {date_col}::date) FROM {table} {changed_filter}),
+                        (SELECT MAX({updated_col}) FROM {table})
+                """).format(date_col=date_col, table=table, changed_filter=changed_filter, updated_col=updated_col), params)
+                dates, new_watermark = await cur.fetchone()
+                dates = dates or []
+
+                if full:
+                    for target in (self._daily, self._monthly):
+                        await cur.execute(sql.SQL("DELETE FROM {} WHERE system = %s").format(target), (system,))
+                if dates:
+                    months = sorted({day.replace(day=1) for day in dates})
+                    await cur.execute(
+                        sql.SQL("DELETE FROM {} WHERE system = %s AND ref_date = ANY(%s)").format(self._daily),
+                        (system, dates)
+                    )
+                    await cur.execute(self._daily_insert(system, resolve), (system, dates))
+                    await cur.execute(
+                        sql.SQL("DELETE FROM {} WHERE system = %s AND month = ANY(%s)").format(self._monthly),
+                        (system, months)
+                    )
+                    await cur.execute(self._monthly_insert(), (system, months))
+
+                await cur.execute(sql.SQL("""
+                    INSERT INTO {} (system, watermark, refreshed_at) VALUES (%s, %s, now())
+                    ON CONFLICT (system) DO UPDATE SET watermark = EXCLUDED.watermark, refreshed_at = now()
+                """).format(self._state), (system, new_watermark))
+        return len(dates)
+
+    def metrics(self, system: str) -> List[str]:
+        """Métricas do rollup que existem de fato na tabela (colunas ausentes são ignoradas)"""
+        return [
+            metric for metric in rollup_metrics(self.sistemas[system])
+            if metric == ROW_COUNT_METRIC or self.registry.has_column(system, metric)
+        ]
+
+    def _daily_insert(self, system: str, resolve) -> sql.Composed:
+        config = self.sistemas[system]
+        column = lambda name: sql.SQL("src.{}").format(resolve(name))
+        values = sql.SQL(", ").join(
+            sql.SQL("({}, {})").format(
+                sql.Literal(metric),
+                sql.SQL("1::numeric") if metric == ROW_COUNT_METRIC else sql.SQL("{}::numeric").format(column(metric))
+            )
+            for metric in self.metrics(system)
+        )
+        filtro = (
+            sql.SQL("COALESCE({}::text, '')").format(column(config['filtro_col']))
+            if config['filtro_col'] else sql.SQL("''")
+        )
+        return sql.SQL("""
+            INSERT INTO {daily} (system, filtro, ref_date, metric, sum_value, count_value, min_value, max_value, updated_at)
+            SELECT %s, {filtro}, {date_col}::date, m.metric,
+                   SUM(m.value), COUNT(m.value), MIN(m.value), MAX(m.value), MAX({updated_col})
+            FROM {table} AS src
+            CROSS JOIN LATERAL (VALUES {values}) AS m(metric, value)
+            WHERE {date_col}::date = ANY(%s)
+            GROUP BY 2, 3, 4
+        """).format(
+            daily=self._daily,
+            filtro=filtro,
+            date_col=column(config['date_col']),
+            updated_col=column(config['updated_col']),
+            table=qualified_table(config),
+            values=values,
+        )
+
+    def _monthly_insert(self) -> sql.Composed:
+        return sql.SQL("""
+            INSERT INTO {monthly} (system, filtro, month, metric, sum_value, count_value, min_value, max_value, updated_at)
+            SELECT system, filtro, date_trunc('month', ref_date)::date, metric,
+                   SUM(sum_value), SUM(count_value), MIN(min_value), MAX(max_value), MAX(updated_at)
+            FROM {daily}
+            WHERE system = %s AND date_trunc('month', ref_date)::date = ANY(%s)
+            GROUP BY 1, 2, 3, 4
+        """).format(monthly=self._monthly, daily=self._daily)
+
+    def series(self, system: str) -> Optional[CompiledQuery]:
+        """Query da série de 14 dias lida do rollup diário (None se o sistema não tiver rollup de série)"""
+        config = self.sistemas[system]
+        source = series_source(config)
+        if not self.supports(system) or source is None:
+            return None
+        metric, aggregation = source
+        query = sql.SQL("""
+            SELECT ref_date, {expression} AS value_sum
+            FROM {daily}
+            WHERE system = %s AND filtro = %s AND metric = %s
+            GROUP BY ref_date
+            ORDER BY ref_date DESC
+            LIMIT {limit}
+        """).format(
+            expression=sql.SQL(ROLLUP_EXPRESSIONS[aggregation].format(filter="")),
+            daily=self._daily,
+            limit=sql.Literal(SERIES_DAYS),
+        )
+        return CompiledQuery(query, (system, primary_filtro(config), metric))
+
+    def grouped_series(self, system: str) -> Optional[CompiledQuery]:
+        """Séries de 14 dias de vários valores do filtro lidas do rollup (a lista entra como último parâmetro)"""
+        config = self.sistemas[system]
+        source = series_source(config)
+        if not self.supports(system) or source is None or not config['filtro_col']:
+            return None
+        metric, aggregation = source
+        query = sql.SQL("""
+            SELECT filtro, ref_date, value_sum
+            FROM (
+                SELECT filtro, ref_date, {expression} AS value_sum,
+                       row_number() OVER (PARTITION BY filtro ORDER BY ref_date DESC) AS position
+                FROM {daily}
+                WHERE system = %s AND metric = %s AND filtro = ANY(%s)
+                GROUP BY filtro, ref_date
+            ) AS grouped
+            WHERE position <= {limit}
+            ORDER BY filtro, ref_date DESC
+        """).format(
+            expression=sql.SQL(ROLLUP_EXPRESSIONS[aggregation].format(filter="")),
+            daily=self._daily,
+            limit=sql.Literal(SERIES_DAYS),
+        )
+        return CompiledQuery(query, (system, metric))
+
+    def range_series(
+        self,
+        system: str,
+        bucket: str,
+        date_from: Optional[date],
+        date_to: Optional[date],
+        filtro_vals: Optional[List[str]] = None,
+    ) -> Optional[Tuple[sql.Composed, list]]:
+        """Série de um intervalo qualquer lida do rollup diário, no mesmo formato de `build_range_series_query`.
+
+        Os totais por semana/mês são recompostos a partir das colunas do rollup
+        (soma, contagem, mínimo e máximo de cada dia). None se o sistema não tiver rollup de série.
+        """
+        config = self.sistemas[system]
+        source = series_source(config)
+        if not self.supports(system) or source is None:
+            return None
+        if bucket not in SERIES_BUCKETS:
+            raise ValueError(f"Intervalo inválido: {bucket}")
+        metric, aggregation = source
+        grouped = filtro_vals is not None
+        conditions = [sql.SQL("system = %s"), sql.SQL("metric = %s")]
+        params: list = [system, metric]
+        if grouped:
+            conditions.append(sql.SQL("filtro = ANY(%s)"))
+            params.append(filtro_vals)
+        else:
+            conditions.append(sql.SQL("filtro = %s"))
+            params.append(primary_filtro(config))
+        if date_from:
+            conditions.append(sql.SQL("ref_date >= %s"))
+            params.append(date_from)
+        if date_to:
+            conditions.append(sql.SQL("ref_date <= %s"))
+            params.append(date_to)
+
+        query = sql.SQL("""
+            SELECT {group}date_trunc({bucket}, ref_date)::date AS ref, {expression} AS value_sum
+            FROM {daily}
+            WHERE {conditions}
+            GROUP BY {group_by}
+            ORDER BY {order_by}
+        """).format(
+            group=sql.SQL("filtro, " if grouped else ""),
+            bucket=sql.Literal(bucket),
+            expression=sql.SQL(ROLLUP_EXPRESSIONS[aggregation].format(filter="")),
+            daily=self._daily,
+            conditions=sql.SQL(" AND ").join(conditions),
+            group_by=sql.SQL("filtro, ref" if grouped else "ref"),
+            order_by=sql.SQL("filtro, ref DESC" if grouped else "ref DESC"),
+        )
+        return query, params
+
+    def months_query(self, systems: List[str]) -> Tuple[sql.Composed, list]:
+        """Meses com dados em algum dos sistemas (mais recente primeiro)"""
+        query = sql.SQL("SELECT DISTINCT month FROM {} WHERE system = ANY(%s) ORDER BY month DESC").format(
+            self._monthly
+        )
+        return query, [systems]
+
+    def monthly_query(
+        self,
+        system: str,
+        metrics: List[str],
+        date_from: Optional[date] = None,
+        date_to: Optional[date] = None,
+    ) -> Tuple[sql.Composed, list, List[str]]:
+        """Totais mensais das métricas pedidas (`coluna:funcao`, ou `count` para o número de linhas).
+
+        Retorna (query, parâmetros, aliases das métricas), uma linha por mês.
+        """
+        config = self.sistemas[system]
+        available = self.metrics(system)
+        columns = []
+        aliases = []
+        params: list = []
+        for spec in metrics:
+            if spec == 'count':
+                col, agg = ROW_COUNT_METRIC, 'sum'
+                alias = 'count'
+            else:
+                col, _, agg = spec.partition(':')
+                agg = (agg or 'sum').lower()
+                alias = f"{col}_{agg}"
+            if col not in available:
+                raise HTTPException(status_code=400, detail=f"Métrica inválida: {col}")
+            if agg not in AGGREGATIONS:
+                raise HTTPException(status_code=400, detail=f"Agregação inválida: {agg}")
+            expression = ROLLUP_EXPRESSIONS[AGGREGATIONS[agg]].format(filter=" FILTER (WHERE metric = %s)")
+            columns.append(sql.SQL("{} AS {}").format(sql.SQL(expression), sql.Identifier(alias)))
+            params.extend([col] * expression.count('%s'))
+            aliases.append(alias)
+        if not columns:
+            raise HTTPException(status_code=400, detail="Informe ao menos uma métrica")
+
+        conditions = [sql.SQL("system = %s"), sql.SQL("filtro = %s")]
+        params.extend([system, primary_filtro(config)])
+        if date_from:
+            conditions.append(sql.SQL("month >= date_trunc('month', %s::date)"))
+            params.append(date_from)
+        if date_to:
+            conditions.append(sql.SQL("month <= %s"))
+            params.append(date_to)
+
+        query = sql.SQL("""
+            SELECT month, {columns}, MAX(updated_at) AS updated_at
+            FROM {monthly}
+            WHERE {conditions}
+            GROUP BY month
+            ORDER BY month DESC
+        """).format(
+            columns=sql.SQL(", ").join(columns),
+            monthly=self._monthly,
+            conditions=sql.SQL(" AND ").join(conditions),
+        )
+        return query, params, aliases
+
+
+class RollupRefresher:
+    """Mantém os rollups em dia em segundo plano, fora do caminho das requisições.
+
+    A cada `interval` segundos (ou logo após um `schedule`) compara o
+    MAX(updated_col) de cada sistema com o do último refresh e atualiza os que
+    mudaram, em uma conexão própria. Cada sistema atualizado é verificado de
+    novo `overlap` segundos depois, para pegar commits atrasados mesmo sem
+    novas mudanças. `on_refresh` recebe os sistemas cujo rollup mudou, inclusive
+    por outro worker, para descartar o que foi calculado com o rollup antigo.
+    """
+
+    def __init__(
+        self,
+        rollups: RollupManager,
+        systems: List[str],
+        connection: Callable[[], AsyncContextManager[Any]],
+        interval: float,
+        on_refresh: Callable[[List[str]], Awaitable[None]],
+    ):
+        self.rollups = rollups
+        self.systems = systems
+        self.connection = connection
+        self.interval = interval
+        self.on_refresh = on_refresh
+        # Watermark do rollup de cada sistema visto na última verificação
+        self._seen: Dict[str, Any] = {}
+        # Quando cada sistema atualizado deve ser verificado de novo (janela de sobreposição)
+        self._recheck: Dict[str, float] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def schedule(self, systems: Iterable[str]) -> None:
+        """Antecipa a próxima verificação (sem esperar por ela)"""
+        if any(system in self.systems for system in systems):
+            self._wakeup.set()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                changed = await self.refresh()
+                if changed:
+                    await self.on_refresh(changed)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Falha ao verificar os rollups: %s", e)
+
+    async def refresh(self) -> List[str]:
+        """Atualiza os rollups desatualizados. Retorna os sistemas cujo rollup mudou."""
+        systems = [system for system in self.systems if self.rollups.supports(system)]
+        if not systems:
+            return []
+        changed: Set[str] = set()
+        async with self.connection() as conn:
+            watermarks = await self.rollups.watermarks(conn, systems)
+            now = time.monotonic()
+            for system, (source, state) in watermarks.items():
+                recheck = self._recheck.get(system, float('inf')) <= now
+                if source != state or recheck:
+                    self._recheck.pop(system, None)
+                    try:
+                        days = await self.rollups.refresh(conn, system)
+                    except Exception as e:
+                        logger.warning("Falha ao atualizar o rollup de %s: %s", system, e)
+                        continue
+                    if days:
+                        changed.add(system)
+                    if source != state and self.rollups.overlap:
+                        self._recheck[system] = now + self.rollups.overlap
+                    state = source
+                if system in self._seen and self._seen[system] != state:
+                    changed.add(system)
+                self._seen[system] = state
+        return sorted(changed)
@@ -0,0 +1,244 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS snapshots (
+        key TEXT PRIMARY KEY,
+        body BLOB NOT NULL,
+        watermark TEXT,
+        computed_at REAL NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS leader (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        owner TEXT NOT NULL,
+        expires_at REAL NOT NULL
+    )
+    """,
+]
+
+
+def encode_body(value: Any) -> bytes:
+    """Mesmo formato do JSONResponse (o valor já passou pelo jsonable_encoder)"""
+    return json.dumps(value, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_watermark(watermark: Any) -> Optional[str]:
+    if isinstance(watermark, tuple):
+        # Watermark composto (origem e último refresh do rollup)
+        return json.dumps([encode_watermark(part) for part in watermark])
+    return watermark.isoformat() if isinstance(watermark, (date, datetime)) else None
+
+
+def decode_watermark(value: Optional[str]) -> Any:
+    if value and value.startswith('['):
+        return tuple(decode_watermark(part) for part in json.loads(value))
+    return datetime.fromisoformat(value) if value else None
+
+
+@dataclass
+class Snapshot:
+    body: bytes
+    watermark: Any
+    computed_at: float
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.computed_at
+
+
+class SnapshotStore:
+    """Snapshots pré-serializados em um arquivo SQLite compartilhado pelos workers da mesma máquina.
+
+    Cada processo abre a própria conexão no startup (`open`) e guarda as
+    linhas em memória; o `PRAGMA data_version` indica quando outro processo
+    publicou algo novo, e só então o cache local é descartado.
+
+    Todas as chamadas ao SQLite rodam em uma thread dedicada: a espera pelo
+    lock do arquivo (até 5 s no BEGIN IMMEDIATE) não trava o event loop, e a
+    conexão nunca é usada por duas threads ao mesmo tempo.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._version: Optional[int] = None
+        self._cache: Dict[str, Optional[Snapshot]] = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='snapshots')
+
+    async def _call(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def open(self) -> None:
+        """Abre a conexão e cria o schema (PRAGMAs e CREATE TABLE) fora das requisições"""
+        await self._call(self._connect)
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, timeout=5)
+            # WAL: leitores não bloqueiam a publicação e vice-versa
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    async def close(self) -> None:
+        await self._call(self._close)
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    async def get(self, key: str) -> Optional[Snapshot]:
+        return await self._call(self._get, key)
+
+    def _get(self, key: str) -> Optional[Snapshot]:
+        conn = self._connect()
+        version = conn.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._version:
+            self._cache = {}
+            self._version = version
+        if key not in self._cache:
+            row = conn.execute("SELECT body, watermark, computed_at FROM snapshots WHERE key = ?", (key,)).fetchone()
+            self._cache[key] = Snapshot(row[0], decode_watermark(row[1]), row[2]) if row else None
+        return self._cache[key]
+
+    async def publish(self, items: Dict[str, Tuple[bytes, Any]]) -> None:
+        """Grava todos os snapshots em uma única transação (leitores veem tudo ou nada)"""
+        await self._call(self._publish, items)
+
+    def _publish(self, items: Dict[str, Tuple[bytes, Any]]) -> None:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO snapshots (key, body, watermark, computed_at) VALUES (?, ?, ?, ?)",
+                [(key, body, encode_watermark(watermark), now) for key, (body, watermark) in items.items()]
+            )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        # O data_version não muda para as escritas da própria conexão
+        self._cache = {}
+
+    async def discard(self, keys: List[str]) -> None:
+        """Remove snapshots que ficaram desatualizados (ex.: depois de uma carga pelo /api/ingest)"""
+        await self._call(self._discard, keys)
+
+    def _discard(self, keys: List[str]) -> None:
+        conn = self._connect()
+        conn.executemany("DELETE FROM snapshots WHERE key = ?", [(key,) for key in keys])
+        self._cache = {}
+
+    async def try_lead(self, owner: str, ttl: float) -> bool:
+        """Renova (ou assume, se expirado) o lease de quem publica. Só um processo publica por vez."""
+        return await self._call(self._try_lead, owner, ttl)
+
+    def _try_lead(self, owner: str, ttl: float) -> bool:
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT owner, expires_at FROM leader WHERE id = 1").fetchone()
+            leading = row is None or row[0] == owner or row[1] < now
+            if leading:
+                conn.execute(
+                    "INSERT OR REPLACE INTO leader (id, owner, expires_at) VALUES (1, ?, ?)", (owner, now + ttl)
+                )
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+        return leading
+
+    async def resign(self, owner: str) -> None:
+        """Libera o lease no shutdown para outro worker assumir sem esperar o TTL"""
+        await self._call(self._resign, owner)
+
+    def _resign(self, owner: str) -> None:
+        conn = self._connect()
+        conn.execute("DELETE FROM leader WHERE id = 1 AND owner = ?", (owner,))
+
+
+class SnapshotPublisher:
+    """Recalcula os snapshots quando algum watermark muda (ou a cada `max_age / 2` segundos).
+
+    Todos os workers rodam o loop, mas só o dono do lease consulta o banco:
+    a carga no Postgres não cresce com o número de workers ou de telas.
+    """
+
+    def __init__(
+        self,
+        store: SnapshotStore,
+        systems: List[str],
+        fetch_watermarks: Callable[[List[str]], Awaitable[Dict[str, Any]]],
+        compute: Callable[[List[str], Dict[str, Any]], Awaitable[Dict[str, Tuple[bytes, Any]]]],
+        interval: float,
+        max_age: float,
+    ):
+        self.store = store
+        self.systems = systems
+        self.fetch_watermarks = fetch_watermarks
+        self.compute = compute
+        self.interval = interval
+        self.max_age = max_age
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self._watermarks: Optional[Dict[str, Any]] = None
+        self._published_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.store.resign(self.owner)
+        await self.store.close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                # O lease dura 3 intervalos: um worker travado perde a vez
+                if await self.store.try_lead(self.owner, self.interval * 3):
+                    await self.publish_if_changed()
+                else:
+                    self._watermarks = None
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Falha ao publicar os snapshots: %s", e)
+            await asyncio.sleep(self.interval)
+
+    async def publish_if_changed(self) -> bool:
+        watermarks = await self.fetch_watermarks(self.systems)
+        expired = time.time() - self._published_at > self.max_age / 2
+        if watermarks == self._watermarks and not expired:
+            return False
+        items = await self.compute(self.systems, watermarks)
+        await self.store.publish(items)
+        self._watermarks = watermarks
+        self._published_at = time.time()
+        return True
@@ -1,11 +1,21 @@
-from main import get_kpi_and_series
+import asyncio
+import main
+from main import get_kpis_data, get_series_data
 
-try:
-    result = get_kpi_and_series('evolution')
-    print("SUCCESS: Evolution API funcionou!")
-    print("KPIs:", result[0])
-    print("Series:", result[1])
-except Exception as e:
-    print(f"ERRO: {e}")
-    import traceback
-    traceback.print_exc()
+async def run():
+    main.pool = main.create_pool()
+    await main.pool.open()
+    try:
+        kpis = await get_kpis_data('evolution')
+        series = await get_series_data('evolution')
+        print("SUCCESS: Evolution API funcionou!")
+        print("KPIs:", kpis)
+        print("Series:", series)
+    except Exception as e:
+        print(f"ERRO: {e}")
+        import traceback
+        traceback.print_exc()
+    finally:
+        await main.pool.close()
+
+asyncio.run(run())
@@ -0,0 +1,40 @@
+import pytest
+from fastapi import HTTPException
+
+from aggregate import build_aggregate_query, build_facets_query
+
+CONFIG = {
+    'schema': 'kpi_tv',
+    'tabela': 'piperun_daily',
+    'filtro_col': 'pipeline_id',
+    'filtro_val': ['78157', '78175', '78291'],
+    'date_col': 'ref_date',
+    'updated_col': 'updated_at',
+    'kpi_cols': ['oportunidades_recebidas'],
+    'dimensions': ['pipeline_id', 'pipeline_name'],
+}
+
+
+def aggregate_params(filters):
+    _, params, _ = build_aggregate_query(CONFIG, ['pipeline_name'], ['oportunidades_recebidas:sum'], filters=filters)
+    return params[:-1]
+
+
+def test_primary_filtro_by_default():
+    assert aggregate_params([]) == ['78157']
+
+
+def test_filter_on_filtro_col_replaces_primary_filtro():
+    assert aggregate_params(['pipeline_id:78175']) == [['78175']]
+    assert aggregate_params(['pipeline_id:78175', 'pipeline_id:78291', 'pipeline_name:X']) == [['78175', '78291'], ['X']]
+
+
+def test_filter_outside_configured_values_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        aggregate_params(['pipeline_id:99999'])
+    assert error.value.status_code == 400
+
+
+def test_facets_cover_every_configured_filtro():
+    _, params = build_facets_query(CONFIG, ['pipeline_id'])
+    assert params == [['78157', '78175', '78291']]
@@ -0,0 +1,213 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from cache import SingleFlight, WatermarkCache
+from deadline import DeadlineMiddleware, current_deadline
+
+
+def asgi_get(path='/', headers=()):
+    return {'type': 'http', 'method': 'GET', 'path': path, 'headers': list(headers)}
+
+
+async def call_and_disconnect(app, scope, after: float):
+    """Chama o app ASGI e simula o cliente desconectando depois de `after` segundos"""
+    sent = []
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(after)
+        return {'type': 'http.disconnect'}
+
+    async def send(event):
+        sent.append(event)
+
+    await app(scope, receive, send)
+    return sent
+
+
+def test_disconnect_cancels_shared_refresh():
+    async def run():
+        cache = WatermarkCache(ttl=60, budget=10)
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def compute():
+            started.set()
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        async def endpoint(scope, receive, send):
+            await cache.get(('kpis', 'piperun'), lambda: asyncio.sleep(0, 'wm'), compute)
+
+        app = DeadlineMiddleware(endpoint, default=10, maximum=30)
+        sent = await call_and_disconnect(app, asgi_get(), after=0.05)
+        assert started.is_set()
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert sent == []
+
+    asyncio.run(run())
+
+
+def test_shared_work_continues_while_someone_waits():
+    async def run():
+        flight = SingleFlight()
+        release = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            return 42
+
+        first = asyncio.create_task(flight.wait('k', work))
+        second = asyncio.create_task(flight.wait('k', work))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        release.set()
+        assert await second == 42
+        with pytest.raises(asyncio.CancelledError):
+            await first
+
+    asyncio.run(run())
+
+
+def test_last_waiter_leaving_cancels_work():
+    async def run():
+        flight = SingleFlight()
+        cancelled = asyncio.Event()
+
+        async def work():
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        waiters = [asyncio.create_task(flight.wait('k', work)) for _ in range(3)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+        # A próxima chamada começa uma execução nova
+        assert await flight.wait('k', lambda: asyncio.sleep(0, 'novo')) == 'novo'
+
+    asyncio.run(run())
+
+
+def test_timed_out_waiter_keeps_work_running():
+    async def run():
+        flight = SingleFlight()
+        release = asyncio.Event()
+        done = asyncio.Event()
+
+        async def work():
+            await release.wait()
+            done.set()
+
+        with pytest.raises(asyncio.TimeoutError):
+            await flight.wait('k', work, timeout=0.01)
+
+        # Mesmo que o próximo a esperar seja cancelado, quem respondeu stale conta com a atualização
+        waiter = asyncio.create_task(flight.wait('k', work))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        release.set()
+        await asyncio.wait_for(done.wait(), 1)
+
+    asyncio.run(run())
+
+
+def test_shared_work_uses_server_deadline():
+    async def run():
+        flight = SingleFlight(budget=10)
+        seen = []
+
+        async def work():
+            seen.append(current_deadline())
+
+        async def endpoint(scope, receive, send):
+            await flight.wait('k', work)
+            await send({'type': 'http.response.start', 'status': 204, 'headers': []})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        app = DeadlineMiddleware(endpoint, default=10, maximum=30)
+        await call_and_disconnect(app, asgi_get(headers=[(b'x-timeout-ms', b'200')]), after=30)
+        deadline, = seen
+        assert not deadline.custom
+        assert deadline.remaining() > 5
+
+    asyncio.run(run())
+
+
+@pytest.mark.skipif(not os.getenv('TEST_DATABASE_URL'), reason="TEST_DATABASE_URL não definido")
+def test_disconnect_cancels_query_in_postgres():
+    from resilience import CircuitBreaker, ResilientPool
+
+    async def active_sleeps(conn):
+        cur = await conn.execute(
+            "SELECT count(*) FROM pg_stat_activity WHERE query LIKE 'SELECT pg_sleep%%' AND state = 'active'"
+        )
+        return (await cur.fetchone())[0]
+
+    async def run():
+        pool = ResilientPool(
+            os.environ['TEST_DATABASE_URL'], min_size=1, max_size=2, open=False,
+            breaker=CircuitBreaker(5, 30), kwargs={'autocommit': True},
+        )
+        await pool.open(wait=True)
+        cache = WatermarkCache(ttl=60, budget=10)
+
+        async def compute():
+            async with pool.connection() as conn:
+                await conn.execute("SELECT pg_sleep(30)")
+
+        async def endpoint(scope, receive, send):
+            await cache.get(('kpis', 'teste'), lambda: asyncio.sleep(0, 'wm'), compute)
+
+        try:
+            app = DeadlineMiddleware(endpoint, default=10, maximum=30)
+            started = time.monotonic()
+            await call_and_disconnect(app, asgi_get(), after=0.5)
+            async with pool.connection() as conn:
+                for _ in range(20):
+                    if await active_sleeps(conn) == 0:
+                        break
+                    await asyncio.sleep(0.1)
+                assert await active_sleeps(conn) == 0
+            assert time.monotonic() - started < 5
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
+
+
+def test_invalidate_during_refresh_keeps_entry_invalidated():
+    async def run():
+        cache = WatermarkCache(ttl=60)
+        release = asyncio.Event()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            if len(calls) == 1:
+                await release.wait()
+            return len(calls)
+
+        first = asyncio.create_task(cache.get('k', lambda: asyncio.sleep(0, 'wm'), compute))
+        await asyncio.sleep(0.01)
+        # Ex.: o rollup foi atualizado enquanto o valor antigo era calculado
+        cache.invalidate()
+        release.set()
+        assert await first == 1
+        assert await cache.get('k', lambda: asyncio.sleep(0, 'wm'), compute) == 2
+
+    asyncio.run(run())
@@ -0,0 +1,47 @@
+import os
+
+import psycopg
+import pytest
+
+from detailed import TIEBREAK_COL, build_detailed_query, encode_cursor
+
+CONFIG = {
+    'schema': 'pg_temp',
+    'tabela': 'detalhes',
+    'filtro_col': 'grupo',
+    'filtro_val': ['a'],
+    'date_col': 'ref_date',
+    'updated_col': 'updated_at',
+}
+
+
+def test_cursor_on_null_updated_col_has_explicit_branch():
+    query, params = build_detailed_query(CONFIG, [], after=encode_cursor('2024-05-01', None, '(0,3)'), limit=10)
+    assert params == ['a', '2024-05-01', '2024-05-01', '(0,3)', 10]
+    _, params = build_detailed_query(CONFIG, [], after=encode_cursor('2024-05-01', '2024-05-01T10:00:00', '(0,3)'))
+    assert params == ['a', '2024-05-01', '2024-05-01T10:00:00', '(0,3)']
+
+
+@pytest.mark.skipif(not os.getenv('TEST_DATABASE_URL'), reason="TEST_DATABASE_URL não definido")
+def test_keyset_pages_cover_rows_with_null_updated_col():
+    with psycopg.connect(os.environ['TEST_DATABASE_URL']) as conn:
+        conn.execute("CREATE TEMP TABLE detalhes (grupo text, ref_date date, updated_at timestamptz, n int)")
+        conn.execute("""
+            INSERT INTO detalhes
+            SELECT 'a', date '2024-05-01' - (i % 3), CASE WHEN i % 2 = 0 THEN NULL ELSE timestamptz '2024-05-01' + i * interval '1 min' END, i
+            FROM generate_series(1, 25) AS i
+        """)
+        seen, after = [], None
+        for _ in range(30):
+            query, params = build_detailed_query(CONFIG, [], after=after, limit=4)
+            cur = conn.execute(query, params)
+            names = [desc.name for desc in cur.description]
+            rows = cur.fetchall()
+            seen += [row[names.index('n')] for row in rows]
+            if len(rows) < 4:
+                break
+            last = rows[-1]
+            after = encode_cursor(
+                last[names.index('ref_date')], last[names.index('updated_at')], last[names.index(TIEBREAK_COL)]
+            )
+        assert sorted(seen) == list(range(1, 26))
@@ -0,0 +1,75 @@
+from datetime import date, timedelta
+
+import pytest
+
+from downsample import lttb, min_max
+from main import downsample_points
+
+
+def wave(n):
+    # Série com um pico e um vale bem marcados no meio
+    ys = [float(i % 7) for i in range(n)]
+    ys[n // 3] = 100.0
+    ys[2 * n // 3] = -100.0
+    return ys
+
+
+@pytest.mark.parametrize('threshold', [3, 4, 5, 10, 50])
+def test_lttb_respects_threshold_and_keeps_ends(threshold):
+    ys = wave(200)
+    indexes = lttb(list(range(200)), ys, threshold)
+    assert len(indexes) == threshold
+    assert indexes[0] == 0 and indexes[-1] == 199
+    assert indexes == sorted(set(indexes))
+
+
+def test_lttb_keeps_peaks():
+    ys = wave(200)
+    indexes = lttb(list(range(200)), ys, 20)
+    assert 200 // 3 in indexes
+    assert 2 * 200 // 3 in indexes
+
+
+def test_lttb_small_series_untouched():
+    assert lttb([0, 1, 2], [5, 6, 7], 10) == [0, 1, 2]
+
+
+@pytest.mark.parametrize('threshold', [3, 4, 5, 10, 51])
+def test_min_max_respects_threshold_and_keeps_ends(threshold):
+    ys = wave(200)
+    indexes = min_max(ys, threshold)
+    assert len(indexes) <= threshold
+    assert indexes[0] == 0 and indexes[-1] == 199
+    assert indexes == sorted(set(indexes))
+
+
+def test_min_max_keeps_peak_and_valley():
+    ys = wave(200)
+    indexes = min_max(ys, 10)
+    assert 200 // 3 in indexes
+    assert 2 * 200 // 3 in indexes
+
+
+def test_min_max_threshold_three_keeps_the_extreme():
+    ys = [0.0, 1.0, 50.0, 1.0, 0.0, 1.0]
+    assert min_max(ys, 3) == [0, 2, 5]
+
+
+def points(n):
+    start = date(2024, 1, 1)
+    return [{"x": (start + timedelta(days=i)).isoformat(), "y": y} for i, y in enumerate(wave(n))]
+
+
+@pytest.mark.parametrize('method', ['lttb', 'minmax'])
+@pytest.mark.parametrize('max_points', [3, 4, 30])
+def test_downsample_points_caps_the_series(method, max_points):
+    series = points(120)
+    reduced = downsample_points(series, max_points, method)
+    assert len(reduced) <= max_points
+    assert reduced[0] == series[0] and reduced[-1] == series[-1]
+    assert [p["x"] for p in reduced] == sorted(p["x"] for p in reduced)
+
+
+def test_downsample_points_short_series_untouched():
+    series = points(5)
+    assert downsample_points(series, 10, 'minmax') is series
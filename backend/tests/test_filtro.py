@@ -0,0 +1,23 @@
+import pytest
+from fastapi import HTTPException
+
+import main
+
+
+def test_filtro_is_normalized_for_the_cache_key():
+    assert main.parse_filtro('piperun', ['78291', '78157', '78291']) == ['78157', '78291']
+    assert main.parse_filtro('piperun', []) is None
+
+
+def test_filtro_outside_filtro_val_is_rejected():
+    with pytest.raises(HTTPException) as error:
+        main.parse_filtro('piperun', ['78157', '99999'])
+    assert error.value.status_code == 400
+    assert '99999' in error.value.detail
+
+
+def test_filtro_requires_filtro_col():
+    with pytest.raises(HTTPException) as error:
+        main.parse_filtro('conta_azul', ['x'])
+    assert error.value.status_code == 400
+    assert 'filtro_col' in error.value.detail
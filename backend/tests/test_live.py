@@ -0,0 +1,39 @@
+import json
+import os
+from datetime import date
+from decimal import Decimal
+
+import psycopg
+import pytest
+
+from live import NOTIFY_CHANNEL, build_notify_triggers_sql, format_sse
+
+
+def test_format_sse_encodes_like_rest_responses():
+    message = format_sse('kpis', {'system': 'piperun', 'valor': Decimal('1234.50'), 'qtd': Decimal('7'), 'data': date(2024, 5, 1)})
+    event, data, blank, end = message.split('\n')
+    assert event == 'event: kpis'
+    assert (blank, end) == ('', '')
+    payload = json.loads(data.removeprefix('data: '))
+    assert payload == {'system': 'piperun', 'valor': 1234.5, 'qtd': 7, 'data': '2024-05-01'}
+
+
+@pytest.mark.skipif(not os.getenv('TEST_DATABASE_URL'), reason="TEST_DATABASE_URL não definido")
+def test_notify_triggers_report_changed_table():
+    schema = 'kpi_test_live'
+    with psycopg.connect(os.environ['TEST_DATABASE_URL'], autocommit=True) as conn:
+        conn.execute(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        conn.execute(f"CREATE SCHEMA {schema}")
+        conn.execute(f"CREATE TABLE {schema}.origem (valor int)")
+        try:
+            for statement in build_notify_triggers_sql({'teste': {'schema': schema, 'tabela': 'Origem'}}):
+                conn.execute(statement)
+            payloads = []
+            conn.add_notify_handler(lambda notify: payloads.append(notify.payload))
+            conn.execute(f"LISTEN {NOTIFY_CHANNEL}")
+            # Trigger por statement: um único aviso para a carga inteira, com o nome real da tabela
+            conn.execute(f"INSERT INTO {schema}.origem VALUES (1), (2)")
+            conn.execute("SELECT 1")
+            assert payloads == ['origem']
+        finally:
+            conn.execute(f"DROP SCHEMA {schema} CASCADE")
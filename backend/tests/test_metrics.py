@@ -0,0 +1,18 @@
+from metrics import RequestTimings, render_metrics, set_known_systems
+
+
+def test_unknown_system_label_is_bucketed():
+    set_known_systems(['piperun', 'n8n'])
+
+    def labels(path_params):
+        return RequestTimings({'endpoint': test_unknown_system_label_is_bucketed, 'path_params': path_params}).labels
+
+    assert labels({'system': 'piperun'})['system'] == 'piperun'
+    assert labels({'system': 'qualquer-coisa-123'})['system'] == 'other'
+    assert labels({})['system'] == ''
+
+
+def test_render_metrics_without_pool():
+    text = render_metrics(None)
+    assert 'kpi_api_request_duration_seconds' in text
+    assert 'kpi_api_pool_size' not in text
@@ -0,0 +1,153 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+import psycopg
+import pytest
+
+from queries import QueryRegistry
+from rollups import RollupManager, RollupRefresher
+
+SCHEMA = 'kpi_test_rollups'
+
+SISTEMAS = {
+    'teste': {
+        'schema': SCHEMA,
+        'tabela': 'origem',
+        'filtro_col': '',
+        'filtro_val': '',
+        'date_col': 'ref_date',
+        'updated_col': 'updated_at',
+        'kpi_cols': ['valor'],
+        'chart_col': 'valor',
+        'kpi_query_type': 'single_row',
+        'series_aggregation': 'SUM',
+    },
+}
+
+pytestmark = pytest.mark.skipif(not os.getenv('TEST_DATABASE_URL'), reason="TEST_DATABASE_URL não definido")
+
+
+def test_refresher_catches_late_commits_in_the_overlap_window():
+    dsn = os.environ['TEST_DATABASE_URL']
+
+    @asynccontextmanager
+    async def connection():
+        async with await psycopg.AsyncConnection.connect(dsn, autocommit=True) as conn:
+            yield conn
+
+    async def days(conn):
+        cur = await conn.execute(
+            f"SELECT ref_date::text, sum_value FROM {SCHEMA}.kpi_rollup_daily WHERE metric = 'valor' ORDER BY 1"
+        )
+        return {day: int(value) for day, value in await cur.fetchall()}
+
+    async def run():
+        async with connection() as conn:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+            await conn.execute(f"CREATE TABLE {SCHEMA}.origem (ref_date date, updated_at timestamptz, valor int)")
+            await conn.execute(f"""
+                INSERT INTO {SCHEMA}.origem VALUES
+                    ('2024-05-01', '2024-05-01 10:00+00', 1),
+                    ('2024-05-02', '2024-05-02 10:00+00', 2)
+            """)
+            registry = QueryRegistry(SISTEMAS)
+            rollups = RollupManager(SISTEMAS, registry, SCHEMA, overlap=3600)
+            await registry.validate(conn)
+            await rollups.install(conn)
+
+            refreshed = []
+
+            async def on_refresh(systems):
+                refreshed.append(systems)
+
+            refresher = RollupRefresher(rollups, ['teste'], connection, 60, on_refresh)
+            assert await refresher.refresh() == ['teste']
+            assert await days(conn) == {'2024-05-01': 1, '2024-05-02': 2}
+            assert await refresher.refresh() == []
+
+            # Transação que gravou updated_at antes do último refresh, mas fez commit depois
+            await conn.execute(f"INSERT INTO {SCHEMA}.origem VALUES ('2024-04-30', '2024-05-02 09:30+00', 5)")
+            assert await refresher.refresh() == []
+            refresher._recheck['teste'] = 0
+            assert await refresher.refresh() == ['teste']
+            assert await days(conn) == {'2024-04-30': 5, '2024-05-01': 1, '2024-05-02': 2}
+
+            # Refresh feito por outro worker também é avisado
+            other = RollupRefresher(rollups, ['teste'], connection, 60, on_refresh)
+            await conn.execute(f"INSERT INTO {SCHEMA}.origem VALUES ('2024-05-03', '2024-05-03 10:00+00', 7)")
+            assert await other.refresh() == ['teste']
+            assert await refresher.refresh() == ['teste']
+
+            await conn.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+
+    asyncio.run(run())
+
+
+def test_watermark_changes_when_rollup_catches_up():
+    dsn = os.environ['TEST_DATABASE_URL']
+
+    async def run():
+        async with await psycopg.AsyncConnection.connect(dsn, autocommit=True) as conn:
+            await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            await conn.execute(f"CREATE SCHEMA {SCHEMA}")
+            await conn.execute(f"CREATE TABLE {SCHEMA}.origem (ref_date date, updated_at timestamptz, valor int)")
+            await conn.execute(f"INSERT INTO {SCHEMA}.origem VALUES ('2024-05-01', '2024-05-01 10:00+00', 1)")
+            registry = QueryRegistry(SISTEMAS)
+            rollups = RollupManager(SISTEMAS, registry, SCHEMA)
+            await registry.validate(conn)
+            await rollups.install(conn)
+            watermark = rollups.watermark_query('teste', registry.get('teste').watermark)
+
+            async def current():
+                cur = await conn.execute(watermark.query, watermark.params)
+                return tuple(await cur.fetchone())
+
+            await rollups.refresh(conn, 'teste')
+            refreshed = await current()
+
+            # A origem mudou, mas o rollup ainda não: o que for lido agora sai com este watermark
+            await conn.execute(f"INSERT INTO {SCHEMA}.origem VALUES ('2024-05-02', '2024-05-02 10:00+00', 2)")
+            behind = await current()
+            assert behind[0] != refreshed[0] and behind[1] == refreshed[1]
+
+            # Quando o refresh alcança a origem o watermark muda de novo (novo ETag, cache recalculado)
+            await rollups.refresh(conn, 'teste')
+            caught_up = await current()
+            assert caught_up[0] == behind[0] and caught_up[1] != behind[1]
+
+            await conn.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+
+    asyncio.run(run())
+
+
+def test_refresh_uses_its_own_statement_timeout():
+    dsn = os.environ['TEST_DATABASE_URL']
+
+    async def run():
+        async with await psycopg.AsyncConnection.connect(dsn, autocommit=True) as setup:
+            await setup.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+            await setup.execute(f"CREATE SCHEMA {SCHEMA}")
+            await setup.execute(f"CREATE TABLE {SCHEMA}.base (ref_date date, updated_at timestamptz, valor int)")
+            await setup.execute(f"INSERT INTO {SCHEMA}.base VALUES ('2024-05-01', '2024-05-01 10:00+00', 1)")
+            # Origem lenta: cada leitura leva mais que o statement_timeout das requisições
+            await setup.execute(f"CREATE VIEW {SCHEMA}.origem AS SELECT base.* FROM {SCHEMA}.base, pg_sleep(0.2)")
+
+            # Conexão como as do pool, com statement_timeout curto na sessão
+            async with await psycopg.AsyncConnection.connect(
+                dsn, autocommit=True, options='-c statement_timeout=100'
+            ) as conn:
+                registry = QueryRegistry(SISTEMAS)
+                await registry.validate(conn)
+                await RollupManager(SISTEMAS, registry, SCHEMA).install(conn)
+
+                with pytest.raises(psycopg.errors.QueryCanceled):
+                    await RollupManager(SISTEMAS, registry, SCHEMA).refresh(conn, 'teste')
+                assert await RollupManager(SISTEMAS, registry, SCHEMA, statement_timeout_ms=5000).refresh(conn, 'teste') == 1
+                cur = await conn.execute("SHOW statement_timeout")
+                assert (await cur.fetchone())[0] == '100ms'
+
+            await setup.execute(f"DROP SCHEMA {SCHEMA} CASCADE")
+
+    asyncio.run(run())
@@ -0,0 +1,46 @@
+import asyncio
+from datetime import datetime
+
+from snapshots import SnapshotStore
+
+
+def test_publish_get_and_lease(tmp_path):
+    async def run():
+        path = str(tmp_path / 'snapshots.db')
+        store, other = SnapshotStore(path), SnapshotStore(path)
+        await store.open()
+        await other.open()
+        try:
+            assert await other.get('dashboard') is None
+            watermark = datetime(2024, 5, 1, 12, 30)
+            await store.publish({'dashboard': (b'{"systems":{}}', watermark)})
+            snapshot = await other.get('dashboard')
+            assert snapshot.body == b'{"systems":{}}'
+            assert snapshot.watermark == watermark
+
+            await store.discard(['dashboard'])
+            assert await other.get('dashboard') is None
+
+            assert await store.try_lead('a', 30)
+            assert not await other.try_lead('b', 30)
+            await store.resign('a')
+            assert await other.try_lead('b', 30)
+        finally:
+            await store.close()
+            await other.close()
+
+    asyncio.run(run())
+
+
+def test_composite_watermark_round_trip(tmp_path):
+    async def run():
+        store = SnapshotStore(str(tmp_path / 'snapshots.db'))
+        await store.open()
+        try:
+            watermark = (datetime(2024, 5, 1, 12, 30), None)
+            await store.publish({'series:teste': (b'{}', watermark)})
+            assert (await store.get('series:teste')).watermark == watermark
+        finally:
+            await store.close()
+
+    asyncio.run(run())
@@ -0,0 +1,71 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+import pytest
+
+import main
+
+
+class FakeConnection:
+    """Conexão que só registra as queries preparadas (ou falha com `error`)"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.prepared = []
+
+    @asynccontextmanager
+    async def pipeline(self):
+        yield
+
+    async def execute(self, query, params=None, prepare=False):
+        if self.error:
+            raise self.error
+        self.prepared.append(query)
+
+
+@pytest.fixture
+def invalid_system(monkeypatch):
+    """Como após uma validação em que o evolution falhou (ex.: coluna inexistente)"""
+    monkeypatch.setitem(main.registry.errors, 'evolution', ["Coluna update_at não encontrada"])
+    monkeypatch.setattr(main.startup, 'validated', 0.0)
+    return 'evolution'
+
+
+def test_warmup_skips_invalid_systems(invalid_system):
+    statements = main.warmup_statements()
+    assert statements
+    assert main.registry._queries[invalid_system].kpi not in statements
+
+
+def test_configure_connection_prepares_valid_systems(invalid_system):
+    conn = FakeConnection()
+    asyncio.run(main.configure_connection(conn))
+    assert len(conn.prepared) == len(main.warmup_statements())
+
+
+def test_configure_connection_never_raises(invalid_system):
+    asyncio.run(main.configure_connection(FakeConnection(RuntimeError("falha inesperada"))))
+
+
+@pytest.mark.skipif(not os.getenv('TEST_DATABASE_URL'), reason="TEST_DATABASE_URL não definido")
+def test_pool_refills_with_invalid_system(invalid_system):
+    from resilience import CircuitBreaker, ResilientPool
+
+    async def run():
+        pool = ResilientPool(
+            os.environ['TEST_DATABASE_URL'], min_size=1, max_size=2, open=False, timeout=5,
+            breaker=CircuitBreaker(5, 30), configure=main.configure_connection, kwargs={'autocommit': True},
+        )
+        await pool.open(wait=True, timeout=5)
+        try:
+            # Como no warm_up: as conexões são trocadas por outras passando pelo configure
+            await pool.drain()
+            await pool.wait(timeout=5)
+            async with pool.connection() as conn:
+                cur = await conn.execute("SELECT 1")
+                assert (await cur.fetchone())[0] == 1
+        finally:
+            await pool.close()
+
+    asyncio.run(run())
@@ -1,9 +1,11 @@
 import { useEffect, useMemo, useState } from "react";
 import { motion } from "framer-motion";
+import { useQueryClient } from "@tanstack/react-query";
 import StatusBar from "./components/StatusBar";
 import KpiCard from "./components/KpiCard";
 import { SYSTEM_ORDER, SYSTEMS } from "./lib/systems";
-import type { SystemKey } from "./types";
+import { subscribeDashboard } from "./lib/api";
+import type { DashboardResponse, SystemKey } from "./types";
 
 // Logo da empresa
 const Logo = "https://s3.automacoesbeo.xyz/logos-empresas/Grupo_B%26O_CINZA.png";
@@ -26,6 +28,17 @@ function App() {
     return () => clearInterval(id);
   }, [autoRefresh]);
 
+  const queryClient = useQueryClient();
+
+  // Aplica no cache do dashboard as atualizações enviadas pelo backend em tempo real
+  useEffect(() => {
+    return subscribeDashboard((system, result) => {
+      queryClient.setQueryData<DashboardResponse>(["dashboard"], (old) =>
+        old ? { systems: { ...old.systems, [system]: result } } : old
+      );
+    });
+  }, [queryClient]);
+
   // Lista dos sistemas definidos
   const systems = SYSTEM_ORDER;
   // Calcula o número total de páginas do carrossel
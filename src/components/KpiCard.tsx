@@ -1,7 +1,7 @@
 import { motion } from 'framer-motion'
 import { useQuery } from '@tanstack/react-query'
 import { Bar, BarChart, ResponsiveContainer, Tooltip, XAxis } from 'recharts'
-import { fetchKpis, fetchSeries } from '../lib/api'
+import { fetchDashboard } from '../lib/api'
 import { fmtNum, fmtMoney } from '../lib/format'
 import type { SystemKey, ChartType } from '../types'
 
@@ -48,20 +48,19 @@ export default function KpiCard({
   moneyIndexes = [],
   autoRefreshMs,
 }: KpiCardProps) {
-  const kpisQ = useQuery({
-    queryKey: ['kpis', system],
-    queryFn: () => fetchKpis(system),
+  // Todos os cards compartilham a mesma query, então a tela inteira faz uma só requisição
+  const dashboardQ = useQuery({
+    queryKey: ['dashboard'],
+    queryFn: fetchDashboard,
     refetchInterval: autoRefreshMs || false,
+    select: (data) => data.systems[system],
   })
 
-  const seriesQ = useQuery({
-    queryKey: ['series', system],
-    queryFn: () => fetchSeries(system),
-    refetchInterval: autoRefreshMs || false,
-  })
-
-  const k = kpisQ.data?.values || []
-  const points = seriesQ.data?.points || []
+  const result = dashboardQ.data
+  const k = result && 'kpis' in result ? result.kpis.values : []
+  const points = result && 'series' in result ? result.series.points : []
+  // Dados antigos servidos pelo backend durante uma falha do banco
+  const staleAge = result && 'kpis' in result && result.stale ? result.age ?? 0 : null
 
   return (
     <motion.div
@@ -82,6 +81,11 @@ export default function KpiCard({
         transition={{ duration: 0.5, delay: 0.1 }}
       >
         {title}
+        {staleAge !== null && (
+          <span className="ml-2 text-xs text-text2" title="O banco não respondeu; exibindo os últimos dados recebidos">
+            (há {Math.max(1, Math.round(staleAge / 60))} min)
+          </span>
+        )}
       </motion.div>
       
       <motion.div
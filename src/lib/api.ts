@@ -1,5 +1,6 @@
 import axios from 'axios'
-import type { KpisResponse, SeriesResponse, SystemKey } from '../types'
+import type { AggregateParams, AggregateResponse, DashboardResponse, DashboardSystemResult, GroupedKpisResponse, GroupedSeriesResponse, KpisResponse, MonthlyReportResponse, SeriesResponse, SystemKey } from '../types'
+import { SYSTEM_ORDER } from './systems'
 
 const apiBaseUrl = import.meta.env.VITE_API_BASE_URL
 
@@ -39,12 +40,9 @@ export async function fetchKpis(system: SystemKey): Promise<KpisResponse> {
     return generateMockKpis(system)
   }
   
-  try {
-    const response = await api.get(`/api/kpis/${system}`)
-    return response.data
-  } catch {
-    return generateMockKpis(system)
-  }
+  // Em caso de erro a query mantém os últimos dados reais em vez de mostrar zeros
+  const response = await api.get(`/api/kpis/${system}`)
+  return response.data
 }
 
 export async function fetchSeries(system: SystemKey): Promise<SeriesResponse> {
@@ -52,12 +50,59 @@ export async function fetchSeries(system: SystemKey): Promise<SeriesResponse> {
     return generateMockSeries(system)
   }
   
-  try {
-    const response = await api.get(`/api/series/${system}`)
-    return response.data
-  } catch {
-    return generateMockSeries(system)
+  const response = await api.get(`/api/series/${system}`)
+  return response.data
+}
+
+// KPIs e séries de vários valores do filtro do sistema (pipelines, workspaces...) em uma requisição
+export async function fetchGroupedKpis(system: SystemKey, values: string[]): Promise<GroupedKpisResponse> {
+  const search = new URLSearchParams()
+  values.forEach(value => search.append('filtro', value))
+  const response = await api.get(`/api/kpis/${system}`, { params: search })
+  return response.data
+}
+
+export async function fetchGroupedSeries(system: SystemKey, values: string[]): Promise<GroupedSeriesResponse> {
+  const search = new URLSearchParams()
+  values.forEach(value => search.append('filtro', value))
+  const response = await api.get(`/api/series/${system}`, { params: search })
+  return response.data
+}
+
+function generateMockDashboard(): DashboardResponse {
+  const systems: DashboardResponse['systems'] = {}
+  for (const system of SYSTEM_ORDER) {
+    systems[system] = { kpis: generateMockKpis(system), series: generateMockSeries(system) }
+  }
+  return { systems }
+}
+
+// Busca KPIs e séries de todos os sistemas em uma única requisição
+export async function fetchDashboard(): Promise<DashboardResponse> {
+  if (!apiBaseUrl) {
+    return generateMockDashboard()
+  }
+  
+  // Sem fallback para mocks: com erro o react-query mantém o último dashboard recebido,
+  // e o backend já responde com valores stale quando o banco está lento ou fora do ar
+  const response = await api.get('/api/dashboard')
+  return response.data
+}
+
+// Recebe do backend (Server-Sent Events) os sistemas que mudaram, sem precisar de polling
+export function subscribeDashboard(
+  onUpdate: (system: SystemKey, result: DashboardSystemResult) => void
+): () => void {
+  if (!apiBaseUrl) {
+    return () => {}
   }
+  
+  const source = new EventSource(`${apiBaseUrl}/api/stream`)
+  source.addEventListener('update', (event) => {
+    const { system, ...result } = JSON.parse((event as MessageEvent).data)
+    onUpdate(system, result)
+  })
+  return () => source.close()
 }
 
 export async function fetchDetailedData(system: string) {
@@ -87,3 +132,40 @@ export async function fetchPiperunAllPipelines() {
     throw new Error('Failed to fetch PipeRun all pipelines data')
   }
 }
+
+// Relatório mensal consolidado: meses disponíveis, totais diários e comparações já calculados no backend
+export async function fetchMonthlyReport(month?: string): Promise<MonthlyReportResponse> {
+  if (!apiBaseUrl) {
+    throw new Error('API Base URL not configured')
+  }
+  
+  const response = await api.get('/api/report/monthly', { params: month ? { month } : undefined })
+  return response.data
+}
+
+// Agregações (GROUP BY), filtros e facetas calculados no backend
+export async function fetchAggregate(system: string, params: AggregateParams): Promise<AggregateResponse> {
+  if (!apiBaseUrl) {
+    throw new Error('API Base URL not configured')
+  }
+  
+  const search = new URLSearchParams()
+  params.groupBy?.forEach(col => search.append('group_by', col))
+  params.metrics.forEach(metric => search.append('metrics', metric))
+  params.facets?.forEach(col => search.append('facets', col))
+  Object.entries(params.filters ?? {}).forEach(([col, value]) => {
+    ;(Array.isArray(value) ? value : [value]).forEach(v => search.append('filter', `${col}:${v}`))
+  })
+  if (params.dateFrom) search.set('date_from', params.dateFrom)
+  if (params.dateTo) search.set('date_to', params.dateTo)
+  if (params.orderBy) search.set('order_by', params.orderBy)
+  if (params.limit) search.set('limit', String(params.limit))
+  
+  try {
+    const response = await api.get(`/api/aggregate/${system}`, { params: search })
+    return response.data
+  } catch (error) {
+    console.error('Error fetching aggregate data:', error)
+    throw new Error('Failed to fetch aggregate data')
+  }
+}
@@ -1,5 +1,5 @@
 import { useEffect, useMemo, useState } from 'react'
-import { useQuery } from '@tanstack/react-query'
+import { keepPreviousData, useQuery } from '@tanstack/react-query'
 import { motion } from 'framer-motion'
 import { Link } from 'react-router-dom'
 import {
@@ -13,63 +13,21 @@ import {
   XAxis,
   YAxis
 } from 'recharts'
-import { fetchDetailedData, fetchPiperunAllPipelines } from '../lib/api'
+import { fetchMonthlyReport } from '../lib/api'
 import { fmtMoney, fmtNum } from '../lib/format'
 import { SYSTEMS } from '../lib/systems'
+import type { ReportDailyValue, ReportMetric, ReportSystem } from '../types'
 
-type NumericLike = number | string | null | undefined
-
-interface MetaAdsRecord {
-  ref_date: string
-  leads: number
-}
-
-interface GoogleAdsRecord {
-  ref_date: string
-  leads: number
-}
-
-interface ContaAzulRaw {
-  ref_date: string
-  recebiveisHojeValor: NumericLike
-  entradaValor: NumericLike
-  recebiveis7DiasValor: NumericLike
-  pagaveis7DiasValor: NumericLike
-  inadimplentesValor: NumericLike
-  inadimplentesQuant: NumericLike
-  updated_at?: string
-}
-
-interface ContaAzulRecord {
-  ref_date: string
-  recebiveisHojeValor: number
-  entradaValor: number
-  recebiveis7DiasValor: number
-  pagaveis7DiasValor: number
-  inadimplentesValor: number
-  inadimplentesQuant: number
-  updated_at: string
-}
-
-interface PiperunRecord {
-  ref_date: string
-  pipeline_name: string
-  oportunidades_recebidas: number
-  oportunidades_ganhas: number
-  updated_at?: string
-}
-
-type DailyValue = { date: string; value: number }
 type ContaDailyPoint = { date: string; receber: number; recebido: number }
 type PipelineDailyPoint = { date: string; recebidas: number; ganhas: number }
 
 type DailyStats = {
   total: number
   average: number
-  last: DailyValue | null
-  previous: DailyValue | null
-  best: DailyValue | null
-  worst: DailyValue | null
+  last: ReportDailyValue | null
+  previous: ReportDailyValue | null
+  best: ReportDailyValue | null
+  worst: ReportDailyValue | null
 }
 
 const MONTH_LABELS = [
@@ -87,46 +45,46 @@ const MONTH_LABELS = [
   'Dezembro'
 ]
 
-const TARGET_PIPELINE = '00. PRE-RECEPTIVO BRANCO'
-const TARGET_PIPELINE_KEY = normalizeText(TARGET_PIPELINE)
-
-function normalizeText(value: string): string {
-  return value
-    .normalize('NFD')
-    .replace(/[\u0300-\u036f]/g, '')
-    .toLowerCase()
-    .trim()
-}
-
-function toNumber(value: NumericLike): number {
-  if (value === null || value === undefined) return 0
-  if (typeof value === 'number') return Number.isFinite(value) ? value : 0
-  if (typeof value === 'string') {
-    const parsed = Number(value.replace(/\s/g, '').replace(',', '.'))
-    return Number.isFinite(parsed) ? parsed : 0
-  }
-  return 0
-}
+const EMPTY_STATS: DailyStats = { total: 0, average: 0, last: null, previous: null, best: null, worst: null }
 
-function normalizeContaAzul(record: ContaAzulRaw): ContaAzulRecord {
+// Totais, melhor/pior dia e comparações já vêm calculados pelo backend
+function toStats(metric: ReportMetric | undefined): DailyStats {
+  if (!metric) return EMPTY_STATS
   return {
-    ref_date: record.ref_date,
-    recebiveisHojeValor: toNumber(record.recebiveisHojeValor),
-    entradaValor: toNumber(record.entradaValor),
-    recebiveis7DiasValor: toNumber(record.recebiveis7DiasValor),
-    pagaveis7DiasValor: toNumber(record.pagaveis7DiasValor),
-    inadimplentesValor: toNumber(record.inadimplentesValor),
-    inadimplentesQuant: toNumber(record.inadimplentesQuant),
-    updated_at: record.updated_at ?? ''
+    total: metric.total,
+    average: metric.average,
+    last: metric.last,
+    previous: metric.previousDay,
+    best: metric.best,
+    worst: metric.worst
   }
 }
 
-function getMonthKey(date: string | undefined): string | null {
-  if (!date) return null
-  const iso = date.includes('T') ? date.split('T')[0] : date
-  const [year, month] = iso.split('-')
-  if (!year || !month) return null
-  return `${year}-${month}`
+// Junta as séries diárias de duas métricas do mesmo sistema em pontos únicos para o gráfico
+function mergeDaily<A extends string, B extends string>(
+  first: ReportMetric | undefined,
+  second: ReportMetric | undefined,
+  firstKey: A,
+  secondKey: B
+): Array<{ date: string } & Record<A | B, number>> {
+  const map = new Map<string, Record<A | B, number>>()
+  const entry = (date: string) => {
+    let current = map.get(date)
+    if (!current) {
+      current = { [firstKey]: 0, [secondKey]: 0 } as Record<A | B, number>
+      map.set(date, current)
+    }
+    return current
+  }
+  first?.daily.forEach(point => {
+    entry(point.date)[firstKey] = point.value
+  })
+  second?.daily.forEach(point => {
+    entry(point.date)[secondKey] = point.value
+  })
+  return Array.from(map.entries())
+    .sort((a, b) => a[0].localeCompare(b[0]))
+    .map(([date, values]) => ({ date, ...values }))
 }
 
 function formatMonthLabel(monthKey: string): string {
@@ -143,51 +101,6 @@ function formatDateLabel(value: string): string {
   return date.toLocaleDateString('pt-BR', { day: '2-digit', month: '2-digit' })
 }
 
-function buildDailySeries<T>(
-  records: T[],
-  valueFn: (record: T) => number,
-  dateFn: (record: T) => string
-): DailyValue[] {
-  const map = new Map<string, number>()
-  records.forEach(record => {
-    const date = dateFn(record)
-    if (!date) return
-    const key = date.includes('T') ? date.split('T')[0] : date
-    const current = map.get(key) ?? 0
-    map.set(key, current + valueFn(record))
-  })
-  return Array.from(map.entries())
-    .sort((a, b) => new Date(a[0]).getTime() - new Date(b[0]).getTime())
-    .map(([date, value]) => ({ date, value }))
-}
-
-function computeDailyStats(series: DailyValue[]): DailyStats {
-  if (!series.length) {
-    return { total: 0, average: 0, last: null, previous: null, best: null, worst: null }
-  }
-
-  const total = series.reduce((acc, point) => acc + point.value, 0)
-  const average = total / series.length
-  const previous = series.length > 1 ? series[series.length - 2] : null
-  const best = series.reduce(
-    (acc: DailyValue | null, point) => (acc === null || point.value > acc.value ? point : acc),
-    null
-  )
-  const worst = series.reduce(
-    (acc: DailyValue | null, point) => (acc === null || point.value < acc.value ? point : acc),
-    null
-  )
-
-  return {
-    total,
-    average,
-    last: series[series.length - 1] ?? null,
-    previous,
-    best,
-    worst
-  }
-}
-
 function formatDecimal(value: number, digits = 1): string {
   if (!Number.isFinite(value)) return '--'
   return value.toLocaleString('pt-BR', {
@@ -202,11 +115,6 @@ function formatPercentage(value: number): string {
   return `${sign}${value.toFixed(1)}%`
 }
 
-function computeDeltaPercent(current: number | null | undefined, base: number | null | undefined) {
-  if (current == null || base == null || base === 0) return null
-  return ((current - base) / base) * 100
-}
-
 function MetricTile({ label, value }: { label: string; value: string }) {
   return (
     <motion.div
@@ -221,201 +129,65 @@ function MetricTile({ label, value }: { label: string; value: string }) {
 }
 
 export default function RelatorioGeral() {
-  const metaAdsQuery = useQuery({
-    queryKey: ['relatorio-geral', 'meta-ads'],
-    queryFn: () => fetchDetailedData('meta_ads'),
-    refetchInterval: 3 * 60 * 1000
-  })
-
-  const googleAdsQuery = useQuery({
-    queryKey: ['relatorio-geral', 'google-ads'],
-    queryFn: () => fetchDetailedData('google_ads'),
-    refetchInterval: 3 * 60 * 1000
-  })
-
-  const contaAzulQuery = useQuery({
-    queryKey: ['relatorio-geral', 'conta-azul'],
-    queryFn: () => fetchDetailedData('conta_azul'),
-    refetchInterval: 3 * 60 * 1000
-  })
+  const [selectedMonth, setSelectedMonth] = useState<string>('')
 
-  const piperunQuery = useQuery({
-    queryKey: ['relatorio-geral', 'piperun'],
-    queryFn: () => fetchPiperunAllPipelines(),
-    refetchInterval: 3 * 60 * 1000
+  // Uma única requisição por mês: o backend devolve os meses disponíveis, os pontos
+  // diários e os totais/comparações de cada sistema, com cache por watermark
+  const reportQuery = useQuery({
+    queryKey: ['relatorio-geral', selectedMonth],
+    queryFn: () => fetchMonthlyReport(selectedMonth || undefined),
+    refetchInterval: 3 * 60 * 1000,
+    placeholderData: keepPreviousData
   })
+  const report = reportQuery.data
 
-  const metaRecords = useMemo<MetaAdsRecord[]>(() => {
-    if (!Array.isArray(metaAdsQuery.data)) return []
-    return (metaAdsQuery.data as MetaAdsRecord[]).filter(item => !!item?.ref_date)
-  }, [metaAdsQuery.data])
-
-  const googleRecords = useMemo<GoogleAdsRecord[]>(() => {
-    if (!Array.isArray(googleAdsQuery.data)) return []
-    return (googleAdsQuery.data as GoogleAdsRecord[]).filter(item => !!item?.ref_date)
-  }, [googleAdsQuery.data])
-
-  const contaRecords = useMemo<ContaAzulRecord[]>(() => {
-    if (!Array.isArray(contaAzulQuery.data)) return []
-    return (contaAzulQuery.data as ContaAzulRaw[])
-      .filter(item => !!item?.ref_date)
-      .map(normalizeContaAzul)
-  }, [contaAzulQuery.data])
-
-  const piperunRecords = useMemo<PiperunRecord[]>(() => {
-    if (!Array.isArray(piperunQuery.data)) return []
-    return (piperunQuery.data as PiperunRecord[]).filter(item => !!item?.ref_date)
-  }, [piperunQuery.data])
-
-  const monthOptions = useMemo(() => {
-    const months = new Set<string>()
-    ;[metaRecords, googleRecords, contaRecords, piperunRecords].forEach(list => {
-      list.forEach(item => {
-        const month = getMonthKey((item as any).ref_date)
-        if (month) months.add(month)
-      })
-    })
-    return Array.from(months).sort((a, b) => b.localeCompare(a))
-  }, [metaRecords, googleRecords, contaRecords, piperunRecords])
-
-  const [selectedMonth, setSelectedMonth] = useState<string>('')
+  const monthOptions = report?.months ?? []
 
   useEffect(() => {
-    if (!selectedMonth && monthOptions.length) {
-      setSelectedMonth(monthOptions[0])
-    } else if (selectedMonth && !monthOptions.includes(selectedMonth)) {
-      setSelectedMonth(monthOptions[0] ?? '')
-    }
-  }, [monthOptions, selectedMonth])
-
-  const filterByMonth = <T extends { ref_date: string }>(records: T[]) => {
-    if (!selectedMonth) return []
-    return records.filter(record => record.ref_date?.startsWith(selectedMonth))
-  }
-
-  const metaMonthly = useMemo(() => filterByMonth(metaRecords), [metaRecords, selectedMonth])
-  const googleMonthly = useMemo(() => filterByMonth(googleRecords), [googleRecords, selectedMonth])
-  const contaMonthly = useMemo(() => filterByMonth(contaRecords), [contaRecords, selectedMonth])
-  const piperunMonthly = useMemo(() => filterByMonth(piperunRecords), [piperunRecords, selectedMonth])
-
-  const metaDaily = useMemo(
-    () => buildDailySeries(metaMonthly, record => record.leads ?? 0, record => record.ref_date),
-    [metaMonthly]
-  )
-  const googleDaily = useMemo(
-    () => buildDailySeries(googleMonthly, record => record.leads ?? 0, record => record.ref_date),
-    [googleMonthly]
-  )
-
-  const contaDaily = useMemo<ContaDailyPoint[]>(() => {
-    const map = new Map<string, { receber: number; recebido: number }>()
-    contaMonthly.forEach(record => {
-      const key = record.ref_date.includes('T') ? record.ref_date.split('T')[0] : record.ref_date
-      const current = map.get(key) ?? { receber: 0, recebido: 0 }
-      current.receber = record.recebiveisHojeValor
-      current.recebido += record.entradaValor
-      map.set(key, current)
-    })
-    return Array.from(map.entries())
-      .sort((a, b) => new Date(a[0]).getTime() - new Date(b[0]).getTime())
-      .map(([date, values]) => ({ date, receber: values.receber, recebido: values.recebido }))
-  }, [contaMonthly])
-
-  const contaRecebidoStats = useMemo(
-    () => computeDailyStats(contaDaily.map(point => ({ date: point.date, value: point.recebido }))),
-    [contaDaily]
-  )
-  const contaReceberStats = useMemo(
-    () => computeDailyStats(contaDaily.map(point => ({ date: point.date, value: point.receber }))),
-    [contaDaily]
-  )
-
-  const contaLatest = useMemo(() => {
-    if (!contaMonthly.length) return null
-    const toTimestamp = (value: string | undefined) => {
-      if (!value) return Number.NEGATIVE_INFINITY
-      const normalized = value.includes('T') ? value : `${value}T00:00:00`
-      const ts = new Date(normalized).getTime()
-      return Number.isFinite(ts) ? ts : Number.NEGATIVE_INFINITY
+    if (!selectedMonth && report?.month) {
+      setSelectedMonth(report.month)
     }
-
-    return contaMonthly.reduce<ContaAzulRecord | null>((latest, record) => {
-      if (!latest) return record
-      const currentDate = toTimestamp(record.ref_date)
-      const latestDate = toTimestamp(latest.ref_date)
-
-      if (currentDate > latestDate) return record
-      if (currentDate < latestDate) return latest
-
-      const currentUpdated = toTimestamp(record.updated_at)
-      const latestUpdated = toTimestamp(latest.updated_at)
-      if (currentUpdated > latestUpdated) return record
-      return latest
-    }, null)
-  }, [contaMonthly])
-
-  const targetPipelineRecords = useMemo(() => {
-    return piperunMonthly.filter(record => normalizeText(record.pipeline_name) === TARGET_PIPELINE_KEY)
-  }, [piperunMonthly])
-
-  const pipelineDaily = useMemo<PipelineDailyPoint[]>(() => {
-    const map = new Map<string, { recebidas: number; ganhas: number }>()
-    targetPipelineRecords.forEach(record => {
-      const key = record.ref_date.includes('T') ? record.ref_date.split('T')[0] : record.ref_date
-      const current = map.get(key) ?? { recebidas: 0, ganhas: 0 }
-      current.recebidas += record.oportunidades_recebidas ?? 0
-      current.ganhas += record.oportunidades_ganhas ?? 0
-      map.set(key, current)
-    })
-    return Array.from(map.entries())
-      .sort((a, b) => new Date(a[0]).getTime() - new Date(b[0]).getTime())
-      .map(([date, values]) => ({ date, recebidas: values.recebidas, ganhas: values.ganhas }))
-  }, [targetPipelineRecords])
-
-  const pipelineRecebidasStats = useMemo(
-    () => computeDailyStats(pipelineDaily.map(point => ({ date: point.date, value: point.recebidas }))),
-    [pipelineDaily]
+  }, [report?.month, selectedMonth])
+
+  const metrics: Record<string, ReportSystem> = report?.systems ?? {}
+  const metaLeads = metrics.meta_ads?.metrics.leads
+  const googleLeads = metrics.google_ads?.metrics.leads
+  const contaRecebido = metrics.conta_azul?.metrics.recebido
+  const contaReceber = metrics.conta_azul?.metrics.receber
+  const pipelineRecebidas = metrics.piperun?.metrics.recebidas
+  const pipelineGanhas = metrics.piperun?.metrics.ganhas
+
+  const metaDaily = metaLeads?.daily ?? []
+  const googleDaily = googleLeads?.daily ?? []
+  const contaDaily = useMemo<ContaDailyPoint[]>(
+    () => mergeDaily(contaRecebido, contaReceber, 'recebido', 'receber'),
+    [contaRecebido, contaReceber]
   )
-  const pipelineGanhasStats = useMemo(
-    () => computeDailyStats(pipelineDaily.map(point => ({ date: point.date, value: point.ganhas }))),
-    [pipelineDaily]
+  const pipelineDaily = useMemo<PipelineDailyPoint[]>(
+    () => mergeDaily(pipelineRecebidas, pipelineGanhas, 'recebidas', 'ganhas'),
+    [pipelineRecebidas, pipelineGanhas]
   )
 
-  const pipelineConversion = useMemo(() => {
-    const totalRecebidas = pipelineRecebidasStats.total
-    const totalGanhas = pipelineGanhasStats.total
-    if (!totalRecebidas) return 0
-    return (totalGanhas / totalRecebidas) * 100
-  }, [pipelineRecebidasStats.total, pipelineGanhasStats.total])
-
-  const isLoading =
-    metaAdsQuery.isLoading ||
-    googleAdsQuery.isLoading ||
-    contaAzulQuery.isLoading ||
-    piperunQuery.isLoading
-
-  const hasError =
-    metaAdsQuery.isError ||
-    googleAdsQuery.isError ||
-    contaAzulQuery.isError ||
-    piperunQuery.isError
-
-  const metaStats = useMemo(() => computeDailyStats(metaDaily), [metaDaily])
-  const googleStats = useMemo(() => computeDailyStats(googleDaily), [googleDaily])
-  const metaDeltaAvg = metaStats.last ? computeDeltaPercent(metaStats.last.value, metaStats.average) : null
-  const metaDeltaPrev =
-    metaStats.last && metaStats.previous ? computeDeltaPercent(metaStats.last.value, metaStats.previous.value) : null
-  const googleDeltaAvg = googleStats.last
-    ? computeDeltaPercent(googleStats.last.value, googleStats.average)
-    : null
-  const googleDeltaPrev =
-    googleStats.last && googleStats.previous
-      ? computeDeltaPercent(googleStats.last.value, googleStats.previous.value)
-      : null
-  const pipelineDeltaPrev =
-    pipelineRecebidasStats.last && pipelineRecebidasStats.previous
-      ? computeDeltaPercent(pipelineRecebidasStats.last.value, pipelineRecebidasStats.previous.value)
-      : null
+  const metaStats = toStats(metaLeads)
+  const googleStats = toStats(googleLeads)
+  const contaRecebidoStats = toStats(contaRecebido)
+  const contaReceberStats = toStats(contaReceber)
+  const pipelineRecebidasStats = toStats(pipelineRecebidas)
+  const pipelineGanhasStats = toStats(pipelineGanhas)
+  const contaLatest = metrics.conta_azul?.latest?.values ?? null
+
+  const pipelineConversion = pipelineRecebidasStats.total
+    ? (pipelineGanhasStats.total / pipelineRecebidasStats.total) * 100
+    : 0
+
+  const isLoading = reportQuery.isLoading
+  const hasError = reportQuery.isError && !report
+
+  const metaDeltaAvg = metaLeads?.deltaAverage ?? null
+  const metaDeltaPrev = metaLeads?.deltaPreviousDay ?? null
+  const googleDeltaAvg = googleLeads?.deltaAverage ?? null
+  const googleDeltaPrev = googleLeads?.deltaPreviousDay ?? null
+  const pipelineDeltaPrev = pipelineRecebidas?.deltaPreviousDay ?? null
 
   return (
     <div className="min-h-screen bg-bg text-text px-4 sm:px-6 lg:px-8 py-6">
@@ -11,10 +11,63 @@ export type SystemKey =
   | 'n8n'
   | 'evolution'
 
+// stale/age: resposta servida do último valor bom (idade em segundos) durante uma falha do banco
+export type StaleMarker = { stale?: boolean; age?: number }
+
 export type KpisResponse = {
   values: Array<number | null>
   updatedAt: string
-}
+} & StaleMarker
 
 export type SeriesPoint = { x: string; y: number }
-export type SeriesResponse = { points: SeriesPoint[]; label: string }
+export type SeriesResponse = { points: SeriesPoint[]; label: string } & StaleMarker
+
+// Respostas de /api/kpis e /api/series com `filtro` repetido, separadas por valor de filtro_col
+export type GroupedKpisResponse = { groups: Record<string, KpisResponse | { error: string }> }
+export type GroupedSeriesResponse = { groups: Record<string, SeriesResponse> }
+
+export type DashboardSystemResult =
+  | ({ kpis: KpisResponse; series: SeriesResponse } & StaleMarker)
+  | { error: string }
+export type DashboardResponse = { systems: Partial<Record<SystemKey, DashboardSystemResult>> }
+
+export type AggregateParams = {
+  groupBy?: string[]
+  metrics: string[]
+  dateFrom?: string
+  dateTo?: string
+  filters?: Record<string, string | string[]>
+  facets?: string[]
+  orderBy?: string
+  limit?: number
+}
+export type AggregateResponse = {
+  rows: Array<Record<string, string | number | null>>
+  facets: Record<string, string[]>
+}
+
+// Relatório mensal consolidado (/api/report/monthly)
+export type ReportDailyValue = { date: string; value: number }
+export type ReportMetric = {
+  total: number
+  average: number
+  days: number
+  daily: ReportDailyValue[]
+  last: ReportDailyValue | null
+  previousDay: ReportDailyValue | null
+  best: ReportDailyValue | null
+  worst: ReportDailyValue | null
+  deltaPreviousDay: number | null
+  deltaAverage: number | null
+  previousMonth: { month: string; total: number; average: number; days: number } | null
+  deltaMonth: number | null
+}
+export type ReportSystem = {
+  metrics: Record<string, ReportMetric>
+  latest?: { date: string; values: Record<string, number | null> } | null
+}
+export type MonthlyReportResponse = {
+  months: string[]
+  month: string | null
+  systems: Record<string, ReportSystem>
+} & StaleMarker